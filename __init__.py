@@ -1,3 +1,4 @@
 from .src.cpu import cpu, rv_cpu
 from .src.control import control, control_zbkb
-from .src.program import Program
+from .src.program import Program, Session
+from .src.iss import ISS
@@ -0,0 +1,236 @@
+import fnmatch, io, json, multiprocessing, platform, sys, time
+from importlib import metadata
+
+import pyrtl
+import generate_cpu, generate_ir
+from design_cache import sources_hash
+from src import rv_cpu
+from src.alu import alu_decomp_large, alu_zbkc
+from src.profiler import Profiler
+
+# The benchmarked circuits, as (name, generator, arguments). Each is elaborated,
+# synthesized and emitted as IR in a fresh process.
+CASES = (
+    [("alu_decomp_large_{}".format(bw), "alu_decomp_large", (bw,)) for bw in (8, 16, 32)]
+    + [("alu_zbkc", "alu_zbkc", (32,))]
+    + [
+        ("rv_cpu_{}_{}".format(stages, isa), "rv_cpu", (stages, isa))
+        for stages in (1, 2, 3, 5) for isa in ("i", "b", "c")
+    ]
+)
+
+# Slack on the comparison with a baseline: a phase regresses when it is both
+# TOLERANCE slower (or uses that much more memory) and MIN_SECONDS (MIN_BYTES)
+# worse, so the noise of short phases doesn't fail the comparison
+TOLERANCE = 0.25
+MIN_SECONDS = 0.1
+MIN_BYTES = 1 << 20
+
+
+def _elaborate_alu(generator, bw):
+    op = pyrtl.Input(bitwidth=5, name="op")
+    in1 = pyrtl.Input(bitwidth=bw, name="in1")
+    in2 = pyrtl.Input(bitwidth=bw, name="in2")
+    out = pyrtl.Output(bitwidth=bw, name="out")
+    if generator == "alu_zbkc":
+        out <<= alu_zbkc(op, in1, in2)
+    else:
+        out <<= alu_decomp_large(op, in1, in2, bw)
+
+
+# Builds one case in the working block, profiling each phase. Returns its
+# result: the phases, and the size of the final block (or the error).
+def _run_case(case):
+    name, generator, args = case
+    pyrtl.reset_working_block()
+    profiler = Profiler()
+    result = {"case": name}
+    try:
+        with profiler.phase("elaborate"):
+            if generator == "rv_cpu":
+                stages, isa = args
+                rv_cpu(num_stages=stages, isa=isa)
+            else:
+                _elaborate_alu(generator, *args)
+        passes = generate_cpu.PASSES if generator == "rv_cpu" else ("synthesize",)
+        for pass_name in passes:
+            with profiler.phase(pass_name):
+                getattr(pyrtl, pass_name)()
+        with profiler.phase("generate_ir"):
+            with io.StringIO() as f:
+                generate_ir.write_ir(pyrtl.working_block(), f)
+        block = pyrtl.working_block()
+        result.update(wires=len(block.wirevector_set), gates=len(block.logic))
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["phases"] = profiler.phases
+    return result
+
+
+def _best(results):
+    """Merges the results of repeated runs of a case: the fastest time and
+    lowest peak of each phase."""
+    best = dict(results[0], phases=[dict(p) for p in results[0]["phases"]])
+    for result in results[1:]:
+        for phase, other in zip(best["phases"], result["phases"]):
+            phase["seconds"] = min(phase["seconds"], other["seconds"])
+            phase["peak_bytes"] = min(phase["peak_bytes"], other["peak_bytes"])
+    return best
+
+
+def select(patterns):
+    """The cases whose names match any of the comma-separated glob patterns."""
+    patterns = patterns.split(",")
+    return [case for case in CASES if any(fnmatch.fnmatchcase(case[0], p) for p in patterns)]
+
+
+def run(cases=CASES, repeat=1, processes=1):
+    """Runs the benchmark.
+
+    Every run of a case gets its own process, so it starts from an empty
+    working block and its memory peak isn't inflated by the cases before it.
+    Use more than one process only to get quick numbers: cases running side by
+    side slow each other down.
+
+    :param cases: the cases to run (see `CASES`)
+    :param repeat: how many times to run each case, keeping its best numbers
+    :param processes: how many cases to run at a time
+    :return: the results, as a JSON-serializable dict
+    """
+    jobs = [case for case in cases for _ in range(repeat)]
+    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+        runs = pool.map(_run_case, jobs, chunksize=1)
+    results = dict()
+    for result in runs:
+        results.setdefault(result["case"], []).append(result)
+    return {
+        "info": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "pyrtl": metadata.version("pyrtl"),
+            "machine": platform.machine(),
+            "sources": sources_hash(),
+            "repeat": repeat,
+        },
+        "cases": {name: _best(case_runs) for name, case_runs in results.items()},
+    }
+
+
+def compare(old, new, tolerance=TOLERANCE, min_seconds=MIN_SECONDS, min_bytes=MIN_BYTES):
+    """Compares benchmark results against a baseline.
+
+    :param old: the baseline results, as written by `run`
+    :param new: the results to check
+    :param tolerance: relative slack on time and memory
+    :param min_seconds: absolute slack on time
+    :param min_bytes: absolute slack on memory
+    :return: (table lines, regression messages)
+    """
+    lines = ["{:<22} {:<20} {:>9} {:>9} {:>8} {:>9} {:>9}".format(
+        "case", "phase", "old s", "new s", "change", "old MB", "new MB"
+    )]
+    regressions = []
+    for name, result in new["cases"].items():
+        baseline = old["cases"].get(name)
+        if baseline is None:
+            continue
+        if "error" in result and "error" not in baseline:
+            regressions.append("{}: now fails ({})".format(name, result["error"]))
+            continue
+        before = {p["phase"]: p for p in baseline["phases"]}
+        for phase in result["phases"]:
+            if phase["phase"] not in before:
+                continue
+            old_s, new_s = before[phase["phase"]]["seconds"], phase["seconds"]
+            old_peak, new_peak = before[phase["phase"]]["peak_bytes"], phase["peak_bytes"]
+            lines.append("{:<22} {:<20} {:>9.3f} {:>9.3f} {:>8} {:>9.1f} {:>9.1f}".format(
+                name, phase["phase"], old_s, new_s,
+                "{:+.0%}".format(new_s / old_s - 1) if old_s else "-",
+                old_peak / (1 << 20), new_peak / (1 << 20),
+            ))
+            if new_s > old_s * (1 + tolerance) and new_s - old_s > min_seconds:
+                regressions.append("{} {}: {:.3f}s -> {:.3f}s".format(name, phase["phase"], old_s, new_s))
+            if new_peak > old_peak * (1 + tolerance) and new_peak - old_peak > min_bytes:
+                regressions.append("{} {}: peak {:.1f} MB -> {:.1f} MB".format(
+                    name, phase["phase"], old_peak / (1 << 20), new_peak / (1 << 20)
+                ))
+    return lines, regressions
+
+
+def format_results(results):
+    """Formats the results of `run` as a table."""
+    lines = ["{:<22} {:>8} {:>8} {:>11} {:>11} {:>9} {:>9}".format(
+        "case", "wires", "gates", "elaborate s", "synth s", "ir s", "peak MB"
+    )]
+    for name, result in results["cases"].items():
+        if "error" in result:
+            lines.append("{:<22}  failed: {}".format(name, result["error"]))
+            continue
+        seconds = {p["phase"]: p["seconds"] for p in result["phases"]}
+        lines.append("{:<22} {:>8} {:>8} {:>11.3f} {:>11.3f} {:>9.3f} {:>9.1f}".format(
+            name, result["wires"], result["gates"], seconds["elaborate"], seconds["synthesize"],
+            seconds["generate_ir"], max(p["peak_bytes"] for p in result["phases"]) / (1 << 20),
+        ))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(
+        "Benchmark elaborating, synthesizing and emitting the IR of the ALUs and CPUs, "
+        "and compare the results against a baseline."
+    )
+    parser.add_argument(
+        "-c", "--cases", type=str, default="*",
+        help="comma-separated glob patterns of the cases to run (default: all; see --list)"
+    )
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="runs of each case, keeping the best")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="cases to run at a time")
+    parser.add_argument("-o", "--out", type=str, metavar="PATH", help="write the results to this JSON file")
+    parser.add_argument(
+        "-b", "--baseline", type=str, metavar="PATH",
+        help="compare against these results, exiting with status 1 on any regression"
+    )
+    parser.add_argument(
+        "--compare", type=str, metavar="PATH",
+        help="compare these results against --baseline instead of running the benchmark"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=TOLERANCE,
+        help="relative slowdown or memory growth allowed (default: %(default)s)"
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        for name, _, _ in CASES:
+            print(name)
+        sys.exit(0)
+
+    if args.compare:
+        with open(args.compare) as f:
+            results = json.load(f)
+    else:
+        cases = select(args.cases)
+        if not cases:
+            parser.error("no case matches {}".format(args.cases))
+        results = run(cases, args.repeat, args.processes)
+        print(format_results(results))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(baseline, results, args.tolerance)
+        print()
+        print("\n".join(lines))
+        if regressions:
+            print("\n{} regression(s) against {}:".format(len(regressions), args.baseline), file=sys.stderr)
+            for regression in regressions:
+                print("  " + regression, file=sys.stderr)
+            sys.exit(1)
+    elif args.compare:
+        parser.error("--compare needs a --baseline")
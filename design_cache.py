@@ -0,0 +1,157 @@
+import hashlib, json, os, time
+from importlib import metadata
+from os.path import dirname, expanduser, getmtime, getsize, join
+
+from ir import Netlist
+
+ROOT = dirname(__file__)
+
+# Everything that the netlist of a design is derived from, besides its options
+SOURCES = ("src", "ir.py")
+
+DEFAULT_DIR = join(os.environ.get("XDG_CACHE_HOME", expanduser("~/.cache")), "rv-cpu-netlists")
+
+
+def sources_hash():
+    """Hash of the contents of every Python source the designs are built from."""
+    digest = hashlib.sha256()
+    for source in SOURCES:
+        path = join(ROOT, source)
+        files = [path] if source.endswith(".py") else sorted(
+            join(d, f) for d, _, fs in os.walk(path) for f in fs if f.endswith(".py")
+        )
+        for file in files:
+            digest.update(os.path.relpath(file, ROOT).encode() + b"\0")
+            with open(file, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class DesignCache:
+    """A content-addressed cache of the netlists of elaborated designs.
+
+    Entries are keyed on the design options (number of stages, ISA, the passes
+    run over it, ...) together with a hash of the sources in `SOURCES` and the
+    PyRTL version, so any change to the CPU invalidates them. Each entry is the
+    netlist in the binary IR format (see `ir.Netlist.save`) plus a JSON file of
+    information about it. Entries older than `max_age` are dropped, then the
+    least recently used ones until the cache fits in `max_bytes`.
+
+    :param directory: where to keep the entries
+    :param max_bytes: size limit of the cache
+    :param max_age: age limit of the entries, in seconds
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=512 << 20, max_age=30 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._sources = None
+
+    def key(self, **options):
+        """The key of the design built with `options`."""
+        if self._sources is None:
+            self._sources = sources_hash()
+        description = dict(options, sources=self._sources, pyrtl=metadata.version("pyrtl"))
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _paths(self, key):
+        return join(self.directory, key + ".oyir"), join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Loads an entry.
+
+        :param key: the key of the entry
+        :return: (Netlist, info) or None if it is not cached
+        """
+        netlist_path, info_path = self._paths(key)
+        try:
+            with open(info_path) as f:
+                info = json.load(f)
+            netlist = Netlist.load(netlist_path)
+        except (OSError, ValueError):
+            return None
+        os.utime(netlist_path)  # for least recently used eviction
+        return netlist, info
+
+    def put(self, key, netlist, info=None):
+        """Stores an entry, then evicts entries as needed.
+
+        :param key: the key of the entry
+        :param netlist: the Netlist
+        :param info: JSON-serializable information to keep with it
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        netlist_path, info_path = self._paths(key)
+        # Written under temporary names first, so concurrent readers never see
+        # half of an entry
+        suffix = ".{}.tmp".format(os.getpid())
+        netlist.save(netlist_path + suffix)
+        with open(info_path + suffix, "w") as f:
+            json.dump(info if info is not None else {}, f)
+        os.replace(info_path + suffix, info_path)
+        os.replace(netlist_path + suffix, netlist_path)
+        self.evict()
+
+    def entries(self):
+        """The entries, as a list of (key, size in bytes, last use time)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if name.endswith(".oyir"):
+                key = name[: -len(".oyir")]
+                try:
+                    size = sum(getsize(path) for path in self._paths(key))
+                    entries.append((key, size, getmtime(self._paths(key)[0])))
+                except OSError:  # removed or half written by another process
+                    continue
+        return entries
+
+    def remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Removes the entries past the age limit, then the least recently used
+        ones until the cache is within its size limit.
+
+        :return: number of entries removed
+        """
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for key, size, used in entries:
+            if now - used <= self.max_age and total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        for key, _, _ in self.entries():
+            self.remove(key)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser("Inspect or clear the cache of design netlists.")
+    parser.add_argument("--dir", type=str, default=DEFAULT_DIR, help="cache directory")
+    parser.add_argument("--clear", action="store_true", help="remove every entry")
+    args = parser.parse_args()
+
+    cache = DesignCache(args.dir)
+    if args.clear:
+        cache.clear()
+    entries = cache.entries()
+    for key, size, used in sorted(entries, key=lambda entry: entry[2]):
+        print("{}  {:>8} KB  {}".format(key[:16], size // 1024, time.ctime(used)))
+    print("{} entries, {} KB in {}".format(len(entries), sum(e[1] for e in entries) // 1024, args.dir))
@@ -1,5 +1,7 @@
 import pyrtl, sys, io
-from .src import alu_decomp_small, alu_decomp_large
+import generate_ir, ir, ir_sim
+from src import alu_decomp_small, alu_decomp_large, breakdown
+from src.profiler import Profiler
 
 def alu_small_builder():
     op = pyrtl.Input(bitwidth=5, name="op")
@@ -34,7 +36,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--opt", default=False, action=BooleanOptionalAction, help="run PyRTL optimize (default: no)"
     )
+    parser.add_argument(
+        "--breakdown", type=str, metavar="PATH", help="write the area and timing breakdown to this JSON file"
+    )
+    parser.add_argument(
+        "--check", type=int, metavar="N", help="check the output against the unoptimized design on N random vectors (needs NumPy)"
+    )
+    parser.add_argument(
+        "--profile", type=str, metavar="PATH",
+        help="time each phase, with its peak memory and net/wire counts, and write them to this JSON file"
+    )
     args = parser.parse_args()
+    profiler = Profiler(enabled=args.profile is not None)
 
     alu_size = args.size if args.size is not None else 's'
     alu_output = args.output if args.output is not None else 'v'
@@ -45,37 +58,70 @@ if __name__ == "__main__":
     elif alu_size == 'l':
         bwidth = 32
 
-    op = pyrtl.Input(bitwidth=5, name="op")
-    in1 = pyrtl.Input(bitwidth=bwidth, name="in1")
-    in2 = pyrtl.Input(bitwidth=bwidth, name="in2")
-    out = pyrtl.Output(bitwidth=bwidth, name="out")
+    with profiler.phase("elaborate"):
+        op = pyrtl.Input(bitwidth=5, name="op")
+        in1 = pyrtl.Input(bitwidth=bwidth, name="in1")
+        in2 = pyrtl.Input(bitwidth=bwidth, name="in2")
+        out = pyrtl.Output(bitwidth=bwidth, name="out")
 
-    if alu_size == 's':
-        alu_out = alu_decomp_small(op, in1, in2)
-        out <<= alu_out
-    elif alu_size in ('m', 'l'):
-        alu_out = alu_decomp_large(op, in1, in2, bwidth)
-        out <<= alu_out
+        if alu_size == 's':
+            alu_out = alu_decomp_small(op, in1, in2)
+            out <<= alu_out
+        elif alu_size in ('m', 'l'):
+            alu_out = alu_decomp_large(op, in1, in2, bwidth)
+            out <<= alu_out
+
+    if args.breakdown:
+        breakdown.label()
+
+    if args.check:
+        reference = ir.Netlist.from_block(pyrtl.working_block())
 
     if args.synth:
-        pyrtl.synthesize()
+        with profiler.phase("synthesize"):
+            pyrtl.synthesize()
     if args.opt:
         # pyrtl.optimize()
-        pyrtl.passes._remove_wire_nets(pyrtl.working_block())
+        with profiler.phase("_remove_wire_nets"):
+            pyrtl.passes._remove_wire_nets(pyrtl.working_block())
         # pyrtl.passes._remove_slice_nets(pyrtl.working_block())
-        pyrtl.passes.constant_propagation(pyrtl.working_block(), True)
+        with profiler.phase("constant_propagation"):
+            pyrtl.passes.constant_propagation(pyrtl.working_block(), True)
         # pyrtl.passes._remove_unlistened_nets(pyrtl.working_block())
         # pyrtl.passes.common_subexp_elimination(pyrtl.working_block())
 
     if alu_output == 'o':
-        import generate_ir
-        design_out = generate_ir.generate_ir(pyrtl.working_block())
-        print(design_out)
+        with profiler.phase("generate_ir"):
+            generate_ir.write_ir(pyrtl.working_block(), sys.stdout)
+            print()
     elif alu_output == 'v':
-        with io.StringIO() as vfile:
-            pyrtl.output_to_verilog(vfile)
-            print(vfile.getvalue())
+        with profiler.phase("output_to_verilog"):
+            with io.StringIO() as vfile:
+                pyrtl.output_to_verilog(vfile)
+                print(vfile.getvalue())
 
     print("// wires: {}, gates: {}".format(
         len(pyrtl.working_block().wirevector_set),
         len(pyrtl.working_block().logic)))
+
+    if args.breakdown:
+        report = breakdown.breakdown()
+        breakdown.write_breakdown(report, args.breakdown)
+        print("\n".join("// " + line for line in breakdown.format_breakdown(report).splitlines()))
+
+    mismatches = []
+    if args.check:
+        mismatches = ir_sim.compare(reference, ir.Netlist.from_block(pyrtl.working_block()), args.check)
+        for output, vector, expected, actual in mismatches[:10]:
+            print("// mismatch: {} is {} instead of {} for {}".format(output, actual, expected, vector))
+        if mismatches:
+            print("// {} mismatches in the first batch of vectors with any".format(len(mismatches)))
+        else:
+            print("// checked {} vectors: no mismatches".format(args.check))
+
+    if args.profile:
+        profiler.write(args.profile, size=alu_size, output=alu_output, synth=args.synth, opt=args.opt)
+        print("\n".join("// " + line for line in profiler.report().splitlines()))
+
+    if mismatches:
+        sys.exit(1)
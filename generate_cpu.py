@@ -1,6 +1,120 @@
-import pyrtl, sys, io
-import generate_ir
-from src import rv_cpu
+import pyrtl, sys, io, multiprocessing, os, time
+import ir, ir_opt
+from design_cache import DesignCache, DEFAULT_DIR
+from src import rv_cpu, breakdown
+from src.cache import CacheConfig
+from src.profiler import Profiler
+
+# The PyRTL passes run over the CPU before generating its IR
+PASSES = ("optimize", "synthesize")
+
+
+# Elaborates the CPU, runs the PASSES and returns its ir.Netlist along with the
+# wire and gate counts of the final block. With a DesignCache, a netlist built
+# from the same sources and options is reused instead. With labeled, the wires
+# are labeled with their subsystem first (see src/breakdown.py) and the final
+# block is left as the working block.
+def build(
+    num_stages=1,
+    extension='i',
+    counters=False,
+    cache=None,
+    labeled=False,
+    profiler=None,
+    predictor=0,
+    icache=None,
+    dcache=None,
+):
+    profiler = profiler if profiler is not None else Profiler(enabled=False)
+    if cache is not None:
+        key = cache.key(
+            stages=num_stages,
+            isa=extension,
+            counters=counters,
+            passes=PASSES,
+            predictor=predictor,
+            icache=str(icache) if icache else None,
+            dcache=str(dcache) if dcache else None,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    pyrtl.reset_working_block()
+    with profiler.phase("elaborate"):
+        rv_cpu(
+            num_stages=num_stages,
+            isa=extension,
+            counters=counters,
+            predictor=predictor,
+            icache=icache,
+            dcache=dcache,
+        )
+    if labeled:
+        breakdown.label()
+    for name in PASSES:
+        with profiler.phase(name):
+            getattr(pyrtl, name)()
+
+    block = pyrtl.working_block()
+    with profiler.phase("generate_ir"):
+        netlist = ir.Netlist.from_block(block)
+    info = {"wires": len(block.wirevector_set), "gates": len(block.logic)}
+    if cache is not None:
+        cache.put(key, netlist, info)
+    return netlist, info
+
+
+# Builds one configuration of a batch and writes its IR (and Verilog) files, in
+# a worker process with its own working block. Returns its row of the summary.
+def _generate_config(job):
+    num_stages, extension, counters, out_dir, verilog, cache_dir = job
+    row = {"stages": num_stages, "ext": extension}
+    start = time.perf_counter()
+    try:
+        cache = DesignCache(cache_dir) if cache_dir is not None else None
+        netlist, info = build(num_stages, extension, counters, cache)
+        base = os.path.join(out_dir, "cpu_{}_{}".format(num_stages, extension))
+        with open(base + ".oyster", "w") as f:
+            for chunk in netlist.iter_text():
+                f.write(chunk)
+            f.write("\n")
+        if verilog:
+            pyrtl.reset_working_block()
+            netlist.to_block()
+            with open(base + ".v", "w") as f:
+                pyrtl.output_to_verilog(f)
+        row.update(info, statements=len(netlist))
+    except Exception as e:
+        row["error"] = "{}: {}".format(type(e).__name__, e)
+    row["seconds"] = round(time.perf_counter() - start, 2)
+    return row
+
+
+# Generates every combination of stages and extensions across a pool of worker
+# processes, slowest (Zbkc) first, and returns the summary rows in order
+def generate_batch(stages, extensions, out_dir, counters=False, verilog=False, cache_dir=None, processes=None):
+    os.makedirs(out_dir, exist_ok=True)
+    order = {'c': 0, 'b': 1, 'i': 2}
+    jobs = sorted(
+        [(s, e, counters, out_dir, verilog, cache_dir) for s in stages for e in extensions],
+        key=lambda job: (order.get(job[1], 3), job[0]),
+    )
+    with multiprocessing.Pool(processes) as pool:
+        rows = list(pool.imap_unordered(_generate_config, jobs, chunksize=1))
+    return sorted(rows, key=lambda row: (row["stages"], extensions.index(row["ext"])))
+
+
+# Formats the summary rows of generate_batch as a table
+def summary_table(rows):
+    lines = ["{:>6} {:>3} {:>8} {:>8} {:>10} {:>8}".format("stages", "ext", "wires", "gates", "statements", "seconds")]
+    for row in rows:
+        if "error" in row:
+            lines.append("{:>6} {:>3}  failed: {}".format(row["stages"], row["ext"], row["error"]))
+        else:
+            lines.append("{stages:>6} {ext:>3} {wires:>8} {gates:>8} {statements:>10} {seconds:>8}".format(**row))
+    return "\n".join(lines)
+
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
@@ -8,24 +122,124 @@ if __name__ == "__main__":
     # Take in number of pipeline stages as an argument
     parser = ArgumentParser()
     parser.add_argument(
-        "-s", "--stages", type=int, dest="stages", help="number of pipeline stages"
+        "-s", "--stages", type=str, dest="stages",
+        help="number of pipeline stages (comma-separated list with --out-dir, default: all)"
+    )
+    parser.add_argument(
+        "-e", "--ext", type=str, dest="extension",
+        help="ISA extension rv(i), zbk(b), zbk(c) (comma-separated list with --out-dir, default: all)"
+    )
+    parser.add_argument(
+        "--out-dir", type=str, dest="out_dir",
+        help="generate every combination of --stages and --ext in parallel, into this directory"
+    )
+    parser.add_argument(
+        "--verilog", action="store_true", help="with --out-dir, also write Verilog for each configuration"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, dest="jobs", help="with --out-dir, number of worker processes (default: all cores)"
     )
     parser.add_argument(
-        "-e", "--ext", type=str, dest="extension", help="ISA extension rv(i), zbk(b), zbk(c)"
+        "--counters", action="store_true", help="include the performance counters"
+    )
+    parser.add_argument(
+        "--predictor", type=int, default=0,
+        help="number of entries of the branch predictor (3 stages only, default: none)"
+    )
+    parser.add_argument(
+        "--icache", type=CacheConfig.argument, metavar="SETS[xWAYS[xWORDS]][:lru|plru]",
+        help="geometry of the instruction cache, e.g. 16x2x4:plru (3 stages only, default: none)"
+    )
+    parser.add_argument(
+        "--dcache", type=CacheConfig.argument, metavar="SETS[xWAYS[xWORDS]][:lru|plru]",
+        help="geometry of the write-back data cache, e.g. 16x2x4 (3 stages only, default: none)"
+    )
+    parser.add_argument(
+        "--binary", type=str, metavar="PATH", help="also save the netlist in the binary IR format"
+    )
+    parser.add_argument(
+        "--opt-ir", action="store_true", dest="opt_ir",
+        help="optimize the IR (see ir_opt.py) and report the savings on stderr"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, dest="cache_dir", default=DEFAULT_DIR,
+        help="where to cache synthesized netlists (default: {})".format(DEFAULT_DIR)
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", dest="no_cache", help="always elaborate and synthesize the CPU"
+    )
+    parser.add_argument(
+        "--breakdown", type=str, metavar="PATH",
+        help="write the area and timing of each subsystem to this JSON file (bypasses the cache)"
+    )
+    parser.add_argument(
+        "--profile", type=str, metavar="PATH",
+        help="time each phase, with its peak memory and net/wire counts, and write them to this JSON file"
+        " (bypasses the cache; see src/profiler.py to compare two profiles)"
     )
     args = parser.parse_args()
 
-    num_stages = args.stages if args.stages is not None else 1
-    extension = args.extension if args.extension is not None else 'i'
+    cache_dir = None if args.no_cache else args.cache_dir
+    if args.out_dir is not None:
+        stages = [int(s) for s in args.stages.split(",")] if args.stages else [1, 2, 3, 5]
+        extensions = args.extension.split(",") if args.extension else ['i', 'b', 'c']
+        start = time.perf_counter()
+        rows = generate_batch(
+            stages, extensions, args.out_dir, args.counters, args.verilog, cache_dir, args.jobs
+        )
+        print(summary_table(rows))
+        print("{} configurations in {:.1f}s".format(len(rows), time.perf_counter() - start))
+        sys.exit(1 if any("error" in row for row in rows) else 0)
 
-    rv_cpu(num_stages=num_stages, isa=extension)
+    num_stages = int(args.stages) if args.stages is not None else 1
+    extension = args.extension if args.extension is not None else 'i'
 
-    pyrtl.optimize()
-    pyrtl.synthesize()
-    # pyrtl.optimize()
+    profiler = Profiler(enabled=args.profile is not None)
+    cache = None if cache_dir is None or args.breakdown or args.profile else DesignCache(cache_dir)
+    netlist, info = build(
+        num_stages,
+        extension,
+        args.counters,
+        cache,
+        labeled=bool(args.breakdown),
+        profiler=profiler,
+        predictor=args.predictor,
+        icache=args.icache,
+        dcache=args.dcache,
+    )
+    if args.breakdown:
+        report = breakdown.breakdown()
+        report["config"] = {
+            "stages": num_stages,
+            "ext": extension,
+            "counters": args.counters,
+            "predictor": args.predictor,
+            "icache": str(args.icache) if args.icache else None,
+            "dcache": str(args.dcache) if args.dcache else None,
+        }
+        breakdown.write_breakdown(report, args.breakdown)
+        print(breakdown.format_breakdown(report), file=sys.stderr)
 
-    ir = generate_ir.generate_ir(pyrtl.working_block())
-    print(ir)
-    print("wires: {}, gates: {}".format(
-        len(pyrtl.working_block().wirevector_set),
-        len(pyrtl.working_block().logic)))
+    if args.opt_ir:
+        before = ir_opt.size(netlist)
+        with profiler.phase("ir_opt"):
+            netlist, removed = ir_opt.optimize(netlist)
+        print(ir_opt.report(before, ir_opt.size(netlist), removed), file=sys.stderr)
+    with profiler.phase("emit"):
+        for chunk in netlist.iter_text():
+            sys.stdout.write(chunk)
+        print()
+    if args.binary is not None:
+        netlist.save(args.binary)
+    print("wires: {}, gates: {}".format(info["wires"], info["gates"]))
+    if args.profile:
+        profiler.write(
+            args.profile,
+            stages=num_stages,
+            ext=extension,
+            counters=args.counters,
+            predictor=args.predictor,
+            icache=str(args.icache) if args.icache else None,
+            dcache=str(args.dcache) if args.dcache else None,
+        )
+        print(profiler.report(), file=sys.stderr)
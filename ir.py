@@ -0,0 +1,648 @@
+import pyrtl, re, struct, sys
+from array import array
+from enum import IntEnum
+
+
+class Kind:
+    """Kinds of declarations."""
+
+    INPUT = 0
+    OUTPUT = 1
+    REGISTER = 2
+    MEMORY = 3
+    ROM = 4
+    HOLE = 5  # an Input that is the hole of a sketch
+
+
+class Op(IntEnum):
+    """Statement operations, named after the Oyster IR keywords below."""
+
+    ASSIGN = 0
+    NOT = 1
+    AND = 2
+    OR = 3
+    XOR = 4
+    NAND = 5
+    ADD = 6
+    SUB = 7
+    MULT = 8
+    LT = 9
+    GT = 10
+    EQ = 11
+    MUX = 12
+    CONCAT = 13
+    SEL = 14
+    CONST = 15
+    READ = 16
+    WRITE = 17
+
+
+KEYWORDS = {
+    Op.ASSIGN: ':=',
+    Op.NOT: 'NOT',
+    Op.AND: 'AND',
+    Op.OR: 'OR',
+    Op.XOR: 'XOR',
+    Op.NAND: 'NAND',
+    Op.ADD: 'ADD-CARRY',
+    Op.SUB: 'SUB-CARRY',
+    Op.MULT: 'MULT',
+    Op.LT: 'LT',
+    Op.GT: 'GT',
+    Op.EQ: 'EQ',
+    Op.MUX: 'MUX',
+    Op.CONCAT: 'CONCAT',
+    Op.SEL: 'SEL',
+    Op.CONST: 'CONST',
+    Op.READ: 'READ',
+    Op.WRITE: 'WRITE',
+}
+
+OPS = {keyword: op for op, keyword in KEYWORDS.items()}
+
+# PyRTL net ops that map directly to an Op over the same arguments
+NET_OPS = {
+    'w': Op.ASSIGN,
+    '~': Op.NOT,
+    '&': Op.AND,
+    '|': Op.OR,
+    '^': Op.XOR,
+    'n': Op.NAND,
+    '+': Op.ADD,
+    '-': Op.SUB,
+    '*': Op.MULT,
+    '<': Op.LT,
+    '>': Op.GT,
+    '=': Op.EQ,
+    'x': Op.MUX,
+    'c': Op.CONCAT,
+}
+
+
+def bitwidth(op, widths, params):
+    """The bitwidth of the result of a statement (other than READ and WRITE).
+
+    :param op: the Op of the statement
+    :param widths: bitwidths of its operands
+    :param params: its parameters
+    :return: the bitwidth of its destination
+    """
+    if op in (Op.LT, Op.GT, Op.EQ):
+        return 1
+    elif op in (Op.ADD, Op.SUB):
+        return max(widths) + 1
+    elif op in (Op.MULT, Op.CONCAT):
+        return sum(widths)
+    elif op == Op.MUX:
+        return widths[1]
+    elif op in (Op.SEL, Op.CONST):
+        return len(params) if op == Op.SEL else params[0]
+    return widths[0]
+
+
+class Decl:
+    """A declared variable: an input, output, register, memory or ROM.
+
+    :param id: the variable id
+    :param kind: one of the `Kind` constants
+    :param bitwidth: bitwidth of the variable (of each word, for memories)
+    :param name: name of the variable
+    :param reset: reset value of a register
+    :param addrwidth: address width of a memory
+    :param data: contents of a ROM (None if they are a hole)
+    :param args: operands of a hole
+    """
+
+    __slots__ = ("id", "kind", "bitwidth", "name", "reset", "addrwidth", "data", "args")
+
+    def __init__(self, id, kind, bitwidth, name, reset=0, addrwidth=0, data=None, args=()):
+        self.id = id
+        self.kind = kind
+        self.bitwidth = bitwidth
+        self.name = name
+        self.reset = reset
+        self.addrwidth = addrwidth
+        self.data = data
+        self.args = list(args)
+
+
+class Statement:
+    """A view of one row of the statement table of a `Netlist`.
+
+    `args` are operands: a variable id, or a constant for negative values (see
+    `Netlist.const`). `params` are the selected bits of SEL and the bitwidth of
+    CONST, whose value is bit 0 of its operand replicated (see `from_block`).
+    """
+
+    __slots__ = ("op", "dest", "args", "params")
+
+    def __init__(self, op, dest, args, params):
+        self.op = op
+        self.dest = dest
+        self.args = args
+        self.params = params
+
+
+class Netlist:
+    """A PyRTL block as an Oyster IR netlist.
+
+    Variables have integer ids. Statements live in flat arrays: one row per
+    statement in `ops`/`dests`, with the operands and parameters of row i at
+    `args[arg_start[i]:arg_start[i + 1]]` and `params[param_start[i]:param_start[i + 1]]`.
+    Constants are interned in `const_values`/`const_widths`, and the operand
+    -(k + 1) refers to constant k.
+
+    :param name: name of the block
+    """
+
+    def __init__(self, name="sketch"):
+        self.name = name
+        self.num_ids = 0
+        self.decls = []  # in declaration order
+        self.const_values = []
+        self.const_widths = array('i')
+        self._consts = {}  # (value, bitwidth) -> operand
+        self.ops = array('B')
+        self.dests = array('i')
+        self.arg_start = array('i', [0])
+        self.args = array('i')
+        self.param_start = array('i', [0])
+        self.params = array('i')
+
+    def new_id(self):
+        self.num_ids += 1
+        return self.num_ids - 1
+
+    def const(self, value, bitwidth):
+        """The operand of a constant, interning it if needed."""
+        operand = self._consts.get((value, bitwidth))
+        if operand is None:
+            self.const_values.append(value)
+            self.const_widths.append(bitwidth)
+            operand = self._consts[(value, bitwidth)] = -len(self.const_values)
+        return operand
+
+    def add(self, op, dest, args, params=()):
+        """Appends a statement."""
+        self.ops.append(op)
+        self.dests.append(dest)
+        self.args.extend(args)
+        self.arg_start.append(len(self.args))
+        self.params.extend(params)
+        self.param_start.append(len(self.params))
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __getitem__(self, i):
+        return Statement(
+            Op(self.ops[i]),
+            self.dests[i],
+            self.args[self.arg_start[i] : self.arg_start[i + 1]],
+            self.params[self.param_start[i] : self.param_start[i + 1]],
+        )
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @classmethod
+    def from_block(cls, block, name="sketch"):
+        """Builds the netlist of a PyRTL block.
+
+        Ids are handed out to inputs, outputs, registers, memories and then the
+        destination of every net in topological order; registers are updated
+        and memories written after every other statement.
+
+        :param block: the block
+        :param name: name to give the netlist
+        :return: the Netlist
+        """
+        netlist = cls(name)
+        var = dict()  # wire name -> operand
+        holes = dict()  # hole input name -> Decl
+
+        inputs = block.wirevector_subset(pyrtl.Input)
+        for i in inputs:
+            var[i.name] = netlist.new_id()
+        for o in block.wirevector_subset(pyrtl.Output):
+            var[o.name] = netlist.new_id()
+            netlist.decls.append(Decl(var[o.name], Kind.OUTPUT, o.bitwidth, o.name))
+        for r in block.wirevector_subset(pyrtl.Register):
+            var[r.name] = netlist.new_id()
+            reset = r.reset_value if r.reset_value else 0
+            netlist.decls.append(Decl(var[r.name], Kind.REGISTER, r.bitwidth, r.name, reset))
+        for m in block.logic_subset('m@'):
+            mem = m.op_param[1]
+            if mem.name in var:
+                continue
+            var[mem.name] = netlist.new_id()
+            bitwidth = m.args[1].bitwidth if m.op == '@' else m.dests[0].bitwidth
+            addrwidth = m.args[0].bitwidth
+            if isinstance(mem, pyrtl.RomBlock):
+                data = None if callable(mem.data) else list(mem.data)
+                decl = Decl(var[mem.name], Kind.ROM, bitwidth, mem.name, addrwidth=addrwidth, data=data)
+            else:
+                decl = Decl(var[mem.name], Kind.MEMORY, bitwidth, mem.name, addrwidth=addrwidth)
+            netlist.decls.append(decl)
+        for c in block.wirevector_subset(pyrtl.Const):
+            var[c.name] = netlist.const(c.val, c.bitwidth)
+
+        for net in block:
+            if net.op in 'r@':  # added after every other statement
+                continue
+            for d in net.dests:
+                if d.name not in var:
+                    var[d.name] = netlist.new_id()
+            dest = var[net.dests[0].name] if net.dests else -1
+            args = [var[arg.name] for arg in net.args]
+
+            if net.op in NET_OPS:
+                netlist.add(NET_OPS[net.op], dest, args)
+            elif net.op == 'h':
+                hole = net.op_param + '_input'
+                holes[hole] = Decl(
+                    var[hole],
+                    Kind.HOLE,
+                    net.dests[0].bitwidth,
+                    net.op_param,
+                    args=[var[arg.name] for arg in net.args if arg.name != hole],
+                )
+                netlist.add(Op.ASSIGN, dest, [var[hole]])
+            elif net.op == 's':
+                # selecting only bit 0 of a constant, over and over: the CONST
+                # keeps the constant, as generate_ir.py always wrote it, and is
+                # that bit replicated, not the constant zero-extended
+                if all(i == 0 for i in net.op_param) and isinstance(net.args[0], pyrtl.Const):
+                    bits = len(net.op_param)
+                    netlist.add(Op.CONST, dest, [netlist.const(net.args[0].val, net.args[0].bitwidth)], [bits])
+                else:
+                    netlist.add(Op.SEL, dest, args, net.op_param)
+            elif net.op == 'm':
+                netlist.add(Op.READ, dest, [var[net.op_param[1].name]] + args)
+
+        for write in block.logic_subset('@'):
+            netlist.add(Op.WRITE, var[write.op_param[1].name], [var[arg.name] for arg in write.args])
+        for r in block.logic_subset('r'):
+            netlist.add(Op.ASSIGN, var[r.dests[0].name], [var[r.args[0].name]])
+
+        for i in inputs:
+            netlist.decls.append(holes.get(i.name) or Decl(var[i.name], Kind.INPUT, i.bitwidth, i.name))
+        return netlist
+
+    def to_block(self, block=None):
+        """Rebuilds the netlist as PyRTL logic.
+
+        Declarations keep their names, while every other wire is a temporary.
+        Holes become Inputs named like the ones `from_block` found them through,
+        and ROMs with unknown contents read as zero.
+
+        :param block: the block to add the logic to (defaults to the working block)
+        :return: the block
+        """
+        block = pyrtl.working_block(block)
+        wires = [None] * self.num_ids
+        mems = dict()  # id -> MemBlock or RomBlock
+        consts = dict()  # operand -> Const
+
+        for decl in self.decls:
+            if decl.kind == Kind.INPUT:
+                wires[decl.id] = pyrtl.Input(decl.bitwidth, decl.name, block=block)
+            elif decl.kind == Kind.OUTPUT:
+                wires[decl.id] = pyrtl.Output(decl.bitwidth, decl.name, block=block)
+            elif decl.kind == Kind.REGISTER:
+                wires[decl.id] = pyrtl.Register(
+                    decl.bitwidth, decl.name, reset_value=decl.reset if decl.reset else None, block=block
+                )
+            elif decl.kind == Kind.MEMORY:
+                mems[decl.id] = pyrtl.MemBlock(
+                    decl.bitwidth, decl.addrwidth, decl.name,
+                    max_read_ports=None, max_write_ports=None, asynchronous=True, block=block,
+                )
+            elif decl.kind == Kind.ROM:
+                mems[decl.id] = pyrtl.RomBlock(
+                    decl.bitwidth, decl.addrwidth, decl.data if decl.data is not None else [0],
+                    decl.name, max_read_ports=None, asynchronous=True, pad_with_zeros=True, block=block,
+                )
+            elif decl.kind == Kind.HOLE:
+                wires[decl.id] = pyrtl.Input(decl.bitwidth, decl.name + '_input', block=block)
+
+        def wire(operand):
+            if operand >= 0:
+                return wires[operand]
+            if operand not in consts:
+                k = -operand - 1
+                consts[operand] = pyrtl.Const(self.const_values[k], self.const_widths[k], block=block)
+            return consts[operand]
+
+        net_ops = {op: net_op for net_op, op in NET_OPS.items()}
+        for i in range(len(self)):
+            op, dest = self.ops[i], self.dests[i]
+            operands = self.args[self.arg_start[i] : self.arg_start[i + 1]]
+            params = tuple(self.params[self.param_start[i] : self.param_start[i + 1]])
+
+            if op == Op.WRITE:
+                mem = mems[dest]
+                args = tuple(wire(arg) for arg in operands)
+                block.add_net(pyrtl.LogicNet('@', (mem.id, mem), args, ()))
+                continue
+            elif op == Op.READ:
+                mem = mems[operands[0]]
+                if wires[dest] is None:
+                    wires[dest] = pyrtl.WireVector(mem.bitwidth, block=block)
+                net = pyrtl.LogicNet('m', (mem.id, mem), (wire(operands[1]),), (wires[dest],))
+                block.add_net(net)
+                continue
+
+            args = tuple(wire(arg) for arg in operands)
+            if wires[dest] is None:
+                wires[dest] = pyrtl.WireVector(bitwidth(op, [arg.bitwidth for arg in args], params), block=block)
+            if op == Op.ASSIGN and isinstance(wires[dest], pyrtl.Register):
+                net = pyrtl.LogicNet('r', None, args, (wires[dest],))
+            elif op == Op.SEL:
+                net = pyrtl.LogicNet('s', params, args, (wires[dest],))
+            elif op == Op.CONST:
+                value = -(self.const_values[-operands[0] - 1] & 1) & ((1 << params[0]) - 1)
+                net = pyrtl.LogicNet('w', None, (pyrtl.Const(value, params[0], block=block),), (wires[dest],))
+            else:
+                net = pyrtl.LogicNet(net_ops[op], None, args, (wires[dest],))
+            block.add_net(net)
+        return block
+
+    ############################################################################
+    # Oyster s-expression text
+    ############################################################################
+
+    def _operand(self, operand):
+        if operand >= 0:
+            return str(operand)
+        return "(CONST {} {})".format(self.const_values[-operand - 1], self.const_widths[-operand - 1])
+
+    def _decl_text(self, decl):
+        if decl.kind == Kind.INPUT:
+            return "({} (INPUT {} \"{}\"))".format(decl.id, decl.bitwidth, decl.name)
+        elif decl.kind == Kind.OUTPUT:
+            return "({} (OUTPUT {} \"{}\"))".format(decl.id, decl.bitwidth, decl.name)
+        elif decl.kind == Kind.REGISTER:
+            return "({} (REGISTER {} {} \"{}\"))".format(decl.id, decl.bitwidth, decl.reset, decl.name)
+        elif decl.kind == Kind.MEMORY:
+            return "({} (MEMORY {} {} \"{}\"))".format(decl.id, decl.bitwidth, decl.addrwidth, decl.name)
+        elif decl.kind == Kind.ROM:
+            data = " ".join(['(??)'] * 2**decl.addrwidth) if decl.data is None \
+                else " ".join([str(x) for x in decl.data])
+            return "({} (ROM {} {} (list {}) \"{}\"))".format(decl.id, decl.bitwidth, decl.addrwidth, data, decl.name)
+        elif decl.kind == Kind.HOLE:
+            args = " ".join(self._operand(arg) for arg in decl.args)
+            return "({} (HOLE {} (list {}) \"{}\"))".format(decl.id, decl.bitwidth, args, decl.name)
+        raise ValueError("invalid declaration kind {}".format(decl.kind))
+
+    def _statement_text(self, i):
+        op = self.ops[i]
+        args = [self._operand(arg) for arg in self.args[self.arg_start[i] : self.arg_start[i + 1]]]
+        params = self.params[self.param_start[i] : self.param_start[i + 1]]
+        if op == Op.CONCAT:
+            expr = "CONCAT (list {})".format(" ".join(args))
+        elif op == Op.SEL:
+            # contiguous increasing bits are written as a range
+            if len(params) > 1 and all(b == a + 1 for a, b in zip(params, params[1:])):
+                bits = "SLICE {} {}".format(params[0], params[-1])
+            else:
+                bits = "list " + " ".join([str(p) for p in params])
+            expr = "SEL {} ({})".format(args[0], bits)
+        elif op == Op.CONST:
+            expr = "CONST {} {}".format(self.const_values[-self.args[self.arg_start[i]] - 1], params[0])
+        else:
+            expr = "{} {}".format(KEYWORDS[op], " ".join(args))
+        return "({} ({}))".format(self.dests[i], expr)
+
+    def iter_text(self):
+        """Yields the Oyster IR text piece by piece."""
+        yield "(define-block {}\n(decl ".format(self.name)
+        for n, decl in enumerate(self.decls):
+            yield self._decl_text(decl) if n == 0 else "\n  " + self._decl_text(decl)
+        yield ")\n(stmt "
+        for i in range(len(self)):
+            yield self._statement_text(i) if i == 0 else "\n  " + self._statement_text(i)
+        yield "))"
+
+    def to_text(self):
+        return "".join(self.iter_text())
+
+    TOKEN = re.compile(r'[()]|"[^"]*"|[^\s()"]+')
+
+    @classmethod
+    def from_text(cls, text):
+        """Parses the Oyster IR text of a block, as written by `iter_text`.
+
+        Only the first define-block is read, so the output of generate_cpu.py can
+        be loaded as is. `(SLICE lo hi)` selects every bit from lo to hi, and
+        `(CONST v w)` statements are bit 0 of v replicated w times, the select
+        they are written for.
+
+        :param text: the text of a define-block
+        :return: the Netlist
+        """
+        # s-expressions as nested lists, with strings kept quoted
+        stack = [[]]
+        for token in cls.TOKEN.findall(text):
+            if token == '(':
+                stack.append([])
+            elif token == ')':
+                if len(stack) == 1:
+                    raise ValueError("unbalanced ')' in Oyster IR")
+                expr = stack.pop()
+                stack[-1].append(expr)
+                if len(stack) == 1:  # anything after the block is ignored
+                    break
+            else:
+                stack[-1].append(token)
+        if len(stack) != 1 or len(stack[0]) != 1 or not isinstance(stack[0][0], list):
+            raise ValueError("expected a define-block in Oyster IR")
+
+        define, name, (decl, *decls), (stmt, *stmts) = stack[0][0]
+        if (define, decl, stmt) != ('define-block', 'decl', 'stmt'):
+            raise ValueError("expected (define-block name (decl ...) (stmt ...))")
+        netlist = cls(name)
+
+        def operand(expr):
+            if isinstance(expr, list):  # (CONST v w)
+                return netlist.const(int(expr[1]), int(expr[2]))
+            return int(expr)
+
+        def string(token):
+            return token[1:-1]
+
+        for id, (kind, *fields) in decls:
+            id = int(id)
+            if kind == 'INPUT':
+                decl = Decl(id, Kind.INPUT, int(fields[0]), string(fields[1]))
+            elif kind == 'OUTPUT':
+                decl = Decl(id, Kind.OUTPUT, int(fields[0]), string(fields[1]))
+            elif kind == 'REGISTER':
+                decl = Decl(id, Kind.REGISTER, int(fields[0]), string(fields[2]), int(fields[1]))
+            elif kind == 'MEMORY':
+                decl = Decl(id, Kind.MEMORY, int(fields[0]), string(fields[2]), addrwidth=int(fields[1]))
+            elif kind == 'ROM':
+                data = fields[2][1:]
+                data = None if any(isinstance(x, list) for x in data) else [int(x) for x in data]
+                decl = Decl(id, Kind.ROM, int(fields[0]), string(fields[3]), addrwidth=int(fields[1]), data=data)
+            elif kind == 'HOLE':
+                args = [operand(arg) for arg in fields[1][1:]]
+                decl = Decl(id, Kind.HOLE, int(fields[0]), string(fields[2]), args=args)
+            else:
+                raise ValueError("unknown declaration {} in Oyster IR".format(kind))
+            netlist.decls.append(decl)
+            netlist.num_ids = max(netlist.num_ids, id + 1)
+
+        for dest, (keyword, *args) in stmts:
+            dest = int(dest)
+            if keyword not in OPS:
+                raise ValueError("unknown statement {} in Oyster IR".format(keyword))
+            op = OPS[keyword]
+            if op == Op.CONCAT:
+                netlist.add(op, dest, [operand(arg) for arg in args[0][1:]])
+            elif op == Op.SEL:
+                kind, *bits = args[1]
+                if kind == 'SLICE':
+                    bits = range(int(bits[0]), int(bits[1]) + 1)
+                netlist.add(op, dest, [operand(args[0])], [int(b) for b in bits])
+            elif op == Op.CONST:
+                bits = int(args[1])
+                netlist.add(op, dest, [netlist.const(int(args[0]), bits)], [bits])
+            else:
+                netlist.add(op, dest, [operand(arg) for arg in args])
+            netlist.num_ids = max(netlist.num_ids, dest + 1)
+        return netlist
+
+    ############################################################################
+    # Binary format: a header followed by the raw little-endian tables
+    ############################################################################
+
+    MAGIC = b"OYIR\x01"
+
+    def to_bytes(self):
+        out = [self.MAGIC]
+
+        def write(fmt, *values):
+            out.append(struct.pack("<" + fmt, *values))
+
+        def write_str(s):
+            data = s.encode()
+            write("I", len(data))
+            out.append(data)
+
+        def write_int(value, bitwidth):
+            out.append(value.to_bytes((bitwidth + 7) // 8, "little"))
+
+        def write_array(values):
+            # in the narrowest signed type that fits every value
+            low, high = (min(values), max(values)) if len(values) else (0, 0)
+            for typecode in 'bhiq':
+                bits = 8 * array(typecode).itemsize
+                if -(1 << (bits - 1)) <= low and high < 1 << (bits - 1):
+                    break
+            table = array(typecode, values)
+            if sys.byteorder == "big":
+                table.byteswap()
+            write("cI", typecode.encode(), len(table))
+            out.append(table.tobytes())
+
+        write_str(self.name)
+        write("QI", self.num_ids, len(self.decls))
+        for decl in self.decls:
+            data = decl.data
+            write("BQIIq", decl.kind, decl.id, decl.bitwidth, decl.addrwidth, -1 if data is None else len(data))
+            write_str(decl.name)
+            write_int(decl.reset, decl.bitwidth)
+            for value in data or ():
+                write_int(value, decl.bitwidth)
+            write_array(decl.args)
+
+        write_array(self.const_widths)
+        for value, bitwidth in zip(self.const_values, self.const_widths):
+            write_int(value, bitwidth)
+
+        # operand and parameter counts rather than offsets, as they are small
+        write_array(self.ops)
+        write_array(self.dests)
+        write_array([b - a for a, b in zip(self.arg_start, self.arg_start[1:])])
+        write_array(self.args)
+        write_array([b - a for a, b in zip(self.param_start, self.param_start[1:])])
+        write_array(self.params)
+        return b"".join(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[: len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError("not a binary Oyster IR netlist")
+        data = memoryview(data)
+        offset = len(cls.MAGIC)
+
+        def read(fmt):
+            nonlocal offset
+            values = struct.unpack_from("<" + fmt, data, offset)
+            offset += struct.calcsize("<" + fmt)
+            return values
+
+        def read_bytes(n):
+            nonlocal offset
+            offset += n
+            return data[offset - n : offset]
+
+        def read_str():
+            return str(read_bytes(*read("I")), "utf-8")
+
+        def read_int(bitwidth):
+            return int.from_bytes(read_bytes((bitwidth + 7) // 8), "little")
+
+        def read_array(typecode):
+            stored, n = read("cI")
+            table = array(stored.decode())
+            table.frombytes(read_bytes(n * table.itemsize))
+            if sys.byteorder == "big":
+                table.byteswap()
+            return table if table.typecode == typecode else array(typecode, table)
+
+        def offsets(counts):
+            table = array('i', [0])
+            for count in counts:
+                table.append(table[-1] + count)
+            return table
+
+        netlist = cls(read_str())
+        netlist.num_ids, num_decls = read("QI")
+        for _ in range(num_decls):
+            kind, id, bitwidth, addrwidth, size = read("BQIIq")
+            name = read_str()
+            reset = read_int(bitwidth)
+            rom = [read_int(bitwidth) for _ in range(size)] if size >= 0 else None
+            args = read_array('i')
+            netlist.decls.append(Decl(id, kind, bitwidth, name, reset, addrwidth, rom, args))
+
+        netlist.const_widths = read_array('i')
+        netlist.const_values = [read_int(bitwidth) for bitwidth in netlist.const_widths]
+        netlist._consts = {
+            (value, bitwidth): -(k + 1)
+            for k, (value, bitwidth) in enumerate(zip(netlist.const_values, netlist.const_widths))
+        }
+
+        netlist.ops = read_array('B')
+        netlist.dests = read_array('i')
+        netlist.arg_start = offsets(read_array('i'))
+        netlist.args = read_array('i')
+        netlist.param_start = offsets(read_array('i'))
+        netlist.params = read_array('i')
+        return netlist
+
+    def save(self, path):
+        """Writes the netlist to a file in the binary format."""
+        with open(path, "wb") as out:
+            out.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        """Reads a netlist written by `save`, or a file of Oyster IR text."""
+        with open(path, "rb") as f:
+            data = f.read()
+        if data.startswith(cls.MAGIC):
+            return cls.from_bytes(data)
+        return cls.from_text(data.decode())
@@ -0,0 +1,268 @@
+import sys
+from array import array
+
+from ir import Decl, Kind, Netlist, Op, bitwidth
+
+# Ops whose operands can be swapped
+COMMUTATIVE = (Op.AND, Op.OR, Op.XOR, Op.NAND, Op.ADD, Op.MULT, Op.EQ)
+
+
+def _mask(bits):
+    return (1 << bits) - 1
+
+
+def _rewrite(netlist, visit):
+    """Rebuilds a netlist, replacing the statements that `visit` resolves.
+
+    Statements are visited in order with their operands already rewritten, as
+    visit(netlist, op, dest, args, params, width) where netlist is the one being
+    built and width is the bitwidth of dest. It returns None to keep the
+    statement, or an operand that dest always equals: uses of dest then read it
+    instead, and the statement is dropped unless dest is an output or register.
+
+    :param netlist: the Netlist to rewrite
+    :param visit: the function deciding what to do with each statement
+    :return: (the new Netlist, number of statements dropped)
+    """
+    out = Netlist(netlist.name)
+    out.num_ids = netlist.num_ids
+    widths = array('i', [0]) * netlist.num_ids
+    declared = set()  # outputs and registers, which have to keep their statements
+    for decl in netlist.decls:
+        widths[decl.id] = decl.bitwidth
+        if decl.kind in (Kind.OUTPUT, Kind.REGISTER):
+            declared.add(decl.id)
+
+    subst = dict()  # id -> operand of the new netlist
+
+    def operand(x):
+        if x < 0:
+            return out.const(netlist.const_values[-x - 1], netlist.const_widths[-x - 1])
+        return subst.get(x, x)
+
+    dropped = 0
+    for i in range(len(netlist)):
+        op, dest = netlist.ops[i], netlist.dests[i]
+        args = [operand(x) for x in netlist.args[netlist.arg_start[i] : netlist.arg_start[i + 1]]]
+        params = netlist.params[netlist.param_start[i] : netlist.param_start[i + 1]]
+        if op == Op.WRITE:
+            out.add(op, dest, args, params)
+            continue
+
+        if op == Op.READ:
+            widths[dest] = widths[args[0]]
+        else:
+            widths[dest] = bitwidth(op, [out.const_widths[-x - 1] if x < 0 else widths[x] for x in args], params)
+
+        value = visit(out, op, dest, args, params, widths[dest])
+        if value is None:
+            out.add(op, dest, args, params)
+        elif dest in declared:
+            out.add(Op.ASSIGN, dest, [value])
+        else:
+            subst[dest] = value
+            dropped += 1
+
+    for decl in netlist.decls:
+        args = [operand(x) for x in decl.args]
+        out.decls.append(Decl(decl.id, decl.kind, decl.bitwidth, decl.name, decl.reset, decl.addrwidth, decl.data, args))
+    return out, dropped
+
+
+def copy_propagation(netlist):
+    """Reads the source of every `:=` instead of its destination.
+
+    :param netlist: the Netlist to optimize
+    :return: (the new Netlist, number of statements removed)
+    """
+
+    def visit(out, op, dest, args, params, width):
+        return args[0] if op == Op.ASSIGN else None
+
+    return _rewrite(netlist, visit)
+
+
+def constant_folding(netlist):
+    """Evaluates the statements whose operands are all constants.
+
+    Also resolves muxes with a constant select, and AND/OR/XOR with an operand
+    that is all zeroes or all ones where the result is one of the operands.
+
+    :param netlist: the Netlist to optimize
+    :return: (the new Netlist, number of statements removed)
+    """
+
+    def visit(out, op, dest, args, params, width):
+        if op == Op.READ:
+            return None
+        consts = [out.const_values[-x - 1] if x < 0 else None for x in args]
+
+        if op == Op.MUX and consts[0] is not None:
+            return args[2] if consts[0] else args[1]
+        if op in (Op.AND, Op.OR, Op.XOR) and len(args) == 2:
+            for x, c, other in ((args[0], consts[0], args[1]), (args[1], consts[1], args[0])):
+                if c == 0 and op == Op.AND:
+                    return x
+                if c == 0 or (c == _mask(width) and op == Op.AND):
+                    return other
+                if c == _mask(width) and op == Op.OR:
+                    return x
+        if None in consts:
+            return None
+
+        if op == Op.ASSIGN:
+            value = consts[0]
+        elif op == Op.NOT:
+            value = ~consts[0]
+        elif op == Op.AND:
+            value = consts[0] & consts[1]
+        elif op == Op.OR:
+            value = consts[0] | consts[1]
+        elif op == Op.XOR:
+            value = consts[0] ^ consts[1]
+        elif op == Op.NAND:
+            value = ~(consts[0] & consts[1])
+        elif op == Op.ADD:
+            value = consts[0] + consts[1]
+        elif op == Op.SUB:
+            value = consts[0] - consts[1]
+        elif op == Op.MULT:
+            value = consts[0] * consts[1]
+        elif op == Op.LT:
+            value = consts[0] < consts[1]
+        elif op == Op.GT:
+            value = consts[0] > consts[1]
+        elif op == Op.EQ:
+            value = consts[0] == consts[1]
+        elif op == Op.CONCAT:  # the first operand is the most significant
+            value = 0
+            for x, c in zip(args, consts):
+                value = (value << out.const_widths[-x - 1]) | c
+        elif op == Op.SEL:
+            value = sum(((consts[0] >> bit) & 1) << i for i, bit in enumerate(params))
+        elif op == Op.CONST:  # bit 0 replicated
+            value = -(consts[0] & 1)
+        else:
+            return None
+        return out.const(int(value) & _mask(width), width)
+
+    return _rewrite(netlist, visit)
+
+
+def common_subexpressions(netlist):
+    """Merges the statements computing the same operation on the same operands.
+
+    :param netlist: the Netlist to optimize
+    :return: (the new Netlist, number of statements removed)
+    """
+    declared = {decl.id for decl in netlist.decls if decl.kind in (Kind.OUTPUT, Kind.REGISTER)}
+    seen = dict()  # (op, args, params) -> dest of the first statement computing it
+
+    def visit(out, op, dest, args, params, width):
+        key = (op, tuple(sorted(args) if op in COMMUTATIVE else args), tuple(params))
+        if key in seen:
+            return seen[key]
+        if dest not in declared:  # outputs can't be read back
+            seen[key] = dest
+        return None
+
+    return _rewrite(netlist, visit)
+
+
+def dead_statements(netlist):
+    """Removes the statements that no output, register, memory or hole reads.
+
+    :param netlist: the Netlist to optimize
+    :return: (the new Netlist, number of statements removed)
+    """
+    live = bytearray(netlist.num_ids)
+    for decl in netlist.decls:
+        if decl.kind in (Kind.OUTPUT, Kind.REGISTER):
+            live[decl.id] = 1
+        for x in decl.args:
+            if x >= 0:
+                live[x] = 1
+
+    keep = bytearray(len(netlist))
+    for i in reversed(range(len(netlist))):
+        if netlist.ops[i] == Op.WRITE or live[netlist.dests[i]]:
+            keep[i] = 1
+            for x in netlist.args[netlist.arg_start[i] : netlist.arg_start[i + 1]]:
+                if x >= 0:
+                    live[x] = 1
+
+    # WRITE statements are never visited
+    keep = iter([keep[i] for i in range(len(netlist)) if netlist.ops[i] != Op.WRITE])
+
+    def visit(out, op, dest, args, params, width):
+        return None if next(keep) else dest
+
+    return _rewrite(netlist, visit)
+
+
+PASSES = (copy_propagation, constant_folding, common_subexpressions, dead_statements)
+
+
+def size(netlist):
+    """Size of a netlist: its statements, constants and length of its text."""
+    return {
+        "statements": len(netlist),
+        "constants": len(netlist.const_values),
+        "text bytes": sum(len(chunk) for chunk in netlist.iter_text()),
+    }
+
+
+def optimize(netlist, passes=PASSES):
+    """Runs optimization passes over a netlist until none of them removes anything.
+
+    :param netlist: the Netlist to optimize
+    :param passes: the passes to run, in order
+    :return: (the optimized Netlist, map of pass name -> statements it removed)
+    """
+    removed = {p.__name__: 0 for p in passes}
+    changed = True
+    while changed:
+        changed = False
+        for p in passes:
+            netlist, n = p(netlist)
+            removed[p.__name__] += n
+            changed = changed or n > 0
+    return netlist, removed
+
+
+def report(before, after, removed):
+    """Formats the before/after sizes of an optimization.
+
+    :param before: `size` of the netlist before
+    :param after: `size` of the netlist after
+    :param removed: statements removed by each pass, as returned by `optimize`
+    :return: the report, one line per measure and pass
+    """
+    lines = []
+    for measure in before:
+        saved = 1 - after[measure] / before[measure] if before[measure] else 0
+        lines.append("{}: {} -> {} ({:.1%} smaller)".format(measure, before[measure], after[measure], saved))
+    for name, n in removed.items():
+        lines.append("  {}: {} statements".format(name, n))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser("Optimize Oyster IR.")
+    parser.add_argument("ir", type=str, help="Oyster IR, as text or in the binary format")
+    parser.add_argument("-o", "--output", type=str, help="file to write (default: text to stdout)")
+    parser.add_argument("--binary", action="store_true", help="write the binary format")
+    args = parser.parse_args()
+
+    netlist = Netlist.load(args.ir)
+    optimized, removed = optimize(netlist)
+    if args.binary:
+        optimized.save(args.output)
+    else:
+        with open(args.output, "w") if args.output else sys.stdout as out:
+            for chunk in optimized.iter_text():
+                out.write(chunk)
+            out.write("\n")
+    print(report(size(netlist), size(optimized), removed), file=sys.stderr)
@@ -0,0 +1,315 @@
+import sys
+
+from ir import Kind, Op, bitwidth
+
+try:
+    import numpy as np
+except ImportError:  # only BatchSimulation needs it
+    np = None
+
+
+def _mask(bits):
+    return (1 << bits) - 1
+
+
+class BatchSimulation:
+    """Simulates many independent copies of an IR netlist at once.
+
+    Every wire holds one value per copy ("lane") in a NumPy array, and each
+    statement is evaluated for all lanes at once, in order. Values of up to 64
+    bits are uint64 arrays; wider ones fall back to arrays of Python ints.
+    Registers and memories hold separate state per lane. Memories are sparse,
+    so even the 30-bit address spaces of the CPU memories are fine.
+
+    :param netlist: the ir.Netlist to simulate
+    :param lanes: number of copies to simulate
+    :param memory_value_map: map of memory name -> {address: value} to start
+        every lane with
+    :param register_value_map: map of register name -> initial value
+    """
+
+    def __init__(self, netlist, lanes=1, memory_value_map=None, register_value_map=None):
+        if np is None:
+            raise ImportError("BatchSimulation requires NumPy")
+        self.netlist = netlist
+        self.lanes = lanes
+        memory_value_map = memory_value_map or {}
+        register_value_map = register_value_map or {}
+
+        self.widths = [0] * netlist.num_ids
+        self.inputs = dict()  # name -> id
+        self.outputs = dict()  # name -> id
+        self.registers = dict()  # name -> id
+        self.mems = dict()  # id -> {address: values of each lane}
+        self.mem_names = dict()  # name -> id
+        self.roms = dict()  # id -> array of contents
+        self.values = [None] * netlist.num_ids
+        for decl in netlist.decls:
+            self.widths[decl.id] = decl.bitwidth
+            if decl.kind == Kind.INPUT:
+                self.inputs[decl.name] = decl.id
+            elif decl.kind == Kind.HOLE:
+                self.inputs[decl.name + '_input'] = decl.id
+            elif decl.kind == Kind.OUTPUT:
+                self.outputs[decl.name] = decl.id
+            elif decl.kind == Kind.REGISTER:
+                self.registers[decl.name] = decl.id
+                reset = register_value_map.get(decl.name, decl.reset)
+                self.values[decl.id] = self._full(reset, decl.bitwidth)
+            elif decl.kind == Kind.MEMORY:
+                self.mem_names[decl.name] = decl.id
+                self.mems[decl.id] = {
+                    addr: self._full(value, decl.bitwidth)
+                    for addr, value in memory_value_map.get(decl.name, {}).items()
+                }
+            elif decl.kind == Kind.ROM:
+                data = decl.data if decl.data is not None else [0]
+                self.roms[decl.id] = np.array(data, dtype=self._dtype(decl.bitwidth))
+
+        # Statements, resolved once: (op, dest, args, params, width, dead) where
+        # dead are the ids no later statement reads, whose values can be freed
+        self.program = []
+        self.updates = []  # (register, operand) of the value of each register in the next cycle
+        self.next = []  # (register, value) to apply at the start of the next step
+        for stmt in netlist:
+            args = list(stmt.args)
+            if stmt.op == Op.WRITE:
+                self.program.append((stmt.op, stmt.dest, args, None, 0, []))
+                continue
+            if stmt.op == Op.ASSIGN and stmt.dest in self.registers.values():
+                self.updates.append((stmt.dest, args[0]))
+                continue
+            if stmt.op == Op.READ:
+                width = self.widths[args[0]]
+            else:
+                width = bitwidth(stmt.op, [self._width(x) for x in args], list(stmt.params))
+            self.widths[stmt.dest] = width
+            self.program.append((stmt.op, stmt.dest, args, list(stmt.params), width, []))
+
+        kept = set(self.inputs.values()) | set(self.outputs.values()) | set(self.registers.values())
+        kept.update(x for _, x in self.updates)
+        freed = set()
+        for op, dest, args, params, width, dead in reversed(self.program):
+            for x in args:
+                if x >= 0 and x not in kept and x not in freed and x not in self.mems and x not in self.roms:
+                    dead.append(x)
+                    freed.add(x)
+
+        self.consts = [
+            self._scalar(value, width) for value, width in zip(netlist.const_values, netlist.const_widths)
+        ]
+
+    def _width(self, x):
+        return self.netlist.const_widths[-x - 1] if x < 0 else self.widths[x]
+
+    @staticmethod
+    def _dtype(width):
+        return np.uint64 if width <= 64 else object
+
+    def _scalar(self, value, width):
+        return np.uint64(value) if width <= 64 else value
+
+    def _full(self, value, width):
+        return np.full(self.lanes, self._scalar(value, width), dtype=self._dtype(width))
+
+    def _value(self, x, wide=False):
+        value = self.consts[-x - 1] if x < 0 else self.values[x]
+        if wide:
+            return np.asarray(np.broadcast_to(value, self.lanes), dtype=object)
+        return value
+
+    def _eval(self, op, args, params, width):
+        wide = width > 64 or any(self._width(x) > 64 for x in args)
+        a = [self._value(x, wide) for x in args]
+        mask = _mask(width) if wide else np.uint64(_mask(width))
+
+        if op == Op.ASSIGN:
+            result = a[0]
+        elif op == Op.NOT:
+            result = ~a[0] & mask
+        elif op == Op.AND:
+            result = a[0] & a[1]
+        elif op == Op.OR:
+            result = a[0] | a[1]
+        elif op == Op.XOR:
+            result = a[0] ^ a[1]
+        elif op == Op.NAND:
+            result = ~(a[0] & a[1]) & mask
+        elif op == Op.ADD:
+            result = a[0] + a[1]
+        elif op in (Op.SUB, Op.MULT):  # wrap around at 64 bits before masking
+            with np.errstate(over="ignore"):
+                result = (a[0] - a[1] if op == Op.SUB else a[0] * a[1]) & mask
+        elif op in (Op.LT, Op.GT, Op.EQ):
+            result = (a[0] < a[1]) if op == Op.LT else (a[0] > a[1]) if op == Op.GT else (a[0] == a[1])
+            result = np.asarray(result, dtype=np.uint64)
+        elif op == Op.MUX:
+            result = np.where(np.asarray(a[0]) != 0, a[2], a[1])
+        elif op == Op.CONCAT:  # the first operand is the most significant
+            result = a[0]
+            for x, value in zip(args[1:], a[1:]):
+                shift = self._width(x)
+                result = (result << (shift if wide else np.uint64(shift))) | value
+        elif op == Op.SEL:
+            lo = params[0]
+            if params == list(range(lo, lo + len(params))):
+                result = (a[0] >> (lo if wide else np.uint64(lo))) & mask
+            else:
+                result = 0
+                for i, bit in enumerate(params):
+                    one = 1 if wide else np.uint64(1)
+                    result = result | (((a[0] >> (bit if wide else np.uint64(bit))) & one) << (i if wide else np.uint64(i)))
+        elif op == Op.CONST:  # bit 0 replicated
+            result = (a[0] & (1 if wide else np.uint64(1))) * mask
+        else:
+            raise ValueError("cannot evaluate {}".format(op.name))
+
+        if width <= 64 and np.asarray(result).dtype == object:
+            result = np.asarray(result).astype(np.uint64)
+        return result
+
+    def _read(self, mem, addr):
+        if mem in self.roms:
+            rom = self.roms[mem]
+            addr = np.broadcast_to(np.asarray(addr, dtype=np.uint64), self.lanes)
+            inside = addr < len(rom)
+            return np.where(inside, rom[np.where(inside, addr, 0).astype(np.intp)], 0).astype(rom.dtype)
+
+        contents = self.mems[mem]
+        width = self.widths[mem]
+        if np.ndim(addr) == 0:
+            return contents[int(addr)].copy() if int(addr) in contents else self._full(0, width)
+        result = self._full(0, width)
+        for address in np.unique(addr):
+            if int(address) in contents:
+                lanes = addr == address
+                result[lanes] = contents[int(address)][lanes]
+        return result
+
+    def _write(self, mem, addr, data, enable):
+        contents = self.mems[mem]
+        width = self.widths[mem]
+        enable = np.broadcast_to(np.asarray(enable) != 0, self.lanes)
+        addr = np.broadcast_to(addr, self.lanes)
+        data = np.broadcast_to(data, self.lanes)
+        for address in np.unique(addr[enable]):
+            lanes = enable & (addr == address)
+            stored = contents.setdefault(int(address), self._full(0, width))
+            stored[lanes] = data[lanes]
+
+    def step(self, inputs):
+        """Simulates one cycle of every lane.
+
+        :param inputs: map of input name -> value, either one per lane or one
+            for all of them
+        :return: map of output name -> value of each lane
+        """
+        for register, value in self.next:
+            self.values[register] = value
+        for name, id in self.inputs.items():
+            if name not in inputs:
+                raise KeyError("no value for input {}".format(name))
+            value = inputs[name]
+            if np.ndim(value) == 0:
+                value = self._scalar(int(value), self.widths[id])
+            self.values[id] = value
+
+        for op, dest, args, params, width, dead in self.program:
+            if op == Op.READ:
+                self.values[dest] = self._read(args[0], self._value(args[1]))
+            elif op == Op.WRITE:
+                self._write(dest, *(self._value(x) for x in args))
+            else:
+                self.values[dest] = self._eval(op, args, params, width)
+            for x in dead:
+                self.values[x] = None
+
+        self.next = [(register, np.broadcast_to(self._value(x), self.lanes).copy()) for register, x in self.updates]
+        return {name: self.inspect(name) for name in self.outputs}
+
+    def inspect(self, name):
+        """The value of each lane of an output or register during the last step."""
+        id = self.outputs.get(name, self.registers.get(name))
+        if id is None:
+            raise KeyError("no output or register named {}".format(name))
+        return np.broadcast_to(self.values[id], self.lanes)
+
+    def inspect_mem(self, name, lane=0):
+        """The contents of a memory in one lane, as a map of address -> value."""
+        contents = self.mems[self.mem_names[name]]
+        return {addr: int(values[lane]) for addr, values in contents.items() if values[lane]}
+
+
+def random_inputs(netlist, lanes, rng):
+    """Random values of each input of a netlist, for every lane.
+
+    :param netlist: the ir.Netlist
+    :param lanes: number of lanes
+    :param rng: a numpy.random.Generator
+    :return: map of input name -> values
+    """
+    inputs = dict()
+    for decl in netlist.decls:
+        if decl.kind in (Kind.INPUT, Kind.HOLE):
+            name = decl.name if decl.kind == Kind.INPUT else decl.name + '_input'
+            if decl.bitwidth <= 64:
+                inputs[name] = rng.integers(0, 1 << decl.bitwidth, lanes, dtype=np.uint64)
+            else:
+                size = (decl.bitwidth + 7) // 8
+                values = [int.from_bytes(rng.bytes(size), "little") & _mask(decl.bitwidth) for _ in range(lanes)]
+                inputs[name] = np.array(values, dtype=object)
+    return inputs
+
+
+def compare(a, b, vectors, lanes=1 << 16, seed=0):
+    """Checks that two combinational netlists compute the same outputs.
+
+    Both are fed the same random input vectors, in batches of `lanes`.
+
+    :param a: an ir.Netlist
+    :param b: the ir.Netlist to compare it to, with the same inputs and outputs
+    :param vectors: number of input vectors to try
+    :param lanes: number of vectors evaluated at once
+    :param seed: seed of the random inputs
+    :return: list of (output, inputs, value in a, value in b) for each
+        mismatching vector of the first batch with mismatches (empty if none)
+    """
+    if np is None:
+        raise ImportError("compare requires NumPy")
+    rng = np.random.default_rng(seed)
+    done = 0
+    while done < vectors:
+        n = min(lanes, vectors - done)
+        inputs = random_inputs(a, n, rng)
+        out_a = BatchSimulation(a, n).step(inputs)
+        out_b = BatchSimulation(b, n).step(inputs)
+        mismatches = []
+        for name in out_a:
+            for lane in np.nonzero(out_a[name] != out_b[name])[0]:
+                vector = {input: int(values[lane]) for input, values in inputs.items()}
+                mismatches.append((name, vector, int(out_a[name][lane]), int(out_b[name][lane])))
+        if mismatches:
+            return mismatches
+        done += n
+    return []
+
+
+if __name__ == "__main__":
+    import time
+    from argparse import ArgumentParser
+    from ir import Netlist
+
+    parser = ArgumentParser("Compare two combinational Oyster IR netlists on random inputs.")
+    parser.add_argument("a", type=str, help="Oyster IR, as text or in the binary format")
+    parser.add_argument("b", type=str, help="Oyster IR to compare it to")
+    parser.add_argument("-n", "--vectors", type=int, default=1 << 20, help="number of input vectors")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random inputs")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    mismatches = compare(Netlist.load(args.a), Netlist.load(args.b), args.vectors, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    for output, vector, a, b in mismatches[:10]:
+        print("{}: {} vs {} for {}".format(output, a, b, vector))
+    print("{} mismatches, {} vectors in {:.2f}s".format(len(mismatches), args.vectors, elapsed))
+    sys.exit(1 if mismatches else 0)
@@ -1,4 +1,5 @@
 from .alu import alu_decomp_small, alu_decomp_large
 from .cpu import cpu, rv_cpu
 from .control import control, control_zbkb
-from .program import Program
+from .program import Program, Session
+from .iss import ISS
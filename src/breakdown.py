@@ -0,0 +1,197 @@
+import json
+import re
+from collections import Counter
+
+import pyrtl
+
+# The subsystems of the CPU, as (name, wire name prefixes, input wires, memories).
+# A wire belongs to the first subsystem one of whose prefixes is its name or
+# starts its name followed by "_", except for the input wires of the subsystem,
+# which are driven by the logic around it.
+SUBSYSTEMS = (
+    ("alu", ("alu",), ("alu_in1", "alu_in2", "alu_op"), ()),
+    ("control", ("cont",), (), ()),
+    ("decode", ("inst_imm",), (), ()),
+    ("fetch", ("inst", "icache"), (), ("imem",)),
+    (
+        "data_memory",
+        ("mem", "read_data_ext", "dcache"),
+        ("mem_addr", "mem_write_data", "mem_read", "mem_write", "mem_mask_mode", "mem_sign_ext"),
+        ("dmem",),
+    ),
+    ("reg_file", ("rf",), ("rf_rs1", "rf_rs2", "rf_rd", "rf_write_data", "rf_write"), ("rf",)),
+    ("predictor", ("btb", "bht", "pred"), (), ("btb", "bht")),
+    ("counters", ("perf",), (), ()),
+)
+
+# Registers outside of every subsystem, i.e. the pipeline and pc registers
+REGISTERS = "registers"
+
+# Named logic outside of every subsystem (pc selection, forwarding, ...), and
+# the temporaries that only feed registers
+DATAPATH = "datapath"
+
+LABELS = {subsystem for subsystem, _, _, _ in SUBSYSTEMS} | {DATAPATH}
+
+# Pipeline registers, by name prefix, named after the stage they feed
+STAGES = (("f", "fetch"), ("d", "decode"), ("x", "execute"), ("m", "memory"), ("wb", "writeback"))
+
+
+def base_name(wire):
+    """The name of a wire, without the suffix `pyrtl.synthesize` adds to bits."""
+    return re.sub(r"_synth_\d+$", "", wire.name)
+
+
+def _is_temporary(wire):
+    return isinstance(wire, pyrtl.Const) or wire.name.startswith("tmp")
+
+
+def _subsystem_of(wire):
+    return _subsystem_of_name(base_name(wire))
+
+
+def _subsystem_of_name(name):
+    subsystem, labeled, _ = name.partition("__")
+    if labeled and subsystem in LABELS:
+        return subsystem
+    for subsystem, prefixes, inputs, _ in SUBSYSTEMS:
+        if any(name == p or name.startswith(p + "_") for p in prefixes):
+            return None if name in inputs else subsystem
+    return None
+
+
+def attribute(block=None):
+    """Attributes every net of a block to a subsystem.
+
+    Memory ports go to the subsystem of their memory (by name, or else by name
+    prefix) and nets driving a named wire to the subsystem of its name (see
+    `SUBSYSTEMS`), or else to
+    `REGISTERS` or `DATAPATH`. Nets driving temporaries go to the subsystem
+    most of their readers are in, so the logic a subsystem elaborates ends up
+    with its named outputs.
+
+    :param block: the block (defaults to the working block)
+    :return: map of net -> subsystem name
+    """
+    block = pyrtl.working_block(block)
+    memories = {mem: subsystem for subsystem, _, _, mems in SUBSYSTEMS for mem in mems}
+    readers = dict()  # wire -> nets reading it
+    for net in block.logic:
+        for arg in net.args:
+            readers.setdefault(arg, []).append(net)
+
+    owner = dict()
+    for net in reversed(list(block)):
+        if net.op in "m@":
+            name = net.op_param[1].name
+            owner[net] = memories.get(name) or _subsystem_of_name(name) or DATAPATH
+            continue
+        dest = net.dests[0]
+        subsystem = _subsystem_of(dest)
+        if subsystem is None and net.op == "r":
+            subsystem = REGISTERS
+        elif subsystem is None and _is_temporary(dest):
+            votes = Counter(owner.get(reader, DATAPATH) for reader in readers.get(dest, ()))
+            votes.pop(REGISTERS, None)
+            if votes:
+                subsystem = min(votes, key=lambda s: (-votes[s], s))
+        owner[net] = subsystem if subsystem is not None else DATAPATH
+    return owner
+
+
+def label(block=None):
+    """Prefixes the name of every internal wire with its subsystem.
+
+    `pyrtl.optimize` and `pyrtl.synthesize` lose most of the names `attribute`
+    relies on, but the bits of a synthesized wire are named after it, so
+    labeling the wires of an elaborated block first keeps the attribution of
+    the logic through those passes.
+
+    :param block: the block (defaults to the working block)
+    """
+    for net, subsystem in attribute(block).items():
+        for dest in net.dests:
+            if type(dest) is pyrtl.WireVector:
+                dest.name = "{}__{}".format(subsystem, dest.name)
+
+
+def area(block=None):
+    """The gates, wires and wire bits of each subsystem of a block.
+
+    :param block: the block (defaults to the working block)
+    :return: map of subsystem name -> {"gates", "wires", "bits"}
+    """
+    report = dict()
+    for net, subsystem in attribute(block).items():
+        entry = report.setdefault(subsystem, {"gates": 0, "wires": 0, "bits": 0})
+        entry["gates"] += 1
+        for dest in net.dests:
+            entry["wires"] += 1
+            entry["bits"] += dest.bitwidth
+    return dict(sorted(report.items(), key=lambda item: -item[1]["gates"]))
+
+
+def timing(block=None):
+    """Estimates the critical path of a block, and into each group of endpoints.
+
+    The endpoints are the registers and memory writes. Registers are grouped by
+    the pipeline stages they sit between (see `STAGES`), or else by their
+    subsystem or name; memory writes by memory.
+
+    :param block: the block (defaults to the working block)
+    :return: dict with the overall "max_length" (ps) and "fmax_mhz", and the
+        longest path into each group of endpoints in "endpoints"
+    """
+    block = pyrtl.working_block(block)
+    analysis = pyrtl.TimingAnalysis(block)
+    arrival = analysis.timing_map
+
+    endpoints = dict()
+    for net in block.logic:
+        if net.op == "r":
+            name = base_name(net.dests[0])
+            group = _subsystem_of(net.dests[0]) or next(
+                (stage for prefix, stage in STAGES if name.startswith(prefix + "_")), name
+            )
+        elif net.op == "@":
+            group = net.op_param[1].name + " write"
+        else:
+            continue
+        length = max(arrival.get(arg, 0) for arg in net.args)
+        endpoints[group] = max(endpoints.get(group, 0), length)
+
+    return {
+        "max_length": analysis.max_length(),
+        "fmax_mhz": analysis.max_freq(),
+        "endpoints": dict(sorted(endpoints.items(), key=lambda item: -item[1])),
+    }
+
+
+def breakdown(block=None, with_timing=True):
+    """The area (and timing) breakdown of a block, as a JSON-serializable dict."""
+    block = pyrtl.working_block(block)
+    report = {
+        "total": {"gates": len(block.logic), "wires": len(block.wirevector_set)},
+        "subsystems": area(block),
+    }
+    if with_timing:
+        report["timing"] = timing(block)
+    return report
+
+
+def format_breakdown(report):
+    """Formats a `breakdown` as a table."""
+    lines = ["{:<12} {:>8} {:>8} {:>8}".format("subsystem", "gates", "wires", "bits")]
+    for subsystem, entry in report["subsystems"].items():
+        lines.append("{:<12} {gates:>8} {wires:>8} {bits:>8}".format(subsystem, **entry))
+    if "timing" in report:
+        t = report["timing"]
+        lines.append("critical path: {:.0f} ps ({:.1f} MHz)".format(t["max_length"], t["fmax_mhz"]))
+        for group, length in t["endpoints"].items():
+            lines.append("  into {:<20} {:>8.0f} ps".format(group, length))
+    return "\n".join(lines)
+
+
+def write_breakdown(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
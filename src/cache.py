@@ -1,5 +1,8 @@
 import pyrtl
 import math
+from argparse import ArgumentTypeError
+
+from .util import add_counter
 
 def CacheDirectMappedNBlock(datawidth, addrwidth, nblocks, ref, mem, prefix=""):
     # On a cache miss, it reads in the memory and outputs validOut=0 on the first cycle,
@@ -36,6 +39,401 @@ def CacheDirectMappedNBlock(datawidth, addrwidth, nblocks, ref, mem, prefix=""):
 
     return data, vout
 
+
+class Replacement():
+    LRU = 'lru'  # true least recently used
+    PLRU = 'plru'  # tree pseudo-LRU
+
+    ALL = (LRU, PLRU)
+
+
+class CacheConfig():
+    """The geometry of a cache built by `CacheSetAssociative`.
+
+    :param sets: number of sets (a power of two, at least 2)
+    :param ways: lines per set (a power of two)
+    :param words: words per line (a power of two)
+    :param replacement: which line of a full set to evict (see `Replacement`)
+    """
+
+    def __init__(self, sets, ways=1, words=1, replacement=Replacement.LRU):
+        for name, value, least in (("sets", sets, 2), ("ways", ways, 1), ("words", words, 1)):
+            if value < least or value & (value - 1):
+                raise ValueError(f"the number of {name} must be a power of two (at least {least})")
+        if replacement not in Replacement.ALL:
+            raise ValueError(f"invalid replacement policy '{replacement}'")
+        self.sets = sets
+        self.ways = ways
+        self.words = words
+        self.replacement = replacement
+
+    @classmethod
+    def parse(cls, text):
+        """Parses SETS[xWAYS[xWORDS]][:POLICY], e.g. "64", "16x4x2" or "16x4:plru"."""
+        geometry, _, replacement = text.partition(":")
+        try:
+            sizes = [int(size) for size in geometry.split("x")]
+        except ValueError:
+            raise ValueError(f"invalid cache geometry '{text}'")
+        if not 1 <= len(sizes) <= 3:
+            raise ValueError(f"invalid cache geometry '{text}'")
+        return cls(*sizes, replacement=replacement or Replacement.LRU)
+
+    @classmethod
+    def argument(cls, text):
+        """`parse` as an argparse type, so that a bad value reports why."""
+        try:
+            return cls.parse(text)
+        except ValueError as e:
+            raise ArgumentTypeError(str(e))
+
+    @property
+    def size(self):
+        """Number of words the cache holds."""
+        return self.sets * self.ways * self.words
+
+    def __str__(self):
+        return f"{self.sets}x{self.ways}x{self.words}:{self.replacement}"
+
+    def __repr__(self):
+        return f"CacheConfig({self})"
+
+
+def _encode(bits):
+    # the index of the (single) high bit of a one-hot list of bits
+    width = max(1, (len(bits) - 1).bit_length())
+    index = pyrtl.Const(0, bitwidth=width)
+    for i, bit in enumerate(bits):
+        if i:
+            index = index | pyrtl.select(bit, pyrtl.Const(i, bitwidth=width), pyrtl.Const(0, bitwidth=width))
+    return index
+
+
+def _first(bits):
+    # one-hot list of the first high bit of a list of bits
+    first, seen = [], pyrtl.Const(0)
+    for bit in bits:
+        first.append(bit & ~seen)
+        seen = seen | bit
+    return first
+
+
+def _lru_pairs(ways):
+    return [(i, j) for i in range(ways) for j in range(i + 1, ways)]
+
+
+# True LRU keeps, for every pair of ways i < j, whether i was used more recently
+# than j. All zeros orders the ways from way 0, the least recently used.
+def _lru_victim(state, ways):
+    newer = dict(zip(_lru_pairs(ways), state))
+    return [
+        pyrtl.rtl_all(*[~newer[(v, j)] for j in range(v + 1, ways)], *[newer[(i, v)] for i in range(v)])
+        for v in range(ways)
+    ]
+
+
+def _lru_touch(state, ways, way):
+    return pyrtl.concat_list([
+        pyrtl.select(way == i, pyrtl.Const(1), pyrtl.select(way == j, pyrtl.Const(0), bit))
+        for (i, j), bit in zip(_lru_pairs(ways), state)
+    ])
+
+
+# Pseudo-LRU keeps a binary tree over the ways, in heap order, whose bits point
+# to the half of their subtree used less recently
+def _plru_victim(state, ways):
+    levels = ways.bit_length() - 1
+    path = []  # the bits of the victim, most significant first
+    for level in range(levels):
+        nodes = [state[(1 << level) - 1 + p] for p in range(1 << level)]
+        path.append(pyrtl.mux(pyrtl.concat(*path), *nodes) if level else nodes[0])
+    victim = pyrtl.concat(*path)
+    return [victim == v for v in range(ways)]
+
+
+def _plru_touch(state, ways, way):
+    levels = ways.bit_length() - 1
+    bits = []
+    for level in range(levels):
+        for p in range(1 << level):
+            on_path = way[levels - level:] == p if level else pyrtl.Const(1)
+            bits.append(pyrtl.select(on_path, ~way[levels - 1 - level], state[(1 << level) - 1 + p]))
+    return pyrtl.concat_list(bits)
+
+
+POLICIES = {
+    Replacement.LRU: (lambda ways: ways * (ways - 1) // 2, _lru_victim, _lru_touch),
+    Replacement.PLRU: (lambda ways: ways - 1, _plru_victim, _plru_touch),
+}
+
+
+def CacheSetAssociative(
+    datawidth,
+    addrwidth,
+    ref,
+    mem,
+    config,
+    request=None,
+    write=None,
+    write_data=None,
+    prefix="",
+    counters=None,
+):
+    """A set-associative cache in front of a memory.
+
+    Looking up a word takes no cycle: on a hit `ready` is high with its data.
+    On a miss the line is refilled one word per cycle from `mem`, starting
+    with the cycle of the miss, and `ready` is low until the cycle after the
+    last word, when the lookup hits. The victim is the first invalid line of
+    the set, or else the one the replacement policy picks. The tags (with
+    their valid bits) and the data of each way are in MemBlocks named
+    `prefix` + "tag<way>" and "data<way>", the replacement state in
+    `prefix` + "lru".
+
+    Without `write` the cache is read-only. With it, the cache is write-back
+    and write-allocate: a write that hits only updates the cache and marks the
+    word dirty, one that misses refills the line first, and a victim with dirty
+    words is written back to `mem`, one word per cycle (writing only the dirty
+    ones), before the refill starts.
+
+    :param datawidth: width of the words
+    :param addrwidth: width of the word addresses
+    :param ref: the address to read (or write)
+    :param mem: the MemBlock to cache
+    :param config: the CacheConfig
+    :param request: ref is to be read or written (defaults to always)
+    :param write: ref is to be written with write_data (None for a read-only
+        cache); the write happens in the cycle ready is high
+    :param write_data: the word to write
+    :param prefix: prefix of the names of the registers and memories
+    :param counters: prefix of the names of the hit, miss, eviction (and
+        write-back) counter Outputs (see `src.util.add_counter`), None for no
+        counters. A lookup repeated once its line is refilled doesn't count
+    :return data: the word at ref
+    :return ready: data is valid, and the write (if any) is done
+    """
+    offset_bits = config.words.bit_length() - 1
+    index_bits = config.sets.bit_length() - 1
+    way_bits = config.ways.bit_length() - 1
+    tag_bits = addrwidth - offset_bits - index_bits
+    if tag_bits < 1:
+        raise ValueError("the cache is larger than the memory")
+    request = pyrtl.Const(1) if request is None else request
+    writable = write is not None
+
+    def line_index(line):  # line: {tag, index}
+        return line[0:index_bits]
+
+    def word_in(line, word):  # the address of a word of a line
+        return pyrtl.concat(line, word[0:offset_bits]) if offset_bits else line
+
+    # Each tag entry is {valid, dirty bit of each word (if writable), tag}
+    dirty_bits = config.words if writable else 0
+    tags = [
+        pyrtl.MemBlock(1 + dirty_bits + tag_bits, index_bits, name=f"{prefix}tag{w}", asynchronous=True)
+        for w in range(config.ways)
+    ]
+    datas = [
+        pyrtl.MemBlock(datawidth, index_bits + offset_bits, name=f"{prefix}data{w}", asynchronous=True)
+        for w in range(config.ways)
+    ]
+
+    # Lookup
+    line = ref[offset_bits:]
+    index, tag = line_index(line), line[index_bits:]
+    entries = [t[index] for t in tags]
+    valid = [entry[-1] for entry in entries]
+    hits = [v & (entry[0:tag_bits] == tag) for v, entry in zip(valid, entries)]
+    hit = pyrtl.rtl_any(*hits)
+    words = [d[ref[0:index_bits + offset_bits]] for d in datas]
+    hit_way = _encode(hits)
+    data = pyrtl.WireVector(datawidth, name=f"{prefix}data")
+    data <<= pyrtl.mux(hit_way, *words) if config.ways > 1 else words[0]
+
+    # Miss state: a line being refilled, after the dirty line it replaces is
+    # written back
+    filling = pyrtl.Register(1, name=f"{prefix}filling")
+    evicting = pyrtl.Register(1, name=f"{prefix}evicting") if writable else pyrtl.Const(0)
+    fill_line_reg = pyrtl.Register(len(line), name=f"{prefix}fill_line")
+    fill_word_reg = pyrtl.Register(max(offset_bits, 1), name=f"{prefix}fill_word")
+    fill_way_reg = pyrtl.Register(max(way_bits, 1), name=f"{prefix}fill_way")
+    idle = ~filling & ~evicting
+
+    lookup = request & idle
+    miss = pyrtl.WireVector(1, name=f"{prefix}miss")
+    miss <<= lookup & ~hit
+    ready = pyrtl.WireVector(1, name=f"{prefix}ready")
+    ready <<= idle & hit
+
+    # Replacement: the state of the set being looked up picks the victim, and
+    # the way used (on a hit, or at the end of a refill) is touched
+    fill_line = pyrtl.select(idle, line, fill_line_reg)
+    set_index = line_index(fill_line)
+    if config.ways > 1:
+        state_bits, victim_of, touch = POLICIES[config.replacement]
+        states = pyrtl.MemBlock(
+            state_bits(config.ways), index_bits, name=f"{prefix}lru", asynchronous=True
+        )
+        all_valid = pyrtl.rtl_all(*valid)
+        victim = pyrtl.select(
+            all_valid,
+            _encode(victim_of(states[index], config.ways)),
+            _encode(_first([~v for v in valid])),
+        )
+        victim_entry = pyrtl.mux(victim, *entries)
+    else:
+        all_valid = valid[0]
+        victim = pyrtl.Const(0)
+        victim_entry = entries[0]
+    fill_way = pyrtl.select(idle, victim, fill_way_reg)
+
+    # Write-back of a dirty victim, one word per cycle; its tag entry is only
+    # overwritten at the end of the refill
+    if writable:
+        evict_line_reg = pyrtl.Register(len(line), name=f"{prefix}evict_line")
+        evict_word_reg = pyrtl.Register(max(offset_bits, 1), name=f"{prefix}evict_word")
+        evict_start = miss & all_valid & (victim_entry[tag_bits:-1] != 0)
+        evict_now = evict_start | evicting
+        evict_line = pyrtl.select(evicting, evict_line_reg, pyrtl.concat(victim_entry[0:tag_bits], index))
+        evict_word = pyrtl.select(evicting, evict_word_reg, pyrtl.Const(0, len(evict_word_reg)))
+        evict_last = evict_word == config.words - 1
+        old_entries = [t[set_index] for t in tags]
+        old_entry = pyrtl.mux(fill_way, *old_entries) if config.ways > 1 else old_entries[0]
+        old_words = [d[word_in(set_index, evict_word)] for d in datas]
+        mem[word_in(evict_line, evict_word)] <<= pyrtl.MemBlock.EnabledWrite(
+            pyrtl.mux(fill_way, *old_words) if config.ways > 1 else old_words[0],
+            evict_now & pyrtl.shift_right_logical(old_entry[tag_bits:-1], evict_word)[0],
+        )
+        evicting.next <<= evict_now & ~evict_last
+        evict_line_reg.next <<= evict_line
+        evict_word_reg.next <<= pyrtl.select(evict_now, evict_word + 1, pyrtl.Const(0))
+        fill_start = miss & ~evict_start
+        fill_after_evict = evict_now & evict_last
+    else:
+        fill_start = miss
+        fill_after_evict = pyrtl.Const(0)
+
+    # Refill, one word per cycle
+    fill_now = fill_start | filling
+    fill_word = pyrtl.select(filling, fill_word_reg, pyrtl.Const(0, len(fill_word_reg)))
+    fill_last = fill_word == config.words - 1
+    new_word = mem[word_in(fill_line, fill_word)]
+    store = lookup & hit & write if writable else pyrtl.Const(0)
+    if writable:
+        written = pyrtl.shift_left_logical(pyrtl.Const(1, dirty_bits), ref[0:offset_bits]) \
+            if offset_bits else pyrtl.Const(1)
+    for w in range(config.ways):
+        fill_this = fill_now & (fill_way == w)
+        store_this = store & hits[w]
+        datas[w][pyrtl.select(fill_now, word_in(set_index, fill_word), ref[0:index_bits + offset_bits])] <<= \
+            pyrtl.MemBlock.EnabledWrite(
+                pyrtl.select(fill_now, new_word, write_data) if writable else new_word,
+                fill_this | store_this,
+            )
+        # a refilled line is clean, a written word dirty
+        if writable:
+            dirty = pyrtl.select(fill_now, pyrtl.Const(0, dirty_bits), entries[w][tag_bits:-1] | written)
+            flags = pyrtl.concat(pyrtl.Const(1), dirty)
+        else:
+            flags = pyrtl.Const(1)
+        tags[w][set_index] <<= pyrtl.MemBlock.EnabledWrite(
+            pyrtl.concat(flags, fill_line[index_bits:]), (fill_this & fill_last) | store_this
+        )
+    filling.next <<= (fill_now & ~fill_last) | fill_after_evict
+    fill_line_reg.next <<= fill_line
+    fill_word_reg.next <<= pyrtl.select(fill_now, fill_word + 1, pyrtl.Const(0))
+    fill_way_reg.next <<= fill_way
+
+    if config.ways > 1:
+        touch_now = (lookup & hit) | (fill_now & fill_last)
+        touch_way = pyrtl.select(fill_now, fill_way, hit_way)
+        states[set_index] <<= pyrtl.MemBlock.EnabledWrite(
+            touch(states[set_index], config.ways, touch_way), touch_now
+        )
+
+    if counters is not None:
+        retry = pyrtl.Register(1, name=f"{prefix}retry")
+        retry.next <<= miss | (retry & ~idle)
+        add_counter(lookup & hit & ~retry, counters + "hits")
+        add_counter(miss, counters + "misses")
+        add_counter(miss & all_valid, counters + "evictions")
+        if writable:
+            add_counter(evict_start, counters + "writebacks")
+
+    return data, ready
+
+
+def cache_memories(prefix, block=None):
+    """The memories of each way of a `CacheSetAssociative`, to look up once and
+    pass to `dirty_words` and `dirty_word`.
+
+    :param prefix: the prefix the cache was built with
+    :param block: the block containing the cache (defaults to the working block)
+    :return: list of (tag, data) MemBlocks, empty if there is no such cache
+    """
+    block = pyrtl.working_block(block)
+    ways = []
+    while block.get_memblock_by_name(f"{prefix}tag{len(ways)}") is not None:
+        ways.append((
+            block.get_memblock_by_name(f"{prefix}tag{len(ways)}"),
+            block.get_memblock_by_name(f"{prefix}data{len(ways)}"),
+        ))
+    return ways
+
+
+def _dirty_in(tags, datas, index, entry):
+    # the (address, data address) of the dirty words of a valid tag entry
+    index_bits = tags.addrwidth
+    offset_bits = datas.addrwidth - index_bits
+    tag_bits = tags.bitwidth - 1 - (1 << offset_bits)
+    if not entry >> (tags.bitwidth - 1):
+        return []
+    line = (entry & ((1 << tag_bits) - 1)) << index_bits | index
+    return [
+        (line << offset_bits | word, index << offset_bits | word)
+        for word in range(1 << offset_bits)
+        if entry >> (tag_bits + word) & 1
+    ]
+
+
+def dirty_words(ways, read):
+    """The dirty words of a write-back `CacheSetAssociative`, i.e. what it
+    holds that its memory doesn't have yet. The cache must be idle: a refill
+    overwrites the data of a line before its tag.
+
+    :param ways: the memories of the cache (see `cache_memories`)
+    :param read: function returning the contents of a MemBlock as a dict of
+        address -> value (e.g. `src.sim.inspect_mem` of a simulation)
+    :return: dict of word address -> word
+    """
+    words = dict()
+    for tags, datas in ways:
+        data = read(datas)
+        for index, entry in read(tags).items():
+            for addr, data_addr in _dirty_in(tags, datas, index, entry):
+                words[addr] = data.get(data_addr, 0)
+    return words
+
+
+def dirty_word(ways, read, addr):
+    """The word at addr if a write-back `CacheSetAssociative` holds it dirty.
+    Only the set addr maps to is read, so this is cheap enough to call every
+    cycle. The cache must be idle (see `dirty_words`).
+
+    :param ways: the memories of the cache (see `cache_memories`)
+    :param read: function returning the contents of a MemBlock as a dict-like
+        object (e.g. `inspect_mem` of a simulation)
+    :param addr: the word address
+    :return: the word, or None if the cache doesn't hold it dirty
+    """
+    for tags, datas in ways:
+        index = (addr >> (datas.addrwidth - tags.addrwidth)) & ((1 << tags.addrwidth) - 1)
+        for dirty, data_addr in _dirty_in(tags, datas, index, read(tags).get(index, 0)):
+            if dirty == addr:
+                return read(datas).get(data_addr, 0)
+    return None
+
+
 if __name__ == "__main__":
     ADDRWIDTH = 5
     DATAWIDTH = 32
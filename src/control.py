@@ -78,7 +78,7 @@ def control(op, fn3, fn7):
     mem_read = pyrtl.WireVector(bitwidth=1, name="cont_mem_read")
     alu_imm = pyrtl.WireVector(bitwidth=1, name="cont_alu_imm")
     alu_pc = pyrtl.WireVector(bitwidth=1, name="cont_alu_pc")
-    alu_op = pyrtl.WireVector(bitwidth=4, name="cont_alu_op")
+    alu_op = pyrtl.WireVector(bitwidth=5, name="cont_alu_op")
     mask_mode = pyrtl.WireVector(bitwidth=2, name="cont_mask_mode")
     mem_sign_ext = pyrtl.WireVector(bitwidth=1, name="cont_mem_sign_ext")
 
@@ -0,0 +1,170 @@
+from collections import deque
+
+from .control import Opcode
+from .cpu import ISA, detect_pipeline
+from .events import write_ports
+from .iss import ISS, MASK, SIGN, IllegalInstruction
+from .mem import STORE
+from .program import Result, get_mem, get_wire, read_counters
+from .sim import Backend
+
+# Opcodes of the instructions that write rd
+WRITES_RD = (
+    Opcode.REG,
+    Opcode.IMM,
+    Opcode.LOAD,
+    Opcode.LUI,
+    Opcode.AUIPC,
+    Opcode.JAL,
+    Opcode.JALR,
+)
+
+
+def retire(iss, inst):
+    """Executes one instruction on the reference model.
+
+    :param iss: the ISS, with its pc at the instruction
+    :param inst: the instruction
+    :return: (halt, jumped, rf, dmem) where jumped tells if the instruction was
+        a jump or taken branch, and rf and dmem are the (address, value) written
+        by the instruction, or None
+    """
+    op = inst & 0x7F
+    rd = (inst >> 7) & 0x1F
+    rs1 = iss.regs[(inst >> 15) & 0x1F]
+    rs2 = iss.regs[(inst >> 20) & 0x1F]
+    fn3 = (inst >> 12) & 0x7
+
+    jumped = op in (Opcode.JAL, Opcode.JALR)
+    if op == Opcode.BRANCH:
+        # a taken branch to pc + 4 is still taken, so compare the operands
+        if fn3 in (4, 5):
+            rs1, rs2 = rs1 ^ SIGN, rs2 ^ SIGN
+        jumped = ((rs1 == rs2) if fn3 in (0, 1) else (rs1 < rs2)) ^ (fn3 & 1)
+
+    addr = None
+    if op == Opcode.STORE:
+        imm = ((inst >> 25) << 5 | rd) - ((inst >> 31) << 12)
+        addr = ((rs1 + imm) & MASK) >> 2
+
+    halt = iss.step()
+    rf = (rd, iss.regs[rd]) if op in WRITES_RD and rd != 0 else None
+    dmem = (addr, iss.dmem.load(addr)) if addr is not None else None
+    return halt, jumped, rf, dmem
+
+
+def cosim(
+    program,
+    max_cycles=4096,
+    backend=Backend.INTERPRETED,
+    session=None,
+    isa=ISA.RVI,
+    verbose=True,
+):
+    """Runs a program on the CPU in lockstep with the ISS.
+
+    Every instruction the CPU executes is also executed on the ISS: its pc must
+    match the pc of the ISS, and the register file writes and stores the CPU
+    performs when it reaches memory and writeback must match the ISS exactly
+    (the cycles the pipeline stalls for the data memory don't count). The run
+    stops at the first divergence, which is reported as the only failure.
+    Otherwise it ends when the ISS halts, and the program's assertions are
+    checked as in `Program.execute`.
+
+    :param program: the Program to run
+    :param max_cycles: maximum number of cycles to simulate
+    :param backend: simulation backend, when not using a session
+    :param session: Session to reuse the CPU and simulator of
+    :param isa: ISA extension of the elaborated CPU, when not using a session
+    :param verbose: print the outcome
+    :return: the Result
+    """
+    pipeline = session.pipeline if session is not None else detect_pipeline()
+    isa = session.isa if session is not None else isa
+    pc, inst = get_wire(pipeline.pc), get_wire(pipeline.inst)
+    ((rf_addr, rf_data, rf_enable),) = write_ports(get_mem("rf"))
+    dmem_addr, dmem_data, dmem_enable = (get_wire(name) for name in STORE)
+    stall = get_wire(pipeline.stall) if pipeline.stall is not None else None
+
+    if verbose:
+        print(f"Running program {program.name} (cosim)...")
+
+    sim = program.load(
+        pipeline,
+        session=session,
+        backend=backend,
+        inspect=(rf_addr, rf_data, rf_enable, dmem_addr, dmem_data, dmem_enable),
+    )
+    iss = ISS.from_program(program, isa=isa)
+
+    def written(addr, data, enable):
+        return (sim.inspect(addr), sim.inspect(data)) if sim.inspect(enable) else None
+
+    # (step, pc, inst, write) of the rf and dmem writes of the executed
+    # instructions yet to happen, where steps are the cycles the pipeline
+    # didn't stall in
+    pending = {"rf": deque(), "dmem": deque()}
+    squashed = 0
+    halt = None
+    divergence = None
+    cycle = 0
+    steps = 0
+    while divergence is None and cycle < max_cycles:
+        sim.step({})
+        cycle += 1
+        # While stalled, the instruction in execute is held and nothing is written
+        stalled = stall is not None and sim.inspect(stall)
+        steps += not stalled
+
+        # The instruction in execute must be the next one of the ISS
+        if halt is None and cycle > pipeline.execute and not stalled:
+            if squashed:
+                squashed -= 1
+            elif pipeline.valid is not None and not sim.inspect(pipeline.valid):
+                pass  # a bubble
+            else:
+                x_pc, x_inst = sim.inspect(pc), sim.inspect(inst)
+                if x_pc != iss.pc:
+                    divergence = ("pc", iss.pc, x_pc, x_pc, x_inst)
+                    break
+                try:
+                    halt, jumped, rf, dmem = retire(iss, x_inst)
+                except IllegalInstruction:
+                    divergence = ("illegal instruction", None, x_inst, x_pc, x_inst)
+                    break
+                if jumped and halt is None and pipeline.valid is None:
+                    squashed = pipeline.flushed
+                pending["rf"].append((steps + pipeline.writeback, x_pc, x_inst, rf))
+                pending["dmem"].append((steps + pipeline.memory, x_pc, x_inst, dmem))
+
+        # The writes of this cycle must be those of the instructions in memory
+        # (dmem) and writeback (rf)
+        for name, port in (
+            ("rf", (rf_addr, rf_data, rf_enable)),
+            ("dmem", (dmem_addr, dmem_data, dmem_enable)),
+        ):
+            value = x_pc = x_inst = None
+            if not stalled and pending[name] and pending[name][0][0] == steps:
+                _, x_pc, x_inst, value = pending[name].popleft()
+            actual = written(*port)
+            if actual != value:
+                divergence = (f"{name} write", value, actual, x_pc, x_inst)
+                break
+
+        if halt is not None and not any(pending.values()):
+            break
+
+    if divergence is not None:
+        what, expected, actual, x_pc, x_inst = divergence
+        where = f"at cycle {cycle}"
+        if x_pc is not None:
+            where = f"of pc {x_pc:#x} ({x_inst:#010x}) " + where
+        failures = [(f"{what} {where}", expected, actual)]
+        result = Result(program.name, cycle, failures, halt="diverged")
+    else:
+        result = Result(program.name, cycle, program.check(sim), halt=halt)
+    result.counters = read_counters(sim)
+
+    if verbose:
+        result.report()
+    return result
@@ -4,19 +4,174 @@ from enum import IntEnum
 from .alu import alu_rvi, alu_zbkc, alu_zbkb
 from .control import control, control_zbkb, Opcode, RegWriteSrc, JumpTarget, ImmType
 from .decode import insert_nop, decode_inst, get_immediate
-from .mem import inst_memory, data_memory
+from .mem import inst_memory, inst_memory_cache, data_memory, data_memory_cache
+from .predictor import branch_predictor
 from .rf import reg_file
-from .util import add_register, add_wire
+from .util import add_counter, add_register, add_wire
 
 class ISA():
     RVI  = 'i'
     ZBKB = 'b'
     ZBKC = 'c'
 
+class Pipeline():
+    """Where a pipeline executes instructions, used to tell when a program is done.
+
+    Instructions in the execute stage have had all earlier branches resolved, so
+    they are always on the correct path. They are real instructions, except for
+    the bubbles of a pipeline that stalls, which has a valid wire to tell them
+    apart.
+
+    :param stages: number of pipeline stages
+    :param execute: index of the execute stage (stage 0 is fetch)
+    :param inst: name of the instruction wire of the execute stage
+    :param pc: name of the program counter wire of the execute stage
+    :param fetch: name of the register holding the pc to fetch from
+    :param memory: cycles after execute that an instruction writes dmem in
+        (defaults to `writeback`)
+    :param valid: name of the wire that is low while the execute stage holds a
+        bubble, squashed or inserted by a stall (None if the only bubbles are the
+        `flushed` instructions after each jump)
+    :param stall: name of the wire that is high while every stage after fetch
+        holds its instruction, waiting for the data memory (None if it never
+        waits); the cycles it is high don't count towards `memory` and
+        `writeback`
+    """
+
+    def __init__(self, stages, execute, inst, pc, fetch, memory=None, valid=None, stall=None):
+        self.stages = stages
+        self.execute = execute
+        self.inst = inst
+        self.pc = pc
+        self.fetch = fetch
+        self.memory = memory if memory is not None else self.writeback
+        self.valid = valid
+        self.stall = stall
+
+    @property
+    def wires(self):
+        """Names of the wires to inspect to follow the execute stage."""
+        return (self.pc, self.inst) + tuple(w for w in (self.valid, self.stall) if w is not None)
+
+    @property
+    def writeback(self):
+        """Cycles after execute that an instruction writes rf in."""
+        return self.stages - self.execute - 1
+
+    @property
+    def flushed(self):
+        """Younger instructions squashed when the instruction in execute jumps
+        (without a branch predictor).
+
+        They were fetched before the jump resolved and reach execute as bubbles.
+        """
+        return self.execute
+
+PIPELINES = {
+    1: Pipeline(stages=1, execute=0, inst="inst", pc="pc", fetch="pc"),
+    2: Pipeline(stages=2, execute=0, inst="inst", pc="next_pc", fetch="next_pc"),
+    3: Pipeline(
+        stages=3, execute=1, inst="x_inst", pc="x_pc", fetch="pc", valid="x_valid", stall="mem_stall"
+    ),
+    5: Pipeline(
+        stages=5, execute=2, inst="x_inst", pc="x_pc", fetch="f_pc", memory=1, valid="x_valid"
+    ),
+}
+
+def detect_pipeline(block=None):
+    """Finds which of the `PIPELINES` was elaborated into a block.
+
+    :param block: the block to inspect (defaults to the working block)
+    :return: the Pipeline with the most stages whose wires are in the block
+    """
+    block = pyrtl.working_block(block)
+    for num_stages in sorted(PIPELINES, reverse=True):
+        pipeline = PIPELINES[num_stages]
+        names = block.wirevector_by_name
+        if all(name in names for name in (pipeline.inst, pipeline.pc, pipeline.fetch)):
+            return pipeline
+    raise ValueError("no known pipeline in block")
+
+class Counter():
+    """Names of the performance counter Outputs added by `rv_cpu(counters=True)`."""
+
+    CYCLES = "perf_cycles"  # clock cycles
+    INSTRET = "perf_instret"  # instructions retired (i.e. written back)
+    BRANCHES_TAKEN = "perf_branches_taken"  # conditional branches taken
+    FLUSHES = "perf_flushes"  # wrong-path instructions replaced by a bubble
+    LOADS = "perf_loads"  # loads retired
+    STORES = "perf_stores"  # stores retired
+    STALLS = "perf_stalls"  # bubbles inserted by load-use interlocks
+    MISPREDICTS = "perf_mispredicts"  # branches and jumps the predictor got wrong
+    ICACHE_STALLS = "perf_icache_stalls"  # bubbles inserted while the icache refills
+    ICACHE_HITS = "perf_icache_hits"  # icache lookups that hit
+    ICACHE_MISSES = "perf_icache_misses"  # icache lookups that missed
+    ICACHE_EVICTIONS = "perf_icache_evictions"  # icache misses that replaced a valid line
+    DCACHE_STALLS = "perf_dcache_stalls"  # cycles the pipeline holds while the dcache is busy
+    DCACHE_HITS = "perf_dcache_hits"  # loads and stores that hit in the dcache
+    DCACHE_MISSES = "perf_dcache_misses"  # loads and stores that missed
+    DCACHE_EVICTIONS = "perf_dcache_evictions"  # dcache misses that replaced a valid line
+    DCACHE_WRITEBACKS = "perf_dcache_writebacks"  # dcache evictions of a dirty line
+
+    # prefixes of the cache counters, added by the caches themselves
+    ICACHE = "perf_icache_"
+    DCACHE = "perf_dcache_"
+
+    ALL = (
+        CYCLES, INSTRET, BRANCHES_TAKEN, FLUSHES, LOADS, STORES, STALLS, MISPREDICTS,
+        ICACHE_STALLS, ICACHE_HITS, ICACHE_MISSES, ICACHE_EVICTIONS,
+        DCACHE_STALLS, DCACHE_HITS, DCACHE_MISSES, DCACHE_EVICTIONS, DCACHE_WRITEBACKS,
+    )
+
+def perf_counters(
+    retire,
+    branch_taken,
+    load,
+    store,
+    flush=None,
+    stall=None,
+    mispredict=None,
+    icache_stall=None,
+    dcache_stall=None,
+):
+    """Adds the performance counters to a design.
+
+    :param retire: an instruction (not a bubble) is written back this cycle,
+        which is when it retires
+    :param branch_taken: a conditional branch is taken this cycle
+    :param load: a load is written back this cycle
+    :param store: a store is written back this cycle
+    :param flush: number of fetched instructions squashed this cycle (None if
+        the pipeline never squashes)
+    :param stall: a bubble is inserted this cycle (None if the pipeline never
+        stalls)
+    :param mispredict: a branch or jump was mispredicted this cycle (None if the
+        pipeline has no branch predictor)
+    :param icache_stall: fetch waits for the instruction cache this cycle (None
+        if the pipeline has no instruction cache)
+    :param dcache_stall: the pipeline waits for the data cache this cycle (None
+        if the pipeline has no data cache)
+    """
+    add_counter(pyrtl.Const(1), Counter.CYCLES)
+    add_counter(retire, Counter.INSTRET)
+    add_counter(branch_taken, Counter.BRANCHES_TAKEN)
+    if flush is not None:
+        add_counter(flush, Counter.FLUSHES)
+    add_counter(load, Counter.LOADS)
+    add_counter(store, Counter.STORES)
+    if stall is not None:
+        add_counter(stall, Counter.STALLS)
+    if mispredict is not None:
+        add_counter(mispredict, Counter.MISPREDICTS)
+    if icache_stall is not None:
+        add_counter(icache_stall, Counter.ICACHE_STALLS)
+    if dcache_stall is not None:
+        add_counter(dcache_stall, Counter.DCACHE_STALLS)
+
 ################################################################################
 # Single-cycle
 ################################################################################
-def cpu(control=control, isa=ISA.RVI):
+def cpu(control=control, isa=ISA.RVI, counters=False):
     pc = pyrtl.wire.Register(bitwidth=32, name="pc")  # program counter
     pc_plus_4 = add_wire(pc + 4, len(pc))  # program counter plus four
 
@@ -111,12 +266,20 @@ def cpu(control=control, isa=ISA.RVI):
         with pyrtl.otherwise:
             pc.next |= pc_plus_4
 
+    if counters:
+        perf_counters(
+            retire=pyrtl.Const(1),
+            branch_taken=cont_branch & taken,
+            load=cont_mem_read,
+            store=cont_mem_write,
+        )
+
     return inst_mem  # return ref to instruction memory unit
 
 ################################################################################
 # Two-stage, (branch resolution in stage 1)
 ################################################################################
-def cpu_two_stage(control=control, isa=ISA.RVI):
+def cpu_two_stage(control=control, isa=ISA.RVI, counters=False):
 
     ############################################################################
     # Stage 1: Instruction fetch, decode, execute
@@ -266,12 +429,22 @@ def cpu_two_stage(control=control, isa=ISA.RVI):
         with instruction_commit:
             pc.next |= next_pc
 
+    if counters:
+        perf_counters(
+            retire=instruction_commit,
+            branch_taken=cont_branch & taken,
+            load=wb_cont_mem_read,
+            store=wb_cont_mem_write,
+        )
+
     return inst_mem  # return ref to instruction memory unit
 
 ################################################################################
 # Three-stage
 ################################################################################
-def cpu_three_stage(control=control, isa=ISA.RVI):
+def cpu_three_stage(
+    control=control, isa=ISA.RVI, counters=False, predictor=0, icache=None, dcache=None
+):
 
     ############################################################################
     # Stage 1: Instruction fetch
@@ -280,9 +453,19 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
     pc = pyrtl.Register(bitwidth=32, name="pc")
     pc_plus_4 = add_wire(pc + 4, len(pc))
 
-    # fetch (using instruction cache)
-    # inst_mem, inst, cache_ready = inst_memory_cache(pc=pc)
-    inst_mem, inst = inst_memory(pc=pc)
+    # the whole pipeline holds while the data cache is busy with the access in
+    # writeback
+    mem_stall = pyrtl.WireVector(bitwidth=1, name="mem_stall")
+
+    # fetch, from an instruction cache that is not ready on a miss, or an ideal
+    # memory that always is
+    if icache:
+        inst_mem, inst, inst_ready = inst_memory_cache(
+            pc=pc, config=icache, request=~mem_stall, counters=Counter.ICACHE if counters else None
+        )
+    else:
+        inst_mem, inst = inst_memory(pc=pc)
+        inst_ready = pyrtl.Const(1, bitwidth=1)
 
     # pipeline registers
     x_inst = pyrtl.Register(bitwidth=32, name="x_inst")
@@ -293,20 +476,57 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
     # fetch_valid = pyrtl.Register(bitwidth=1, name="fetch_valid")
 
     ctrl_hazard = pyrtl.WireVector(bitwidth=1, name='ctrl_hazard')
-    x_pc.next <<= pc
-    x_pc_plus_4.next <<= pc_plus_4
+
+    # x_inst is only a real instruction after the first cycle, when the
+    # previous one did not flush it and when it was fetched
+    x_valid = pyrtl.Register(bitwidth=1, name="x_valid")
+
+    # branch prediction: fetch from the predicted target, and resolve the
+    # prediction in execute
+    fetch_pc = pc_plus_4
+    if predictor:
+        x_taken = pyrtl.WireVector(bitwidth=1)
+        x_target = pyrtl.WireVector(bitwidth=32)
+        x_resolved = pyrtl.WireVector(bitwidth=1)
+        x_jump = pyrtl.WireVector(bitwidth=1)
+        pred_taken, pred_target = branch_predictor(
+            pc=pc,
+            entries=predictor,
+            update=x_resolved,
+            update_pc=x_pc,
+            taken=x_taken,
+            jump=x_jump,
+            target=x_target,
+        )
+        fetch_pc = pyrtl.select(pred_taken, pred_target, pc_plus_4)
+        x_pred_taken = pyrtl.Register(bitwidth=1, name="x_pred_taken")
+        x_pred_target = pyrtl.Register(bitwidth=32, name="x_pred_target")
 
     branch_target = pyrtl.WireVector(bitwidth=32, name='branch_target')
     # pc update
     with pyrtl.conditional_assignment:
-        with ctrl_hazard:
-            pc.next |= branch_target
-            x_inst.next |= pyrtl.Const(19, bitwidth=len(inst)) # nop
-            # fetch_valid.next |= 0
-        with pyrtl.otherwise:
-            pc.next |= pc_plus_4
-            x_inst.next |= inst
-            # fetch_valid.next |= 1
+        with ~mem_stall:
+            x_pc.next |= pc
+            x_pc_plus_4.next |= pc_plus_4
+            x_valid.next |= ~ctrl_hazard & inst_ready
+            if predictor:
+                x_pred_target.next |= pred_target
+            with ctrl_hazard:
+                pc.next |= branch_target
+                x_inst.next |= pyrtl.Const(19, bitwidth=len(inst)) # nop
+                if predictor:
+                    x_pred_taken.next |= 0
+                # fetch_valid.next |= 0
+            with ~inst_ready:  # hold pc until the cache refills
+                x_inst.next |= pyrtl.Const(19, bitwidth=len(inst)) # nop
+                if predictor:
+                    x_pred_taken.next |= 0
+            with pyrtl.otherwise:
+                pc.next |= fetch_pc
+                x_inst.next |= inst
+                if predictor:
+                    x_pred_taken.next |= pred_taken
+                # fetch_valid.next |= 1
 
     ############################################################################
     # Stage 2: Instruction decode, execute (x)
@@ -348,7 +568,7 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
         # Stage 2 (Write Back):
         rd=wb_rd,
         write_data=reg_write_data,
-        write=wb_reg_write_enable,
+        write=wb_reg_write_enable & ~mem_stall,
     )
 
     # forwarding
@@ -378,7 +598,7 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
     elif isa == ISA.ZBKB:
         alu_out = alu_zbkb(
             op=cont_alu_op,
-            in1=pyrtl.mux(cont_alu_pc, rs1_val, next_pc),
+            in1=pyrtl.mux(cont_alu_pc, rs1_val, x_pc),
             in2=pyrtl.mux(cont_alu_imm, rs2_val, inst_imm),
         )
 
@@ -389,8 +609,21 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
     target = pyrtl.enum_mux(
         cont_target, {JumpTarget.IMM: x_pc + inst_imm, JumpTarget.ALU: alu_out}
     )
-    ctrl_hazard <<= taken
-    branch_target <<= target
+    if predictor:
+        # the next instruction was fetched from the wrong pc if the prediction
+        # disagrees with the branch, or the target with its target
+        x_taken <<= taken
+        x_target <<= target
+        x_resolved <<= (cont_jump | cont_branch) & ~mem_stall
+        x_jump <<= cont_jump
+        mispredict = add_wire(
+            (taken != x_pred_taken) | (taken & (x_target != x_pred_target)), name="mispredict"
+        )
+        ctrl_hazard <<= mispredict
+        branch_target <<= pyrtl.select(taken, x_target, x_pc_plus_4)
+    else:
+        ctrl_hazard <<= taken
+        branch_target <<= target
 
     wb_cont_mem_read = pyrtl.Register(name='wb_cont_mem_read', bitwidth=1)
     wb_cont_mem_write = pyrtl.Register(name='wb_cont_mem_write', bitwidth=1)
@@ -400,26 +633,29 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
     wb_mem_address = pyrtl.Register(name='wb_mem_address', bitwidth=32)
     wb_mem_write_data = pyrtl.Register(name='wb_mem_write_data', bitwidth=32)
 
-    wb_cont_mem_read.next <<= cont_mem_read
-    wb_cont_mem_write.next <<= cont_mem_write
-    wb_cont_mem_sign_ext.next <<= cont_mem_sign_ext
-    wb_cont_mask_mode.next <<= cont_mask_mode
+    with pyrtl.conditional_assignment:
+        with ~mem_stall:
+            wb_cont_mem_read.next |= cont_mem_read
+            wb_cont_mem_write.next |= cont_mem_write
+            wb_cont_mem_sign_ext.next |= cont_mem_sign_ext
+            wb_cont_mask_mode.next |= cont_mask_mode
 
-    wb_rd.next <<= inst_rd
-    wb_reg_write_data.next <<= pyrtl.enum_mux(
-        cont_reg_write_src, {RegWriteSrc.ALU: alu_out, RegWriteSrc.PC: x_pc_plus_4}
-    )
-    wb_reg_write_enable.next <<= cont_reg_write | cont_mem_read
+            wb_rd.next |= inst_rd
+            wb_reg_write_data.next |= pyrtl.enum_mux(
+                cont_reg_write_src, {RegWriteSrc.ALU: alu_out, RegWriteSrc.PC: x_pc_plus_4}
+            )
+            wb_reg_write_enable.next |= cont_reg_write | cont_mem_read
 
-    wb_mem_address.next <<= alu_out
-    wb_mem_write_data.next <<= rs2_val
+            wb_mem_address.next |= alu_out
+            wb_mem_write_data.next |= rs2_val
 
     ############################################################################
     # Stage 3: Memory and Write Back (wb)
     ############################################################################
 
-    # data memory
-    read_data = data_memory(
+    # data memory, from a data cache that is not ready on a miss, or an ideal
+    # memory that always is
+    mem_ports = dict(
         addr=wb_mem_address,
         write_data=wb_mem_write_data,
         read=wb_cont_mem_read,
@@ -427,6 +663,14 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
         mask_mode=wb_cont_mask_mode,
         sign_ext=wb_cont_mem_sign_ext,
     )
+    if dcache:
+        read_data, mem_ready = data_memory_cache(
+            **mem_ports, config=dcache, counters=Counter.DCACHE if counters else None
+        )
+        mem_stall <<= (wb_cont_mem_read | wb_cont_mem_write) & ~mem_ready
+    else:
+        read_data = data_memory(**mem_ports)
+        mem_stall <<= 0
 
     # compute reg write data
     reg_write_data <<= pyrtl.mux(
@@ -435,19 +679,324 @@ def cpu_three_stage(control=control, isa=ISA.RVI):
         read_data,
     )
 
+    if counters:
+        wb_valid = pyrtl.Register(bitwidth=1, name="wb_valid")
+        wb_valid.next <<= pyrtl.select(mem_stall, wb_valid, x_valid)
+        # a stalled cycle only counts as a data cache stall
+        advance = ~mem_stall
+        perf_counters(
+            retire=wb_valid & advance,
+            branch_taken=cont_branch & taken & advance,
+            load=wb_cont_mem_read & advance,
+            store=wb_cont_mem_write & advance,
+            flush=ctrl_hazard & advance,
+            mispredict=ctrl_hazard & advance if predictor else None,
+            icache_stall=~inst_ready & ~ctrl_hazard & advance if icache else None,
+            dcache_stall=mem_stall if dcache else None,
+        )
+
     return inst_mem  # return ref to instruction memory unit
 
-def rv_cpu(num_stages=1, isa=ISA.RVI):
+################################################################################
+# Five-stage (IF/ID/EX/MEM/WB)
+################################################################################
+def cpu_five_stage(control=control, isa=ISA.RVI, counters=False):
+
+    # Each pipeline register is prefixed with the stage it feeds: f (fetch),
+    # d (decode), x (execute), m (memory) and wb (write back)
+
+    ############################################################################
+    # Stage 1: Instruction fetch (f)
+    ############################################################################
+
+    f_pc = pyrtl.Register(bitwidth=32, name="f_pc")
+    f_pc_plus_4 = add_wire(f_pc + 4, len(f_pc))
+
+    inst_mem, inst = inst_memory(pc=f_pc)
+
+    # pipeline registers
+    d_inst = pyrtl.Register(bitwidth=32, name="d_inst")
+    d_pc = pyrtl.Register(bitwidth=32, name="d_pc")
+    d_pc_plus_4 = pyrtl.Register(bitwidth=32, name="d_pc_plus_4")
+    d_valid = pyrtl.Register(bitwidth=1, name="d_valid")  # not a reset value or flushed
+
+    ctrl_hazard = pyrtl.WireVector(bitwidth=1, name='ctrl_hazard')
+    data_hazard = pyrtl.WireVector(bitwidth=1, name='data_hazard')
+    branch_target = pyrtl.WireVector(bitwidth=32, name='branch_target')
+
+    # pc update: a taken jump in execute squashes the instructions in fetch and
+    # decode, a load-use hazard holds them for a cycle
+    with pyrtl.conditional_assignment:
+        with ctrl_hazard:
+            f_pc.next |= branch_target
+            d_inst.next |= pyrtl.Const(19, bitwidth=len(inst))  # nop
+            d_valid.next |= 0
+        with data_hazard:
+            pass
+        with pyrtl.otherwise:
+            f_pc.next |= f_pc_plus_4
+            d_inst.next |= inst
+            d_pc.next |= f_pc
+            d_pc_plus_4.next |= f_pc_plus_4
+            d_valid.next |= 1
+
+    ############################################################################
+    # Stage 2: Instruction decode (d)
+    ############################################################################
+
+    inst_fn7, inst_rs2, inst_rs1, inst_fn3, inst_rd, inst_op = decode_inst(
+        d_inst, nop=None
+    )
+
+    # define control block
+    (
+        cont_imm_type,  # (3) type of instruction (R, I, S, etc.)
+        cont_jump,  # (1) unconditional jump is taken
+        cont_target,  # (1) jump to immediate or alu_out
+        cont_branch,  # (1) conditional branch is taken
+        cont_branch_inv,  # (1) branch is taken if alu_out != 0
+        cont_reg_write,  # (1) register rd is updated
+        cont_reg_write_src,  # (1) write alu_out or pc+4 to rd
+        cont_mem_write,  # (1) write to memory
+        cont_mem_read,  # (1) read from memory
+        cont_alu_imm,  # (1) alu_in2 from register or immediate
+        cont_alu_pc,  # (1) alu_in1 from register or pc
+        cont_alu_op,  # (4--5) alu operation to use
+        cont_mask_mode,  # (2) whether to r/w byte, short, or word
+        cont_mem_sign_ext,  # (1) zero extend read_data
+    ) = control(op=inst_op, fn3=inst_fn3, fn7=inst_fn7, imm=d_inst[20:32]) if isa == ISA.ZBKB else \
+        control(op=inst_op, fn3=inst_fn3, fn7=inst_fn7)
+
+    # parse immediate
+    inst_imm = get_immediate(d_inst, cont_imm_type)
+
+    # register file
+    reg_write_data = pyrtl.WireVector(bitwidth=32, name='reg_write_data')
+    wb_rd = pyrtl.Register(name='wb_rd', bitwidth=5)
+    wb_reg_write_enable = pyrtl.Register(name='wb_reg_write_enable', bitwidth=1)
+    rs1_val, rs2_val = reg_file(
+        rs1=inst_rs1,
+        rs2=inst_rs2,
+        # Stage 5 (Write Back):
+        rd=wb_rd,
+        write_data=reg_write_data,
+        write=wb_reg_write_enable,
+    )
+
+    # the register file is written at the end of the cycle, so pass the value
+    # being written back through to decode
+    rs1_val = pyrtl.select(
+        wb_reg_write_enable & (wb_rd == inst_rs1) & (wb_rd != 0),
+        reg_write_data,
+        rs1_val)
+
+    rs2_val = pyrtl.select(
+        wb_reg_write_enable & (wb_rd == inst_rs2) & (wb_rd != 0),
+        reg_write_data,
+        rs2_val)
+
+    # load-use interlock: a load in execute only has its data in memory, so an
+    # instruction using it waits in decode for a cycle (behind a bubble) and
+    # then gets it forwarded from write back
+    x_mem_read = pyrtl.Register(name='x_mem_read', bitwidth=1)
+    x_rd = pyrtl.Register(name='x_rd', bitwidth=5)
+    uses_rs2 = ~cont_alu_imm | cont_mem_write
+    data_hazard <<= d_valid & x_mem_read & (x_rd != 0) & (
+        (x_rd == inst_rs1) | (uses_rs2 & (x_rd == inst_rs2))
+    )
+
+    # pipeline registers
+    x_inst = pyrtl.Register(bitwidth=32, name="x_inst")
+    x_valid = pyrtl.Register(bitwidth=1, name="x_valid")
+    x_jump = pyrtl.Register(name='x_jump', bitwidth=1)
+    x_branch = pyrtl.Register(name='x_branch', bitwidth=1)
+    x_reg_write = pyrtl.Register(name='x_reg_write', bitwidth=1)
+    x_mem_write = pyrtl.Register(name='x_mem_write', bitwidth=1)
+
+    # bubble: the instruction in decode does not move on to execute
+    with pyrtl.conditional_assignment:
+        with ctrl_hazard | data_hazard | ~d_valid:
+            x_inst.next |= pyrtl.Const(19, bitwidth=len(d_inst))  # nop
+            x_valid.next |= 0
+            x_jump.next |= 0
+            x_branch.next |= 0
+            x_reg_write.next |= 0
+            x_mem_read.next |= 0
+            x_mem_write.next |= 0
+        with pyrtl.otherwise:
+            x_inst.next |= d_inst
+            x_valid.next |= 1
+            x_jump.next |= cont_jump
+            x_branch.next |= cont_branch
+            x_reg_write.next |= cont_reg_write | cont_mem_read
+            x_mem_read.next |= cont_mem_read
+            x_mem_write.next |= cont_mem_write
+
+    x_pc = add_register(d_pc, name="x_pc")
+    x_pc_plus_4 = add_register(d_pc_plus_4, name="x_pc_plus_4")
+    x_rd.next <<= inst_rd
+    x_rs1 = add_register(inst_rs1, name="x_rs1")
+    x_rs2 = add_register(inst_rs2, name="x_rs2")
+    x_rs1_val = add_register(rs1_val, name="x_rs1_val")
+    x_rs2_val = add_register(rs2_val, name="x_rs2_val")
+    x_imm = add_register(inst_imm, name="x_imm")
+    x_target = add_register(cont_target, name="x_target")
+    x_branch_inv = add_register(cont_branch_inv, name="x_branch_inv")
+    x_reg_write_src = add_register(cont_reg_write_src, name="x_reg_write_src")
+    x_alu_imm = add_register(cont_alu_imm, name="x_alu_imm")
+    x_alu_pc = add_register(cont_alu_pc, name="x_alu_pc")
+    x_alu_op = add_register(cont_alu_op, name="x_alu_op")
+    x_mask_mode = add_register(cont_mask_mode, name="x_mask_mode")
+    x_mem_sign_ext = add_register(cont_mem_sign_ext, name="x_mem_sign_ext")
+
+    ############################################################################
+    # Stage 3: Execute (x)
+    ############################################################################
+
+    m_rd = pyrtl.Register(name='m_rd', bitwidth=5)
+    m_reg_write = pyrtl.Register(name='m_reg_write', bitwidth=1)
+    m_mem_read = pyrtl.Register(name='m_mem_read', bitwidth=1)
+    m_result = pyrtl.Register(name='m_result', bitwidth=32)
+
+    # forwarding, from the instruction in memory first (the interlock keeps the
+    # users of a load out of execute while it is there), then write back
+    def forward(rs, val):
+        return pyrtl.select(
+            m_reg_write & (m_rd == rs) & (m_rd != 0),
+            m_result,
+            pyrtl.select(
+                wb_reg_write_enable & (wb_rd == rs) & (wb_rd != 0),
+                reg_write_data,
+                val))
+
+    x_rs1_val = forward(x_rs1, x_rs1_val)
+    x_rs2_val = forward(x_rs2, x_rs2_val)
+
+    # alu
+    if isa == ISA.RVI:
+        alu_out = alu_rvi(
+            op=x_alu_op,
+            in1=pyrtl.mux(x_alu_pc, x_rs1_val, x_pc),
+            in2=pyrtl.mux(x_alu_imm, x_rs2_val, x_imm),
+        )
+    elif isa == ISA.ZBKC:
+        alu_out = alu_zbkc(
+            op=x_alu_op,
+            in1=pyrtl.mux(x_alu_pc, x_rs1_val, x_pc),
+            in2=pyrtl.mux(x_alu_imm, x_rs2_val, x_imm),
+        )
+    elif isa == ISA.ZBKB:
+        alu_out = alu_zbkb(
+            op=x_alu_op,
+            in1=pyrtl.mux(x_alu_pc, x_rs1_val, x_pc),
+            in2=pyrtl.mux(x_alu_imm, x_rs2_val, x_imm),
+        )
+
+    # compute next pc
+    taken = add_wire(
+        x_jump | (x_branch & ((alu_out == 0) ^ x_branch_inv)), name="taken"
+    )
+    target = pyrtl.enum_mux(
+        x_target, {JumpTarget.IMM: x_pc + x_imm, JumpTarget.ALU: alu_out}
+    )
+    ctrl_hazard <<= taken
+    branch_target <<= target
+
+    m_valid = add_register(x_valid, name="m_valid")
+    m_rd.next <<= x_rd
+    m_reg_write.next <<= x_reg_write
+    m_mem_read.next <<= x_mem_read
+    m_mem_write = add_register(x_mem_write, name="m_mem_write")
+    m_mask_mode = add_register(x_mask_mode, name="m_mask_mode")
+    m_mem_sign_ext = add_register(x_mem_sign_ext, name="m_mem_sign_ext")
+    m_result.next <<= pyrtl.enum_mux(
+        x_reg_write_src, {RegWriteSrc.ALU: alu_out, RegWriteSrc.PC: x_pc_plus_4}
+    )
+    m_mem_address = add_register(alu_out, name="m_mem_address")
+    m_mem_write_data = add_register(x_rs2_val, name="m_mem_write_data")
+
+    ############################################################################
+    # Stage 4: Memory (m)
+    ############################################################################
+
+    # data memory
+    read_data = data_memory(
+        addr=m_mem_address,
+        write_data=m_mem_write_data,
+        read=m_mem_read,
+        write=m_mem_write,
+        mask_mode=m_mask_mode,
+        sign_ext=m_mem_sign_ext,
+    )
+
+    wb_valid = add_register(m_valid, name="wb_valid")
+    wb_rd.next <<= m_rd
+    wb_reg_write_enable.next <<= m_reg_write
+    wb_reg_write_data = add_register(
+        pyrtl.mux(m_mem_read, m_result, read_data), name="wb_reg_write_data"
+    )
+
+    ############################################################################
+    # Stage 5: Write Back (wb)
+    ############################################################################
+
+    reg_write_data <<= wb_reg_write_data
+
+    if counters:
+        perf_counters(
+            retire=wb_valid,
+            branch_taken=x_branch & taken,
+            load=m_mem_read,
+            store=m_mem_write,
+            # both instructions behind a taken jump are squashed
+            flush=pyrtl.concat(ctrl_hazard, pyrtl.Const(0, bitwidth=1)),
+            stall=data_hazard,
+        )
+
+    return inst_mem  # return ref to instruction memory unit
+
+def rv_cpu(num_stages=1, isa=ISA.RVI, counters=False, predictor=0, icache=None, dcache=None):
+    """Elaborates a CPU into the working block.
+
+    :param num_stages: number of pipeline stages (1, 2, 3 or 5)
+    :param isa: ISA extension (see `ISA`)
+    :param counters: add the performance counters (see `Counter`)
+    :param predictor: number of entries of the branch predictor (see
+        `src.predictor`), 0 for none; only for the three-stage pipeline
+    :param icache: the geometry of the instruction cache (a
+        `src.cache.CacheConfig`), None to fetch straight from imem; only for the
+        three-stage pipeline
+    :param dcache: the geometry of the write-back data cache (a
+        `src.cache.CacheConfig`), None to access dmem directly; only for the
+        three-stage pipeline
+    :return: the instruction memory
+    """
+    if predictor and num_stages != 3:
+        raise ValueError("the branch predictor is only available in the three-stage pipeline")
+    if icache and num_stages != 3:
+        raise ValueError("the instruction cache is only available in the three-stage pipeline")
+    if dcache and num_stages != 3:
+        raise ValueError("the data cache is only available in the three-stage pipeline")
+
     selected_control = control
     if isa == ISA.ZBKB:
         selected_control = control_zbkb
     # default `control` covers RVI and ZBKC
 
     if num_stages == 1:
-        return cpu(control=selected_control, isa=isa)
+        return cpu(control=selected_control, isa=isa, counters=counters)
     elif num_stages == 2:
-        return cpu_two_stage(control=selected_control, isa=isa)
+        return cpu_two_stage(control=selected_control, isa=isa, counters=counters)
     elif num_stages == 3:
-        return cpu_three_stage(control=selected_control, isa=isa)
+        return cpu_three_stage(
+            control=selected_control,
+            isa=isa,
+            counters=counters,
+            predictor=predictor,
+            icache=icache,
+            dcache=dcache,
+        )
+    elif num_stages == 5:
+        return cpu_five_stage(control=selected_control, isa=isa, counters=counters)
     else:
         raise ValueError("invalid number of pipeline stages")
@@ -0,0 +1,128 @@
+import json
+import pyrtl
+
+
+def write_ports(mem, block=None):
+    """Finds the write ports of a memory.
+
+    :param mem: the memory block
+    :param block: the block containing it (defaults to the working block)
+    :return: list of (addr, data, enable) wires, one per write port
+    """
+    return [
+        tuple(net.args)
+        for net in pyrtl.working_block(block).logic_subset("@")
+        if net.op_param[1] is mem
+    ]
+
+
+class EventLog:
+    """Writes what changed on each cycle of a program to a JSON Lines file.
+
+    The first line is a header with the initial memory contents; every following
+    line is one cycle with the pc and instruction in the execute stage plus the
+    writes the register file and data memory performed at the end of it:
+
+        {"cycle": 3, "pc": 8, "inst": 19, "rf": [[10, 18]], "dmem": [[64, 5]]}
+
+    `replay` rebuilds the full state at any cycle from the log.
+
+    :param file: path of the log to write
+    :param program: name of the program
+    :param mems: map of memory name -> memory block to record the writes of, or
+        the (addr, data, enable) wires of its writes (e.g. the stores of the
+        core, when a cache sits in front of the memory)
+    :param initial: map of memory name -> initial {address: value} contents
+    """
+
+    def __init__(self, file, program, mems, initial=None):
+        self.file = open(file, "w")
+        self.ports = {
+            name: mem if isinstance(mem, (list, tuple)) else write_ports(mem)
+            for name, mem in mems.items()
+        }
+        initial = initial if initial is not None else {}
+        self._write(
+            {
+                "program": program,
+                "initial": {
+                    name: sorted(initial.get(name, {}).items()) for name in mems
+                },
+            }
+        )
+
+    def wires(self):
+        """The wires `record` inspects (besides pc/inst)."""
+        return [wire for ports in self.ports.values() for port in ports for wire in port]
+
+    def record(self, sim, cycle, pc, inst):
+        """Records the cycle that was just simulated.
+
+        :param sim: the simulation object
+        :param cycle: number of cycles simulated so far
+        :param pc: the pc wire to record
+        :param inst: the instruction wire to record
+        """
+        event = {"cycle": cycle, "pc": sim.inspect(pc), "inst": sim.inspect(inst)}
+        for name, ports in self.ports.items():
+            writes = [
+                [sim.inspect(addr), sim.inspect(data)]
+                for addr, data, enable in ports
+                if sim.inspect(enable)
+            ]
+            if writes:
+                event[name] = writes
+        self._write(event)
+
+    def close(self):
+        self.file.close()
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def replay(file, cycle=None):
+    """Rebuilds the state of a program from its event log.
+
+    :param file: path of the log
+    :param cycle: the cycle to stop after (defaults to the last one)
+    :return: dict with the cycle, pc, inst and the contents of each memory
+    """
+    with open(file) as log:
+        header = json.loads(next(log))
+        state = {"cycle": 0, "pc": None, "inst": None}
+        for name, contents in header["initial"].items():
+            state[name] = dict(contents)
+
+        for line in log:
+            event = json.loads(line)
+            if cycle is not None and event["cycle"] > cycle:
+                break
+            state["cycle"], state["pc"], state["inst"] = (
+                event["cycle"],
+                event["pc"],
+                event["inst"],
+            )
+            for name, writes in event.items():
+                if name in header["initial"]:
+                    state[name].update(writes)
+    return state
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser("Rebuild the CPU state from an event log.")
+    parser.add_argument("log", type=str, help="event log written by Program.execute")
+    parser.add_argument(
+        "-c", "--cycle", type=int, dest="cycle", help="cycle to stop after (default: last)"
+    )
+    args = parser.parse_args()
+
+    state = replay(args.log, args.cycle)
+    print(f"CYCLE: {state['cycle']}")
+    if state["pc"] is not None:
+        print(f"INST: {state['pc']:#0x} ({state['inst']:#0{10}x})")
+    for name in state:
+        if name not in ("cycle", "pc", "inst"):
+            print(f"{name.upper()}: {state[name]}")
@@ -0,0 +1,540 @@
+from array import array
+
+from .control import ALUOp, MaskMode, Opcode
+from .cpu import ISA
+from .program import EBREAK, ECALL, PASS, TOHOST, Halt
+
+MASK = 0xFFFFFFFF
+SIGN = 0x80000000
+
+PAGE_BITS = 10
+PAGE_WORDS = 1 << PAGE_BITS
+
+MISC_MEM = 0b0001111  # fence, which this core executes as a nop
+
+
+def _signed(a):
+    return a - ((a & SIGN) << 1)
+
+
+def _rotr(a, b):
+    b &= 31
+    return ((a >> b) | (a << (32 - b))) & MASK
+
+
+def _zip(a):
+    out = 0
+    for i in range(16):
+        out |= ((a >> i) & 1) << (2 * i) | ((a >> (i + 16)) & 1) << (2 * i + 1)
+    return out
+
+
+def _unzip(a):
+    out = 0
+    for i in range(16):
+        out |= ((a >> (2 * i)) & 1) << i | ((a >> (2 * i + 1)) & 1) << (i + 16)
+    return out
+
+
+def _revb(a):
+    out = 0
+    for i in range(32):
+        out |= ((a >> i) & 1) << ((i & ~7) | (7 - (i & 7)))
+    return out
+
+
+def _clmul(a, b):
+    out = 0
+    for i in range(32):
+        if (b >> i) & 1:
+            out ^= a << i
+    return out
+
+
+# The ALU operations on unsigned 32-bit values, mirroring `alu_zbkb`/`alu_zbkc`
+ALU = {
+    ALUOp.ADD: lambda a, b: (a + b) & MASK,
+    ALUOp.SUB: lambda a, b: (a - b) & MASK,
+    ALUOp.SLL: lambda a, b: (a << (b & 31)) & MASK,
+    ALUOp.SLT: lambda a, b: int((a ^ SIGN) < (b ^ SIGN)),
+    ALUOp.SLTU: lambda a, b: int(a < b),
+    ALUOp.XOR: lambda a, b: a ^ b,
+    ALUOp.SRL: lambda a, b: a >> (b & 31),
+    ALUOp.SRA: lambda a, b: (_signed(a) >> (b & 31)) & MASK,
+    ALUOp.OR: lambda a, b: a | b,
+    ALUOp.AND: lambda a, b: a & b,
+    ALUOp.IMM: lambda a, b: b,
+    ALUOp.ROR: _rotr,
+    ALUOp.ROL: lambda a, b: _rotr(a, -b),
+    ALUOp.ANDN: lambda a, b: a & ~b & MASK,
+    ALUOp.ORN: lambda a, b: (a | ~b) & MASK,
+    ALUOp.XNOR: lambda a, b: ~(a ^ b) & MASK,
+    ALUOp.PACK: lambda a, b: (b & 0xFFFF) << 16 | (a & 0xFFFF),
+    ALUOp.PACKH: lambda a, b: (b & 0xFF) << 8 | (a & 0xFF),
+    ALUOp.ZIP: lambda a, b: _zip(a),
+    ALUOp.UNZIP: lambda a, b: _unzip(a),
+    ALUOp.REV8: lambda a, b: int.from_bytes(a.to_bytes(4, "little"), "big"),
+    ALUOp.REVB: lambda a, b: _revb(a),
+    ALUOp.CLMUL: lambda a, b: _clmul(a, b) & MASK,
+    ALUOp.CLMULH: lambda a, b: _clmul(a, b) >> 32,
+}
+
+# (fn3, fn7) -> ALUOp of register-register instructions, as decoded by `control`
+REG_OPS = {
+    (0, 0x00): ALUOp.ADD,
+    (0, 0x20): ALUOp.SUB,
+    (1, 0x00): ALUOp.SLL,
+    (2, 0x00): ALUOp.SLT,
+    (3, 0x00): ALUOp.SLTU,
+    (4, 0x00): ALUOp.XOR,
+    (5, 0x00): ALUOp.SRL,
+    (5, 0x20): ALUOp.SRA,
+    (6, 0x00): ALUOp.OR,
+    (7, 0x00): ALUOp.AND,
+}
+REG_OPS_ZBKC = {
+    (1, 0x05): ALUOp.CLMUL,
+    (3, 0x05): ALUOp.CLMULH,
+}
+REG_OPS_ZBKB = {
+    (1, 0x30): ALUOp.ROL,
+    (4, 0x04): ALUOp.PACK,
+    (4, 0x20): ALUOp.XNOR,
+    (5, 0x30): ALUOp.ROR,
+    (6, 0x20): ALUOp.ORN,
+    (7, 0x04): ALUOp.PACKH,
+    (7, 0x20): ALUOp.ANDN,
+}
+
+# (fn3, fn7) -> ALUOp of register-immediate instructions; fn7 is only part of
+# the encoding for shifts (None matches any fn7)
+IMM_OPS = {
+    (0, None): ALUOp.ADD,
+    (1, 0x00): ALUOp.SLL,
+    (2, None): ALUOp.SLT,
+    (3, None): ALUOp.SLTU,
+    (4, None): ALUOp.XOR,
+    (5, 0x00): ALUOp.SRL,
+    (5, 0x20): ALUOp.SRA,
+    (6, None): ALUOp.OR,
+    (7, None): ALUOp.AND,
+}
+IMM_OPS_ZBKB = {
+    (1, 0x04): ALUOp.ZIP,
+    (5, 0x04): ALUOp.UNZIP,
+    (5, 0x30): ALUOp.ROR,
+}
+# 12-bit immediate -> ALUOp of the fn3=5, fn7=0x34 unary instructions
+UNARY_OPS_ZBKB = {
+    0x698: ALUOp.REV8,
+    0x687: ALUOp.REVB,
+}
+
+
+class IllegalInstruction(ValueError):
+    def __init__(self, pc, inst):
+        super().__init__(f"illegal instruction {inst:#010x} at pc {pc:#x}")
+        self.pc = pc
+        self.inst = inst
+
+
+class _Halt(Exception):
+    def __init__(self, source):
+        self.source = source
+
+
+class Memory:
+    """Sparse word-addressed memory, allocated in pages of `PAGE_WORDS` words.
+
+    Mirrors a PyRTL MemBlock: unwritten words read as zero, and `to_dict` holds
+    exactly the addresses that were initialized or written.
+
+    :param contents: initial {word address: value} contents
+    """
+
+    def __init__(self, contents=None):
+        self.pages = {}  # page number -> array of PAGE_WORDS words
+        self.present = set()
+        for addr, value in (contents or {}).items():
+            self.store(addr, value)
+
+    def page(self, addr):
+        """The page holding addr, allocating it if needed."""
+        page = self.pages.get(addr >> PAGE_BITS)
+        if page is None:
+            page = self.pages[addr >> PAGE_BITS] = array("L", [0]) * PAGE_WORDS
+        return page
+
+    def load(self, addr):
+        page = self.pages.get(addr >> PAGE_BITS)
+        return page[addr & (PAGE_WORDS - 1)] if page is not None else 0
+
+    def store(self, addr, value):
+        self.page(addr)[addr & (PAGE_WORDS - 1)] = value
+        self.present.add(addr)
+
+    def to_dict(self):
+        return {addr: self.load(addr) for addr in sorted(self.present)}
+
+
+class ISS:
+    """Instruction-level simulator of the RV32I core (plus Zbkb or Zbkc).
+
+    Executes the same instruction set as `rv_cpu` with the same `Opcode`/`ALUOp`
+    decoding, including the core's handling of misaligned loads and stores, but
+    one instruction at a time and without elaborating any hardware. Each
+    instruction is decoded into a closure the first time it is fetched and the
+    closure is reused on every later execution.
+
+    :param imem: {word address: instruction} contents of the instruction memory
+    :param dmem: {word address: value} contents of the data memory
+    :param entry: the pc of the first instruction
+    :param isa: ISA extension, as passed to `rv_cpu`
+    :param halt: the halt sources that stop `run` (see `src.program.Halt`)
+    """
+
+    def __init__(self, imem, dmem=None, entry=0, isa=ISA.RVI, halt=Halt.ALL):
+        self.imem = imem
+        self.dmem = Memory(dmem)
+        self.pc = entry
+        self.isa = isa
+        self.halt = halt
+        self.instret = 0
+        self.regs = array("L", [0]) * 32
+        self.written = bytearray(32)  # registers written at least once
+        self.decoded = _Decoded(self)
+
+        self.reg_ops = dict(REG_OPS)
+        self.imm_ops = dict(IMM_OPS)
+        if isa == ISA.ZBKC:
+            self.reg_ops.update(REG_OPS_ZBKC)
+        elif isa == ISA.ZBKB:
+            self.reg_ops.update(REG_OPS_ZBKB)
+            self.imm_ops.update(IMM_OPS_ZBKB)
+
+    @classmethod
+    def from_program(cls, program, isa=ISA.RVI):
+        """Builds a simulator loaded with the image of a `Program`."""
+        imem, dmem, entry = program.image()
+        return cls(imem, dmem, entry, isa=isa, halt=program.halt)
+
+    def rf(self):
+        """The register file as a {register: value} dict, like `inspect_mem` of rf."""
+        return {r: self.regs[r] for r in range(1, 32) if self.written[r]}
+
+    def run(self, max_steps=1 << 20):
+        """Executes instructions until a halt source fires.
+
+        :param max_steps: maximum number of instructions to execute
+        :return: the halt source that fired, or None if max_steps ran out
+        """
+        decoded = self.decoded
+        pc = self.pc
+        source = None
+        steps = 0
+        try:
+            for steps in range(max_steps):
+                pc = decoded[pc]()
+            steps = max_steps
+        except _Halt as halt:
+            # the halting instruction itself has executed, unless it is not one
+            source = halt.source
+            steps += source != Halt.END
+        finally:
+            self.pc = pc
+            self.instret += steps
+        return source
+
+    def step(self):
+        """Executes a single instruction, see `run`."""
+        return self.run(1)
+
+    def decode(self, pc, inst):
+        """Decodes the instruction at pc into a closure that executes it.
+
+        :return: function executing the instruction and returning the next pc
+        """
+        x = self.regs
+        dmem = self.dmem
+        op = inst & 0x7F
+        rd = (inst >> 7) & 0x1F
+        fn3 = (inst >> 12) & 0x7
+        rs1 = (inst >> 15) & 0x1F
+        rs2 = (inst >> 20) & 0x1F
+        fn7 = inst >> 25
+        imm_i = _signed(inst) >> 20
+        nxt = (pc + 4) & MASK
+
+        def nop():
+            return nxt
+
+        def halt(source):
+            def step():
+                raise _Halt(source)
+
+            return step
+
+        def illegal():
+            raise IllegalInstruction(pc, inst)
+
+        if inst == 0 and Halt.END in self.halt:
+            return halt(Halt.END)
+
+        if op in (Opcode.REG, Opcode.IMM):
+            if op == Opcode.REG:
+                alu_op = self.reg_ops.get((fn3, fn7))
+            else:
+                alu_op = self.imm_ops.get((fn3, fn7), self.imm_ops.get((fn3, None)))
+                if self.isa == ISA.ZBKB and (fn3, fn7) == (5, 0x34):
+                    alu_op = UNARY_OPS_ZBKB.get(inst >> 20)
+            if alu_op is None:
+                return illegal
+            if rd == 0:
+                return nop
+            self.written[rd] = 1
+            fn = ALU[alu_op]
+
+            if op == Opcode.REG:
+
+                def step():
+                    x[rd] = fn(x[rs1], x[rs2])
+                    return nxt
+
+            elif alu_op == ALUOp.ADD:  # addi, by far the most common
+
+                def step():
+                    x[rd] = (x[rs1] + imm_i) & MASK
+                    return nxt
+
+            else:
+                imm = imm_i & MASK
+
+                def step():
+                    x[rd] = fn(x[rs1], imm)
+                    return nxt
+
+            return step
+
+        if op == Opcode.LUI or op == Opcode.AUIPC:
+            if rd == 0:
+                return nop
+            self.written[rd] = 1
+            value = inst & 0xFFFFF000
+            if op == Opcode.AUIPC:
+                value = (value + pc) & MASK
+
+            def step():
+                x[rd] = value
+                return nxt
+
+            return step
+
+        if op == Opcode.JAL:
+            offset = (
+                ((inst >> 31) & 1) << 20
+                | ((inst >> 12) & 0xFF) << 12
+                | ((inst >> 20) & 1) << 11
+                | ((inst >> 21) & 0x3FF) << 1
+            )
+            target = (pc + offset - ((offset & (1 << 20)) << 1)) & MASK
+            if rd != 0:
+                self.written[rd] = 1
+            if target == pc and Halt.SELF_LOOP in self.halt:
+
+                def step():
+                    if rd:
+                        x[rd] = nxt
+                    raise _Halt(Halt.SELF_LOOP)
+
+            elif rd == 0:
+
+                def step():
+                    return target
+
+            else:
+
+                def step():
+                    x[rd] = nxt
+                    return target
+
+            return step
+
+        if op == Opcode.JALR:
+            if rd != 0:
+                self.written[rd] = 1
+
+            def step():
+                target = (x[rs1] + imm_i) & MASK & ~1
+                if rd:
+                    x[rd] = nxt
+                return target
+
+            return step
+
+        if op == Opcode.BRANCH:
+            offset = (
+                ((inst >> 31) & 1) << 12
+                | ((inst >> 7) & 1) << 11
+                | ((inst >> 25) & 0x3F) << 5
+                | ((inst >> 8) & 0xF) << 1
+            )
+            target = (pc + offset - ((offset & (1 << 12)) << 1)) & MASK
+            if fn3 in (2, 3):
+                return illegal
+            # beq/bne compare equal, blt/bge signed and bltu/bgeu unsigned;
+            # odd fn3 takes the branch when the comparison is false
+            flip = SIGN if fn3 in (4, 5) else 0
+            equal = fn3 in (0, 1)
+            invert = fn3 & 1
+
+            def step():
+                a = x[rs1] ^ flip
+                b = x[rs2] ^ flip
+                if ((a == b) if equal else (a < b)) ^ invert:
+                    return target
+                return nxt
+
+            return step
+
+        if op == Opcode.LOAD:
+            mode = fn3 & 0x3
+            sign_ext = not fn3 & 0x4
+            if rd == 0:
+                return nop
+            self.written[rd] = 1
+            load = dmem.load
+            pages = dmem.pages
+
+            if mode >= MaskMode.WORD:
+
+                def step():
+                    addr = (x[rs1] + imm_i) & MASK
+                    if addr & 0x3:  # misaligned, reads as zero
+                        x[rd] = 0
+                    else:
+                        page = pages.get(addr >> (PAGE_BITS + 2))
+                        x[rd] = 0 if page is None else page[(addr >> 2) & (PAGE_WORDS - 1)]
+                    return nxt
+
+                return step
+
+            def step():
+                addr = (x[rs1] + imm_i) & MASK
+                offset = addr & 0x3
+                value = load(addr >> 2)
+                if mode == MaskMode.BYTE:
+                    value = (value >> (8 * offset)) & 0xFF
+                    if sign_ext and value & 0x80:
+                        value |= 0xFFFFFF00
+                elif mode == MaskMode.SHORT:
+                    if offset & 1:  # misaligned, reads as zero
+                        value = 0
+                    else:
+                        value = (value >> (8 * offset)) & 0xFFFF
+                        if sign_ext and value & 0x8000:
+                            value |= 0xFFFF0000
+                elif offset:
+                    value = 0
+                x[rd] = value
+                return nxt
+
+            return step
+
+        if op == Opcode.STORE:
+            mode = fn3 & 0x3
+            imm_s = (imm_i & ~0x1F) | rd
+            load, store = dmem.load, dmem.store
+            tohost = Halt.TOHOST in self.halt
+            pages, present = dmem.pages, dmem.present
+
+            if mode >= MaskMode.WORD:
+
+                def step():
+                    addr = (x[rs1] + imm_s) & MASK
+                    word = addr >> 2
+                    page = pages.get(word >> PAGE_BITS)
+                    if page is None:
+                        page = dmem.page(word)
+                    # misaligned stores write the old value back
+                    if not addr & 0x3:
+                        page[word & (PAGE_WORDS - 1)] = x[rs2]
+                    present.add(word)
+                    if word == TOHOST and tohost and x[rs2] == PASS and not addr & 0x3:
+                        raise _Halt(Halt.TOHOST)
+                    return nxt
+
+                return step
+
+            def step():
+                addr = (x[rs1] + imm_s) & MASK
+                offset = addr & 0x3
+                word = addr >> 2
+                value = x[rs2]
+                if mode == MaskMode.BYTE:
+                    shift = 8 * offset
+                    value = (load(word) & ~(0xFF << shift) | (value & 0xFF) << shift) & MASK
+                elif mode == MaskMode.SHORT:
+                    # misaligned stores write the old value back
+                    if offset & 1:
+                        value = load(word)
+                    else:
+                        shift = 8 * offset
+                        value = load(word) & ~(0xFFFF << shift) & MASK | (value & 0xFFFF) << shift
+                elif offset:
+                    value = load(word)
+                store(word, value)
+                if tohost and word == TOHOST and value == PASS:
+                    raise _Halt(Halt.TOHOST)
+                return nxt
+
+            return step
+
+        if op == Opcode.SYSTEM:
+            if inst in (ECALL, EBREAK) and Halt.SYSTEM in self.halt:
+                return halt(Halt.SYSTEM)
+            return nop  # CSRs are not implemented by the core
+
+        if op == MISC_MEM:
+            return nop
+
+        return illegal
+
+
+class _Decoded(dict):
+    """pc -> decoded instruction, decoding each pc on its first fetch."""
+
+    def __init__(self, iss):
+        self.iss = iss
+
+    def __missing__(self, pc):
+        step = self[pc] = self.iss.decode(pc, self.iss.imem.get(pc >> 2, 0))
+        return step
+
+
+if __name__ == "__main__":
+    import sys, time
+    from argparse import ArgumentParser
+    from . import loader
+
+    parser = ArgumentParser("Run a program on the instruction-set simulator.")
+    parser.add_argument("image", type=str, help="ELF file or flat binary to run")
+    parser.add_argument(
+        "-e", "--ext", type=str, dest="isa", default=ISA.RVI,
+        choices=[ISA.RVI, ISA.ZBKB, ISA.ZBKC], help="ISA extension",
+    )
+    parser.add_argument(
+        "-n", "--max-steps", type=int, dest="max_steps", default=1 << 24,
+        help="maximum number of instructions to execute",
+    )
+    args = parser.parse_args()
+
+    iss = ISS(*loader.load(args.image), isa=args.isa)
+    start = time.perf_counter()
+    source = iss.run(args.max_steps)
+    elapsed = time.perf_counter() - start
+
+    print(f"HALT: {source} at pc {iss.pc:#x}")
+    print(f"INSTRET: {iss.instret} ({iss.instret / elapsed / 1e6:.2f} MIPS)")
+    print(f"RF: {iss.rf()}")
+    print(f"DMEM: {iss.dmem.to_dict()}")
+    sys.exit(0 if source is not None else 1)
@@ -0,0 +1,77 @@
+import struct, sys
+from array import array
+
+ELF_MAGIC = b"\x7fELF"
+PT_LOAD = 1
+PF_X = 0x1
+
+
+def words(data):
+    """Decodes little-endian bytes into 32-bit words in one pass.
+
+    :param data: bytes-like object (padded with zeroes to a multiple of 4 bytes)
+    :return: array of unsigned 32-bit words
+    """
+    data = memoryview(data)
+    if len(data) % 4:
+        data = memoryview(bytes(data) + bytes(4 - len(data) % 4))
+    typecode = "I" if array("I").itemsize == 4 else "L"
+    decoded = array(typecode)
+    decoded.frombytes(data)
+    if sys.byteorder == "big":
+        decoded.byteswap()
+    return decoded
+
+
+def load_binary(data):
+    """Loads a flat binary (e.g. `objcopy -O binary`) at address 0 of imem.
+
+    :param data: the file contents
+    :return: (imem, dmem, entry) with word address -> word dicts for each memory
+    """
+    return dict(enumerate(words(data))), {}, 0
+
+
+def load_elf(data):
+    """Loads the PT_LOAD segments of a 32-bit little-endian RISC-V ELF file.
+
+    Executable segments go to imem and all other segments to dmem, each at its
+    load address. Bytes past the end of the file contents of a segment (.bss) are
+    left out, since memories read as zero anyway.
+
+    :param data: the file contents
+    :return: (imem, dmem, entry) with word address -> word dicts for each memory
+    """
+    ident = data[:16]
+    if ident[4] != 1 or ident[5] != 1:
+        raise ValueError("only 32-bit little-endian ELF files are supported")
+
+    (entry, phoff) = struct.unpack_from("<II", data, 24)
+    (phentsize, phnum) = struct.unpack_from("<HH", data, 42)
+
+    imem, dmem = {}, {}
+    for i in range(phnum):
+        (kind, offset, vaddr, _, filesz, _, flags, _) = struct.unpack_from(
+            "<8I", data, phoff + i * phentsize
+        )
+        if kind != PT_LOAD or filesz == 0:
+            continue
+        if vaddr % 4:
+            raise ValueError(f"segment at {vaddr:#x} is not word aligned")
+        mem = imem if flags & PF_X else dmem
+        segment = words(memoryview(data)[offset : offset + filesz])
+        mem.update(zip(range(vaddr // 4, vaddr // 4 + len(segment)), segment))
+    return imem, dmem, entry
+
+
+def load(path):
+    """Loads a program image, either an ELF file or a flat binary.
+
+    :param path: path of the file to load
+    :return: (imem, dmem, entry) with word address -> word dicts for each memory
+    """
+    with open(path, "rb") as image_file:
+        data = image_file.read()
+    if data[:4] == ELF_MAGIC:
+        return load_elf(data)
+    return load_binary(data)
@@ -1,19 +1,28 @@
 import pyrtl
 
+from .cache import CacheSetAssociative
 from .control import MaskMode
 from .util import add_wire
 
-def inst_memory_cache(pc):
-    """Instruction memory IOs:
+def inst_memory_cache(pc, config, request=None, counters=None):
+    """Instruction memory IOs, behind a set-associative cache:
 
     :param pc: the program counter
+    :param config: the geometry of the cache (see `src.cache.CacheConfig`)
+    :param request: pc is to be fetched (defaults to always)
+    :param counters: prefix of the names of the hit, miss and eviction
+        counters, None for no counters
     :return inst_mem: a reference to the memory block
     :return inst: the fetched instruction (inst_mem[pc])
+    :return ready_o: inst is valid; on a miss it is low while the cache
+        refills the line, one word per cycle
     """
     inst_mem = pyrtl.MemBlock(
         bitwidth=32, addrwidth=30, name="imem", asynchronous=True
     )
-    data_o, ready_o = CacheDirectMappedNBlock(32, 30, 8, pc[2:], inst_mem, prefix="icache_")
+    data_o, ready_o = CacheSetAssociative(
+        32, 30, pc[2:], inst_mem, config, request=request, prefix="icache_", counters=counters
+    )
 
     # The addresses in instruction memory are word-addressable, while the addresses produced by
     # alu operations with the immediates, pcs, etc. are byte-addressable, so we need to shift
@@ -44,6 +53,11 @@ def inst_memory(pc):
     return inst_mem, inst
 
 
+# Names of the wires of the stores the data memory performs, as (word address,
+# data, enable): what is written to dmem, or to the data cache in front of it
+STORE = ("mem_store_addr", "mem_store_data", "mem_store")
+
+
 def data_memory(addr, write_data, read, write, mask_mode, sign_ext):
     """The data memory
 
@@ -58,6 +72,24 @@ def data_memory(addr, write_data, read, write, mask_mode, sign_ext):
 
     :return: data read from addr
     """
+    return _data_memory(addr, write_data, read, write, mask_mode, sign_ext)[0]
+
+
+def data_memory_cache(addr, write_data, read, write, mask_mode, sign_ext, config, counters=None):
+    """The data memory, behind a write-back, write-allocate cache (see
+    `src.cache.CacheSetAssociative`). Its IOs are those of `data_memory`, and:
+
+    :param config: the geometry of the cache (see `src.cache.CacheConfig`)
+    :param counters: prefix of the names of the hit, miss, eviction and
+        write-back counters, None for no counters
+    :return read_data: data read from addr
+    :return ready: the load or store is done; while it is low the cache
+        writes back and refills lines, and the access must be held
+    """
+    return _data_memory(addr, write_data, read, write, mask_mode, sign_ext, config, counters)
+
+
+def _data_memory(addr, write_data, read, write, mask_mode, sign_ext, config=None, counters=None):
     addr = add_wire(addr, bitwidth=32, name="mem_addr")
     write_data = add_wire(write_data, bitwidth=32, name="mem_write_data")
     read = add_wire(read, bitwidth=1, name="mem_read")
@@ -71,11 +103,29 @@ def data_memory(addr, write_data, read, write, mask_mode, sign_ext):
 
     offset = addr[0:2]  # lower 2 bits determine if its byte 0, 1, 2, or 3 of word
     real_addr = addr[2:]
-    read_data = data_mem[real_addr]
+
+    # Read the word at addr from dmem, or from the cache in front of it, which
+    # also takes the word to store there
+    to_write = pyrtl.WireVector(len(write_data))
+    if config is None:
+        read_data = data_mem[real_addr]
+        ready = pyrtl.Const(1, bitwidth=1)
+    else:
+        read_data, ready = CacheSetAssociative(
+            32,
+            30,
+            real_addr,
+            data_mem,
+            config,
+            request=read | write,
+            write=write,
+            write_data=to_write,
+            prefix="dcache_",
+            counters=counters,
+        )
 
     # Store: write the particular byte/halfword/word to memory and maintain
     # the other bytes (in the class of byte/halfword) already present
-    to_write = pyrtl.WireVector(len(write_data))
     with pyrtl.conditional_assignment:
         with mask_mode == MaskMode.BYTE:
             with offset == 0:
@@ -110,7 +160,12 @@ def data_memory(addr, write_data, read, write, mask_mode, sign_ext):
             with pyrtl.otherwise:
                 to_write |= read_data
 
-    data_mem[real_addr] <<= pyrtl.MemBlock.EnabledWrite(to_write, write)
+    store = write if config is None else write & ready
+    store_addr, store_data, store = (
+        add_wire(wire, name=name) for wire, name in zip((real_addr, to_write, store), STORE)
+    )
+    if config is None:
+        data_mem[store_addr] <<= pyrtl.MemBlock.EnabledWrite(store_data, store)
 
     def data_ext(data, ext, width):
         return pyrtl.select(
@@ -143,4 +198,4 @@ def data_memory(addr, write_data, read, write, mask_mode, sign_ext):
                 read_data,
                 pyrtl.Const(0, len(read_data)))
 
-    return add_wire(read_data_ext, name="mem_data_read")
+    return add_wire(read_data_ext, name="mem_data_read"), ready
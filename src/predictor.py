@@ -0,0 +1,63 @@
+import pyrtl
+
+from .util import add_wire
+
+
+def branch_predictor(pc, entries, update, update_pc, taken, jump, target):
+    """Branch target buffer (BTB) and branch history table (BHT) IOs:
+
+    :param pc: the pc being fetched
+    :param entries: number of entries of the BTB and of the BHT (a power of two)
+    :param update: a branch or jump is resolved this cycle
+    :param update_pc: the pc of the resolved branch or jump
+    :param taken: the resolved branch or jump is taken
+    :param jump: the resolved instruction is an unconditional jump
+    :param target: the pc the resolved branch or jump goes to when taken
+    :return pred_taken: the instruction at pc is predicted to be a taken
+        branch or jump
+    :return pred_target: the pc it is predicted to go to
+
+    Both tables are direct-mapped on the low bits of the word address. The BTB
+    holds the (tagged) target of the last taken branch or jump at each index,
+    and the BHT a 2-bit saturating counter of how often the branches there were
+    taken. A branch is predicted taken if it hits in the BTB and its counter is
+    at least 2. Jumps set the counter straight to 3.
+    """
+    index_bits = entries.bit_length() - 1
+    if entries < 2 or entries != 1 << index_bits:
+        raise ValueError("the number of predictor entries must be a power of two (at least 2)")
+    tag_bits = 30 - index_bits
+
+    # Each BTB entry is {valid, tag, target word address}
+    btb = pyrtl.MemBlock(
+        bitwidth=1 + tag_bits + 30, addrwidth=index_bits, name="btb", asynchronous=True
+    )
+    bht = pyrtl.MemBlock(bitwidth=2, addrwidth=index_bits, name="bht", asynchronous=True)
+
+    # Lookup
+    entry = btb[pc[2:2 + index_bits]]
+    hit = add_wire(entry[-1] & (entry[30:-1] == pc[2 + index_bits:]), name="btb_hit")
+    pred_taken = add_wire(hit & bht[pc[2:2 + index_bits]][1], name="pred_taken")
+    pred_target = add_wire(pyrtl.concat(entry[0:30], pyrtl.Const(0, bitwidth=2)), name="pred_target")
+
+    # Update
+    index = update_pc[2:2 + index_bits]
+    btb[index] <<= pyrtl.MemBlock.EnabledWrite(
+        pyrtl.concat(pyrtl.Const(1, bitwidth=1), update_pc[2 + index_bits:], target[2:]),
+        update & taken,
+    )
+    count = bht[index]
+    bht[index] <<= pyrtl.MemBlock.EnabledWrite(
+        pyrtl.select(
+            jump,
+            pyrtl.Const(3, bitwidth=2),
+            pyrtl.select(
+                taken,
+                pyrtl.select(count == 3, count, (count + 1)[0:2]),
+                pyrtl.select(count == 0, count, (count - 1)[0:2]),
+            ),
+        ),
+        update,
+    )
+
+    return pred_taken, pred_target
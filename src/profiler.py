@@ -0,0 +1,110 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pyrtl
+
+
+class Profiler:
+    """Measures the phases of building a circuit.
+
+    Each phase records its wall time, the peak of the memory traced by
+    tracemalloc while it runs (which includes what earlier phases left
+    allocated; tracing slows Python down noticeably) and the number of nets and
+    wires of the working block before and after it.
+
+    :param enabled: measure phases (a disabled Profiler only runs them)
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = []
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @staticmethod
+    def _counts():
+        block = pyrtl.working_block()
+        return len(block.logic), len(block.wirevector_set)
+
+    @contextmanager
+    def phase(self, name):
+        """Measures the code run in a `with` block as the phase `name`."""
+        if not self.enabled:
+            yield
+            return
+        nets, wires = self._counts()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        nets_after, wires_after = self._counts()
+        self.phases.append(
+            {
+                "phase": name,
+                "seconds": round(seconds, 4),
+                "peak_bytes": peak,
+                "nets": [nets, nets_after],
+                "wires": [wires, wires_after],
+            }
+        )
+
+    def report(self):
+        """The phases as a table."""
+        lines = ["{:<24} {:>9} {:>10} {:>17} {:>17}".format("phase", "seconds", "peak MB", "nets", "wires")]
+        for p in self.phases:
+            lines.append(
+                "{:<24} {:>9.3f} {:>10.1f} {:>17} {:>17}".format(
+                    p["phase"],
+                    p["seconds"],
+                    p["peak_bytes"] / (1 << 20),
+                    "{} -> {}".format(*p["nets"]),
+                    "{} -> {}".format(*p["wires"]),
+                )
+            )
+        return "\n".join(lines)
+
+    def write(self, path, **info):
+        """Writes the phases to a JSON file, with any extra information given."""
+        with open(path, "w") as f:
+            json.dump(dict(info, phases=self.phases), f, indent=2)
+
+
+def compare(old, new):
+    """Compares the phases of two profiles written by `Profiler.write`.
+
+    :param old: the profile to compare against, as loaded from JSON
+    :param new: the profile to compare
+    :return: list of (phase, old seconds, new seconds, old peak, new peak) for
+        the phases in both
+    """
+    before = {p["phase"]: p for p in old["phases"]}
+    return [
+        (p["phase"], before[p["phase"]]["seconds"], p["seconds"], before[p["phase"]]["peak_bytes"], p["peak_bytes"])
+        for p in new["phases"]
+        if p["phase"] in before
+    ]
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser("Compare two profiles written by generate_cpu.py/generate_alu.py --profile.")
+    parser.add_argument("old", type=str, help="profile to compare against")
+    parser.add_argument("new", type=str, help="profile to compare")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print("{:<24} {:>9} {:>9} {:>8} {:>10} {:>10}".format("phase", "old s", "new s", "change", "old MB", "new MB"))
+    for phase, old_s, new_s, old_peak, new_peak in compare(old, new):
+        change = "{:+.0%}".format(new_s / old_s - 1) if old_s else "-"
+        print(
+            "{:<24} {:>9.3f} {:>9.3f} {:>8} {:>10.1f} {:>10.1f}".format(
+                phase, old_s, new_s, change, old_peak / (1 << 20), new_peak / (1 << 20)
+            )
+        )
@@ -1,5 +1,14 @@
-import pyrtl, inspect
+import pyrtl, inspect, multiprocessing
 from enum import IntEnum
+from os.path import basename, splitext
+
+from . import loader
+from .cache import cache_memories, dirty_word, dirty_words
+from .control import Opcode
+from .cpu import ISA, PIPELINES, Counter, detect_pipeline, rv_cpu
+from .events import EventLog, write_ports
+from .mem import STORE
+from .sim import Backend, Trace, simulation, inspect_mem, reset
 
 
 # print fancy colors to terminal
@@ -23,82 +32,539 @@ def get_mem(name):
     return pyrtl.working_block().get_memblock_by_name(name)
 
 
+def counter_wires():
+    """The performance counter Outputs of the design (see `src.cpu.Counter`)."""
+    return [get_wire(name) for name in Counter.ALL if get_wire(name) is not None]
+
+
+def read_data_memory(sim):
+    """Reads the data memory as the program sees it.
+
+    With a data cache, dmem lags behind the stores: the dirty words of the cache
+    are laid over it.
+
+    :param sim: the simulation object
+    :return: dict of word address -> word
+    """
+    dirty = dirty_words(cache_memories("dcache_"), lambda mem: inspect_mem(sim, mem))
+    return {**inspect_mem(sim, get_mem("dmem")), **dirty}
+
+
+def read_counters(sim):
+    """Reads the performance counters of the design.
+
+    :param sim: the simulation object
+    :return: dict of counter name -> value, empty if the design has none
+    """
+    return {wire.name: sim.inspect(wire.name) for wire in counter_wires()}
+
+
+# The openpiton tests store "PASS" (little-endian) to 0x10000000, i.e. this dmem word
+TOHOST = 0x4000000
+PASS = int("".join(map(lambda i: hex(ord(i))[2:], reversed("PASS"))), 16)
+
+ECALL = 0x00000073
+EBREAK = 0x00100073
+
+
+class Halt:
+    """Events that end a program, passed as `halt=` to `Program`.
+
+    Besides these names, any callable `predicate(sim, cycle)` returning True
+    once the program is done can be used as a halt source.
+    """
+
+    TOHOST = "tohost"  # PASS was stored to TOHOST
+    SYSTEM = "system"  # an ecall or ebreak executed
+    SELF_LOOP = "self_loop"  # a `j .` (jal with a zero offset) executed
+    END = "end"  # an all-zero instruction executed, i.e. ran off the program end
+
+    ALL = (TOHOST, SYSTEM, SELF_LOOP, END)
+
+
 class Program:
-    def __init__(self, name, instructions, debug=False, check_pass=False, **kwargs):
+    def __init__(
+        self,
+        name,
+        instructions=(),
+        debug=False,
+        check_pass=False,
+        halt=Halt.ALL,
+        path=None,
+        **kwargs,
+    ):
         self.name = name
         self.instructions = instructions
         self.debug = debug
         self.assertions = kwargs
         self.check_pass = check_pass
+        self.halt = halt
+        self.path = path
+        self._image = None
+
+    @classmethod
+    def from_file(cls, path, name=None, **kwargs):
+        """Creates a program from an ELF file or flat binary, read on first use.
+
+        :param path: path of the program image
+        :param name: name of the program (defaults to the file name)
+        :return: the Program
+        """
+        name = name if name is not None else splitext(basename(path))[0]
+        return cls(name, path=path, **kwargs)
 
-    def execute(self, max_cycles=256, debug=False):
+    def image(self):
+        """Returns the memory image of the program, loading it if needed.
+
+        :return: (imem, dmem, entry) with word address -> word dicts for each memory
+        """
+        if self._image is None:
+            if self.path is not None:
+                self._image = loader.load(self.path)
+            else:
+                self._image = dict(enumerate(self.instructions)), {}, 0
+        return self._image
+
+    def halted(self, sim, cycle, pipeline, data_mem, dcache=()):
+        """Checks the halt sources after a cycle.
+
+        :param sim: the simulation object
+        :param cycle: number of cycles simulated so far
+        :param pipeline: the Pipeline being simulated
+        :param data_mem: the data memory block
+        :param dcache: the memories of the data cache (see
+            `src.cache.cache_memories`), empty without one
+        :return: the halt source that fired, or None
+        """
+        # Until the first instruction reaches execute it holds a reset value
+        executed = sim.inspect(pipeline.inst) if cycle > pipeline.execute else None
+        for source in self.halt:
+            if callable(source):
+                if source(sim, cycle):
+                    return source
+            elif source == Halt.TOHOST:
+                tohost = dirty_word(dcache, sim.inspect_mem, TOHOST)
+                if tohost is None:
+                    tohost = sim.inspect_mem(data_mem).get(TOHOST)
+                if tohost == PASS:
+                    return source
+            elif executed is None:
+                continue
+            elif source == Halt.SYSTEM:
+                if executed in (ECALL, EBREAK):
+                    return source
+            elif source == Halt.SELF_LOOP:
+                if executed & 0xFFFFF07F == Opcode.JAL:
+                    return source
+            elif source == Halt.END:
+                if executed == 0:
+                    return source
+            else:
+                raise ValueError(f"invalid halt source '{source}'")
+        return None
+
+    def load(
+        self,
+        pipeline,
+        session=None,
+        backend=Backend.INTERPRETED,
+        inspect=(),
+        trace=Trace.NONE,
+    ):
+        """Builds (or resets) a simulation with the program loaded into memory.
+
+        :param pipeline: the Pipeline being simulated
+        :param session: Session to reuse the simulator of (one is built otherwise)
+        :param backend: simulation backend, when not using a session
+        :param inspect: extra wires to inspect, when not using a session
+        :param trace: the trace retention policy, when not using a session
+        :return: the simulation object
+        """
+        imem, dmem, entry = self.image()
+        memory_value_map = {get_mem("imem"): imem, get_mem("dmem"): dmem}
+        register_value_map = {get_wire(pipeline.fetch): entry} if entry else {}
+
+        if session is not None:
+            return session.load(memory_value_map, register_value_map)
+        return simulation(
+            backend,
+            memory_value_map=memory_value_map,
+            register_value_map=register_value_map,
+            inspect=[get_wire(w) for w in pipeline.wires]
+            + [get_wire(w) for w in self.assertions if get_wire(w) is not None]
+            + counter_wires()
+            + list(inspect),
+            trace=trace,
+        )
+
+    def check(self, sim):
+        """Checks the assertions (and check_pass) against a finished simulation.
+
+        :param sim: the simulation object
+        :return: list of (assertion, expected, actual) tuples that failed
+        """
+        failures = []
+        for wire in self.assertions:
+            if get_wire(wire) is not None:
+                value = sim.inspect(get_wire(wire))
+            elif wire == "dmem":
+                value = read_data_memory(sim)
+            else:
+                value = inspect_mem(sim, get_mem(wire))
+            if value != self.assertions[wire]:
+                failures.append((wire, self.assertions[wire], value))
+
+        if self.check_pass:
+            mem = read_data_memory(sim)
+            if TOHOST not in mem or mem[TOHOST] != PASS:
+                failures.append(("check_pass", PASS, mem.get(TOHOST)))
+        return failures
+
+    def execute(
+        self,
+        max_cycles=256,
+        debug=False,
+        backend=Backend.INTERPRETED,
+        session=None,
+        verbose=True,
+        trace=Trace.NONE,
+        events=None,
+    ):
         debug = debug or self.debug
+        if debug and events is None:
+            events = f"{self.name}.events.jsonl"
+        trace = session.trace if session is not None else trace
+        pipeline = session.pipeline if session is not None else detect_pipeline()
 
-        pc = get_wire("pc")
-        inst = get_wire("inst")
+        # the instruction (and its pc) in the execute stage
+        pc = get_wire(pipeline.pc)
+        inst = get_wire(pipeline.inst)
         rf = get_mem("rf")
-        inst_mem = get_mem("imem")
         data_mem = get_mem("dmem")
+        dcache = cache_memories("dcache_")
 
-        print(f"Running program {self.name}...")
+        if verbose:
+            print(f"Running program {self.name}...")
 
-        # Start a simulation trace
-        sim_trace = pyrtl.SimulationTrace()
+        # Log the register file writes and the stores of every cycle (a data
+        # cache keeps the stores from dmem)
+        log = None
+        if events is not None:
+            store = [tuple(get_wire(name) for name in STORE)]
+            log = EventLog(
+                events, self.name, {"rf": rf, "dmem": store}, {"dmem": self.image()[1]}
+            )
 
-        # Initialize the inst_mem with your instuctions.
-        sim = pyrtl.Simulation(
-            tracer=sim_trace,
-            memory_value_map={inst_mem: dict(enumerate(self.instructions))},
+        sim = self.load(
+            pipeline,
+            session=session,
+            backend=backend,
+            inspect=log.wires() if log is not None else (),
+            trace=trace,
         )
 
         # Simulate program execution
         def step(sim):
             sim.step({})
-            if debug:
-                print(cycle)
-                print(f"INST: {sim.inspect(pc):#0x} ({sim.inspect(inst):#0{10}x})")
-                print(f"REGS: {sim.inspect_mem(rf)}")
-                print(f"DMEM: {sim.inspect_mem(data_mem)}")
+            if log is not None:
+                log.record(sim, cycle + 1, pc, inst)
 
         cycle = 0
-        countdown = None
-        while (countdown is None or countdown > 0) and cycle < max_cycles:
+        halt = None
+        while halt is None and cycle < max_cycles:
             step(sim)
             cycle += 1
-            if not sim.inspect(inst):
-                countdown = countdown - 1 if countdown else 8  # probably enough time
-            elif countdown is not None:
-                countdown = None
+            halt = self.halted(sim, cycle, pipeline, data_mem, dcache)
 
-        if cycle >= max_cycles:
-            warning(f"Warning: exceeded maximum clock cycles ({max_cycles})")
+        # Let the halting instruction (or the store to tohost) and the ones
+        # ahead of it retire, i.e. reach writeback, as in `src.cosim.cosim`.
+        # A stalled cycle holds every instruction, so it doesn't count
+        def stalled():
+            return pipeline.stall is not None and sim.inspect(pipeline.stall)
 
-        failed = False
-        for wire in self.assertions:
-            value = (
-                sim.inspect(get_wire(wire))
-                if get_wire(wire)
-                else sim.inspect_mem(get_mem(wire))
+        if halt in (Halt.SYSTEM, Halt.SELF_LOOP, Halt.END):
+            drain = pipeline.writeback + stalled()
+        elif halt == Halt.TOHOST:
+            drain = pipeline.writeback - pipeline.memory
+        else:
+            drain = 0
+        while drain or stalled():
+            step(sim)
+            cycle += 1
+            if drain and not stalled():
+                drain -= 1
+
+        if log is not None:
+            log.close()
+
+        result = Result(self.name, cycle, self.check(sim), halt=halt)
+        result.counters = read_counters(sim)
+        if trace is not Trace.NONE:
+            result.trace = {
+                name: list(values)
+                for name, values in sim.tracer.trace.items()
+                if not isinstance(trace, list) or name in trace
+            }
+
+        if verbose:
+            result.report()
+            # Show whatever the trace policy retained to help debug the failure
+            if not result.passed and trace is not Trace.NONE:
+                sim.tracer.render_trace()
+        return result
+
+
+class Result:
+    """The outcome of executing a Program.
+
+    Truthy if the program passed, so it can be used like the boolean that
+    `Program.execute` used to return.
+
+    :param name: name of the program
+    :param cycles: number of cycles simulated
+    :param failures: list of (assertion, expected, actual) tuples
+    :param halt: the halt source that ended the program (None if it hit max_cycles,
+        "diverged" if a co-simulation stopped at a divergence)
+    """
+
+    def __init__(self, name, cycles, failures=(), halt=None):
+        self.name = name
+        self.cycles = cycles
+        self.failures = list(failures)
+        self.halt = halt if isinstance(halt, str) or halt is None else "predicate"
+        self.trace = None  # wire name -> values, as retained by the trace policy
+        self.counters = {}  # performance counter name -> value
+
+    @property
+    def cpi(self):
+        """Cycles per retired instruction, from the performance counters."""
+        if not self.counters.get(Counter.INSTRET):
+            return None
+        return self.counters[Counter.CYCLES] / self.counters[Counter.INSTRET]
+
+    @property
+    def passed(self):
+        return not self.failures
+
+    @property
+    def timed_out(self):
+        return self.halt is None
+
+    def __bool__(self):
+        return self.passed
+
+    def report(self):
+        """Prints the warnings, failed assertions and verdict."""
+        if self.timed_out:
+            warning(f"Warning: exceeded maximum clock cycles ({self.cycles})")
+        label = "Divergence" if self.halt == "diverged" else "Invalid assertion"
+        for wire, expected, actual in self.failures:
+            if wire != "check_pass":
+                error(f"{label}: {wire} \n\texpected {expected} \n\tactual {actual})")
+        if self.cpi is not None:
+            print(self.performance())
+        if self.passed:
+            ok(f"Passed! ({self.cycles} cycles)")
+        else:
+            error(f"Failed! ({self.cycles} cycles)")
+
+    def performance(self):
+        """Summarizes the performance counters: CPI and where the stalls went."""
+        counters = self.counters
+        cycles, instret = counters[Counter.CYCLES], counters[Counter.INSTRET]
+        flushes = counters.get(Counter.FLUSHES, 0)
+        stalls = {
+            label: counters[counter]
+            for counter, label in (
+                (Counter.STALLS, "load-use"),
+                (Counter.ICACHE_STALLS, "icache"),
+                (Counter.DCACHE_STALLS, "dcache"),
             )
-            if value != self.assertions[wire]:
-                failed = True
-                error(
-                    f"Invalid assertion: {wire} \n\texpected {self.assertions[wire]} \n\tactual {value})"
+            if counter in counters
+        }
+        caches = ""
+        for cache, hits, misses, evictions, writebacks in (
+            ("icache", Counter.ICACHE_HITS, Counter.ICACHE_MISSES, Counter.ICACHE_EVICTIONS, None),
+            (
+                "dcache",
+                Counter.DCACHE_HITS,
+                Counter.DCACHE_MISSES,
+                Counter.DCACHE_EVICTIONS,
+                Counter.DCACHE_WRITEBACKS,
+            ),
+        ):
+            if hits in counters:
+                hits, misses = counters[hits], counters[misses]
+                dirty = f" ({counters[writebacks]} dirty)" if writebacks else ""
+                caches += (
+                    f"{cache} {hits / max(hits + misses, 1):.1%} hits, "
+                    f"{counters[evictions]} evictions{dirty}; "
                 )
+        mispredicts = (
+            f"{counters[Counter.MISPREDICTS]} mispredicts, "
+            if Counter.MISPREDICTS in counters
+            else ""
+        )
+        return (
+            f"CPI {self.cpi:.2f} ({instret} instructions in {cycles} cycles; "
+            f"stalls: {flushes} flush, "
+            + "".join(f"{count} {label}, " for label, count in stalls.items())
+            + f"{cycles - instret - flushes - sum(stalls.values())} fill/drain; "
+            + caches
+            + f"{counters[Counter.BRANCHES_TAKEN]} branches taken, {mispredicts}"
+            f"{counters[Counter.LOADS]} loads, {counters[Counter.STORES]} stores)"
+        )
 
-        if self.check_pass:
-            mem = sim.inspect_mem(data_mem)
-            if 0x4000000 not in mem or mem[0x4000000] != int(
-                "".join(map(lambda i: hex(ord(i))[2:], reversed("PASS"))), 16
-            ):
-                failed = True
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "passed": self.passed,
+            "cycles": self.cycles,
+            "halt": self.halt,
+            "cpi": self.cpi,
+            "counters": self.counters,
+            "failures": [
+                {"assertion": wire, "expected": expected, "actual": actual}
+                for wire, expected, actual in self.failures
+            ],
+        }
 
-        # Use render_trace() to debug if your code doesn't work.
-        # sim_trace.render_trace()
 
-        if failed:
-            error(f"Failed!")
-        else:
-            ok("Passed!")
+class Session:
+    """Elaborates a CPU once and reuses a single simulator for many programs.
+
+    The design is built in a fresh working block and the simulator is created
+    (and, for the compiled backend, compiled) once; `Program.execute` then only
+    resets registers and reloads the memories between programs.
+
+    :param num_stages: number of pipeline stages passed to `rv_cpu`
+    :param isa: ISA extension passed to `rv_cpu`
+    :param backend: simulation backend (see `src.sim.Backend`)
+    :param inspect: names of extra wires that programs will assert on
+    :param trace: the trace retention policy (see `src.sim.Trace`)
+    :param counters: build the performance counters into the CPU
+    :param predictor: number of entries of the branch predictor passed to `rv_cpu`
+    :param icache: the icache geometry passed to `rv_cpu` (see `src.cache.CacheConfig`)
+    :param dcache: the dcache geometry passed to `rv_cpu`
+    """
+
+    def __init__(
+        self,
+        num_stages=1,
+        isa=ISA.RVI,
+        backend=Backend.INTERPRETED,
+        inspect=(),
+        trace=Trace.NONE,
+        counters=True,
+        predictor=0,
+        icache=None,
+        dcache=None,
+    ):
+        pyrtl.reset_working_block()
+        rv_cpu(
+            num_stages=num_stages,
+            isa=isa,
+            counters=counters,
+            predictor=predictor,
+            icache=icache,
+            dcache=dcache,
+        )
+
+        self.num_stages = num_stages
+        self.isa = isa
+        self.predictor = predictor
+        self.icache = icache
+        self.dcache = dcache
+        self.backend = backend
+        self.trace = trace
+        self.pipeline = PIPELINES[num_stages]
+        # Also inspect the write ports, so event logs work with every backend,
+        # and the stores, which a data cache keeps from dmem
+        ports = write_ports(get_mem("rf")) + write_ports(get_mem("dmem"))
+        self.sim = simulation(
+            backend,
+            inspect=[
+                get_wire(w) for w in (*self.pipeline.wires, *STORE, *inspect)
+            ]
+            + [wire for port in ports for wire in port]
+            + counter_wires(),
+            trace=trace,
+        )
+
+    def load(self, memory_value_map, register_value_map=None):
+        """Resets the simulator and loads new memory contents.
+
+        :param memory_value_map: map of memory block -> {address: value}
+        :param register_value_map: map of register -> initial value
+        :return: the reset simulation object
+        """
+        reset(self.sim, memory_value_map, register_value_map)
+        return self.sim
+
+
+# Each worker process of `run_parallel` elaborates its own CPU into this session,
+# and runs programs with _worker_run. Only valid inside the pool's worker
+# processes, where `_init_worker` sets them
+_worker_session = None
+_worker_run = None
+
+
+def _init_worker(num_stages, isa, backend, trace, cosim, predictor, icache, dcache):
+    global _worker_session, _worker_run
+    _worker_session = Session(
+        num_stages=num_stages,
+        isa=isa,
+        backend=backend,
+        trace=trace,
+        predictor=predictor,
+        icache=icache,
+        dcache=dcache,
+    )
+    if cosim:
+        from .cosim import cosim as _worker_run
+    else:
+        _worker_run = Program.execute
+
+
+def _run_job(job):
+    program, max_cycles = job
+    return _worker_run(
+        program, max_cycles=max_cycles, session=_worker_session, verbose=False
+    )
+
+
+def run_parallel(
+    jobs,
+    num_stages=1,
+    isa=ISA.RVI,
+    backend=Backend.INTERPRETED,
+    processes=None,
+    trace=Trace.NONE,
+    cosim=False,
+    predictor=0,
+    icache=None,
+    dcache=None,
+):
+    """Runs programs across a pool of worker processes.
+
+    Every worker builds its own `Session`, then programs are handed out one at a
+    time so that long and short programs balance across the pool.
 
-        return not failed
+    :param jobs: list of (program, max_cycles) pairs
+    :param num_stages: number of pipeline stages passed to `rv_cpu`
+    :param isa: ISA extension passed to `rv_cpu`
+    :param backend: simulation backend (see `src.sim.Backend`)
+    :param processes: number of workers (defaults to the number of cores)
+    :param trace: the trace retention policy (see `src.sim.Trace`)
+    :param cosim: run the programs in lockstep with the ISS (see `src.cosim`)
+    :param predictor: number of entries of the branch predictor passed to `rv_cpu`
+    :param icache: the icache geometry passed to `rv_cpu` (see `src.cache.CacheConfig`)
+    :param dcache: the dcache geometry passed to `rv_cpu`
+    :return: list of Results, in the same order as `jobs`
+    """
+    with multiprocessing.Pool(
+        processes,
+        initializer=_init_worker,
+        initargs=(num_stages, isa, backend, trace, cosim, predictor, icache, dcache),
+    ) as pool:
+        return pool.map(_run_job, jobs, chunksize=1)
@@ -0,0 +1,334 @@
+import ctypes
+import pyrtl
+import warnings
+from collections import deque
+from collections.abc import Mapping
+from functools import cache
+from importlib.metadata import version
+
+
+class Backend:
+    INTERPRETED = "interpreted"
+    FAST = "fast"
+    COMPILED = "compiled"
+
+
+BACKENDS = (Backend.INTERPRETED, Backend.FAST, Backend.COMPILED)
+
+
+def expose(wire):
+    """Makes a wire inspectable by every simulation backend.
+
+    CompiledSimulation can only inspect Inputs and Outputs (or wires that directly
+    drive an Output), so an internal wire gets a probe the first time it is exposed.
+
+    :param wire: the wire to expose
+    :return: the original wire
+    """
+    if isinstance(wire, (pyrtl.Input, pyrtl.Output)):
+        return wire
+    for net in pyrtl.working_block().logic_subset("w"):
+        if net.args[0] is wire and isinstance(net.dests[0], pyrtl.Output):
+            return wire
+    return pyrtl.probe(wire)
+
+
+class Trace:
+    """Trace retention policies, passed as `trace=` to `simulation`.
+
+    - `Trace.NONE` (None): record nothing
+    - `Trace.FULL` ("full"): record every named wire on every cycle
+    - a list of wire names: record only those wires
+    - an int N: record every named wire, keeping only the last N cycles
+    """
+
+    NONE = None
+    FULL = "full"
+
+
+class _RingStorage(Mapping):
+    """Trace storage that only keeps the most recent values of each wire."""
+
+    def __init__(self, wvs, cycles=None):
+        # CompiledSimulation re-initializes the storage with just the wires
+        if cycles is not None:
+            self._cycles = cycles
+        self._data = {wv.name: deque(maxlen=self._cycles) for wv in wvs}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+
+class RingTrace(pyrtl.SimulationTrace):
+    """A SimulationTrace bounded to the last `cycles` cycles.
+
+    :param cycles: number of cycles to keep
+    :param wires_to_track: same as for SimulationTrace
+    """
+
+    def __init__(self, cycles, wires_to_track=None, block=None):
+        super().__init__(wires_to_track=wires_to_track, block=block)
+        self.cycles = cycles
+        self.trace = _RingStorage(self.wires_to_track, cycles)
+
+
+def tracer(policy=Trace.NONE, backend=Backend.INTERPRETED, inspect=()):
+    """Builds the tracer for a trace retention policy (see `Trace`).
+
+    FastSimulation and CompiledSimulation only compute the values of traced wires
+    (outside of registers and Outputs), so for those backends the inspected wires
+    are always tracked, keeping only their latest value when the policy records
+    nothing.
+
+    :param policy: the trace retention policy
+    :param backend: the simulation backend the tracer is for
+    :param inspect: the wires that will be read with `sim.inspect`
+    :return: a SimulationTrace, or None
+    """
+    compiled = backend == Backend.COMPILED
+    reads_trace = backend in (Backend.FAST, Backend.COMPILED)
+    if policy is Trace.NONE:
+        return RingTrace(1, wires_to_track=list(inspect)) if reads_trace else None
+    elif policy == Trace.FULL:
+        return pyrtl.SimulationTrace()
+    elif isinstance(policy, int):
+        return RingTrace(policy)
+
+    wires = []
+    for name in policy:
+        wire = pyrtl.working_block().get_wirevector_by_name(name)
+        if wire is None:
+            raise ValueError(f"cannot trace unknown wire '{name}'")
+        wires.append(expose(wire) if compiled else wire)
+    if reads_trace:
+        names = set(policy)
+        wires += [wire for wire in inspect if wire.name not in names]
+    return pyrtl.SimulationTrace(wires_to_track=wires)
+
+
+def simulation(
+    backend=Backend.INTERPRETED,
+    memory_value_map=None,
+    inspect=(),
+    trace=Trace.NONE,
+    register_value_map=None,
+):
+    """Builds a simulation of the working block.
+
+    :param backend: one of `Backend.INTERPRETED`, `Backend.FAST` or `Backend.COMPILED`
+        (see `compiled_internals` for the PyRTL versions the latter supports)
+    :param memory_value_map: initial contents of the memories
+    :param register_value_map: initial values of registers, overriding reset values
+    :param inspect: the wires that will be read with `sim.inspect`
+    :param trace: the trace retention policy (see `Trace`)
+    :return: the simulation object
+    """
+    if backend == Backend.COMPILED:
+        inspect = [expose(wire) for wire in inspect]
+    sim_trace = tracer(trace, backend, inspect)
+
+    if backend == Backend.INTERPRETED:
+        cls = pyrtl.Simulation
+    elif backend == Backend.FAST:
+        cls = pyrtl.FastSimulation
+    elif backend == Backend.COMPILED:
+        if compiled_internals():
+            cls = _ResettableCompiledSimulation
+        else:
+            warnings.warn(
+                f"the compiled backend supports PyRTL {COMPILED_PYRTL_VERSION}, "
+                f"not {version('pyrtl')}: simulating with the fast backend instead"
+            )
+            cls = pyrtl.FastSimulation
+    else:
+        raise ValueError(f"invalid simulation backend '{backend}'")
+    return cls(
+        tracer=sim_trace,
+        memory_value_map=memory_value_map,
+        register_value_map=register_value_map,
+    )
+
+
+# The PyRTL release whose CompiledSimulation internals the compiled backend relies
+# on: `_ResettableCompiledSimulation` overrides its private code generation
+# methods, and `inspect_mem` walks the C hash map of its memories
+COMPILED_PYRTL_VERSION = "1.0.3"
+
+# The C structs of the memories that `_Node` and `_HashMap` mirror, as declared
+# by `CompiledSimulation._declare_mem_helpers` (with whitespace collapsed)
+_MEM_STRUCTS = (
+    "typedef struct node { uint64_t key; val_t *val; struct node *next; } node_t;",
+    "typedef struct hashmap { int size; int val_limbs; val_t *default_value; "
+    "node_t **list; } hashmap_t;",
+)
+
+
+@cache
+def compiled_internals():
+    """Tells if the installed PyRTL is the one the compiled backend supports.
+
+    Both the version and the layout of the memories in the generated C code must
+    match; otherwise `simulation` builds a FastSimulation for `Backend.COMPILED`.
+    """
+    if version("pyrtl") != COMPILED_PYRTL_VERSION:
+        return False
+    code = []
+    try:
+        pyrtl.CompiledSimulation._declare_mem_helpers(None, code.append)
+    except (AttributeError, TypeError):
+        return False
+    code = " ".join(" ".join(code).split())
+    return all(struct in code for struct in _MEM_STRUCTS)
+
+
+class _ResettableCompiledSimulation(pyrtl.CompiledSimulation):
+    """A CompiledSimulation whose state can be reset without recompiling.
+
+    Registers are normally `static` locals of the generated step function; here
+    they are declared as exported globals instead so they can be rewritten
+    through ctypes, and a `clear` helper is added to empty a memory.
+    """
+
+    def _declare_mem_helpers(self, write):
+        super()._declare_mem_helpers(write)
+        write("""
+            EXPORT
+            void clear(hashmap_t *h) {
+                for (int i = 0; i < h->size; i++) {
+                    node_t *node = h->list[i];
+                    while (node) {
+                        node_t *next = node->next;
+                        free(node->val);
+                        free(node);
+                        node = next;
+                    }
+                    h->list[i] = NULL;
+                }
+            }
+        """)
+
+    def _declare_wirevector(self, write, wire):
+        if not isinstance(wire, pyrtl.Register):
+            return super()._declare_wirevector(write, wire)
+        self.var_names[wire] = var_name = self._clean_name("w", wire)
+        write(f"extern uint64_t {var_name}[{self._limbs(wire)}];")
+
+    def _create_code(self, write):
+        super()._create_code(write)
+        for reg in self.block.wirevector_subset(pyrtl.Register):
+            initializer = self._make_initializer(reg, self._register_value_map[reg])
+            write("EXPORT")
+            write(f"uint64_t {self.var_names[reg]}[{self._limbs(reg)}] = {initializer};")
+
+    def reset(self, memory_value_map, register_value_map):
+        def limbs(wire, value):
+            mask = (1 << 64) - 1
+            n = self._limbs(wire)
+            return (ctypes.c_uint64 * n)(*((value >> (64 * i)) & mask for i in range(n)))
+
+        for reg, value in {**self._register_value_map, **register_value_map}.items():
+            state = (ctypes.c_uint64 * self._limbs(reg)).in_dll(
+                self._dll, self.var_names[reg]
+            )
+            state[:] = limbs(reg, value)
+
+        for mem in {net.op_param[1] for net in self.block.logic_subset("m@")}:
+            if isinstance(mem, pyrtl.RomBlock):
+                continue
+            table = ctypes.c_void_p.in_dll(self._dll, self.var_names[mem])
+            self._dll.clear(table)
+            for addr, value in memory_value_map.get(mem, {}).items():
+                self._dll.insert(table, ctypes.c_uint64(addr), limbs(mem, value))
+
+
+def reset(sim, memory_value_map=None, register_value_map=None):
+    """Puts a simulation back into its initial state so it can be reused.
+
+    Registers go back to their reset values (or `register_value_map`) and every
+    memory is emptied before being loaded from `memory_value_map`. The tracer (if
+    any) is cleared.
+
+    :param sim: the simulation object (built with `simulation`)
+    :param memory_value_map: new initial contents of the memories
+    :param register_value_map: initial values of registers, overriding reset values
+    """
+    memory_value_map = memory_value_map if memory_value_map is not None else {}
+    register_value_map = register_value_map if register_value_map is not None else {}
+
+    if isinstance(sim, _ResettableCompiledSimulation):
+        sim.reset(memory_value_map, register_value_map)
+    elif isinstance(sim, pyrtl.FastSimulation):
+        for reg in sim.block.wirevector_subset(pyrtl.Register):
+            sim.regs[reg.name] = register_value_map.get(
+                reg,
+                reg.reset_value if reg.reset_value is not None else sim.default_value,
+            )
+        sim.mems.clear()
+        sim._initialize_mems(memory_value_map)
+    elif isinstance(sim, pyrtl.Simulation):
+        sim.memvalue.clear()
+        sim._initialize(
+            register_value_map=register_value_map, memory_value_map=memory_value_map
+        )
+    else:
+        raise ValueError(f"cannot reset simulation of type {type(sim).__name__}")
+
+    if sim.tracer is not None:
+        for values in sim.tracer.trace.values():
+            values.clear()
+
+
+# Mirrors the `hashmap_t` and `node_t` structs that CompiledSimulation uses to
+# store memories, so that their written addresses can be enumerated.
+class _Node(ctypes.Structure):
+    pass
+
+
+_Node._fields_ = [
+    ("key", ctypes.c_uint64),
+    ("val", ctypes.POINTER(ctypes.c_uint64)),
+    ("next", ctypes.POINTER(_Node)),
+]
+
+
+class _HashMap(ctypes.Structure):
+    _fields_ = [
+        ("size", ctypes.c_int),
+        ("val_limbs", ctypes.c_int),
+        ("default_value", ctypes.POINTER(ctypes.c_uint64)),
+        ("list", ctypes.POINTER(ctypes.POINTER(_Node))),
+    ]
+
+
+def inspect_mem(sim, mem):
+    """Returns the written contents of a memory as a dict, for any backend.
+
+    `CompiledSimulation.inspect_mem` returns a view that pretends every one of the
+    2**addrwidth addresses is present, which makes it useless for comparing
+    against an expected dict. Walk the hash map instead so that all backends
+    report exactly the addresses that were initialized or written.
+
+    :param sim: the simulation object
+    :param mem: the memory block to inspect
+    :return: dict of address -> value
+    """
+    if not isinstance(sim, pyrtl.CompiledSimulation):
+        return sim.inspect_mem(mem)
+
+    table = ctypes.POINTER(_HashMap).in_dll(sim._dll, sim.var_names[mem]).contents
+    contents = {}
+    for i in range(table.size):
+        node = table.list[i]
+        while node:
+            value = 0
+            for limb in reversed(range(table.val_limbs)):
+                value = (value << 64) | node.contents.val[limb]
+            contents[node.contents.key] = value
+            node = node.contents.next
+    return contents
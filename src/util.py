@@ -15,3 +15,17 @@ def add_register(wire, bitwidth=None, name="", block=None):
     register = pyrtl.Register(bitwidth=bitwidth, name=name, block=block)
     register.next <<= wire
     return register
+
+
+def add_counter(event, name, bitwidth=32, block=None):
+    """Creates a counter of the cycles the event is high, driving a new Output.
+
+    The Output includes the current cycle, i.e. it shows the next counter value.
+    """
+    count = pyrtl.Register(bitwidth=bitwidth, name=name + "_reg", block=block)
+    total = pyrtl.WireVector(bitwidth=bitwidth, block=block)
+    total <<= count + event
+    count.next <<= total
+    output = pyrtl.Output(bitwidth=bitwidth, name=name, block=block)
+    output <<= total
+    return output
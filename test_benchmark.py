@@ -0,0 +1,23 @@
+import os, sys
+
+import benchmark
+
+
+def test_benchmark():
+    """Runs every case of the default benchmark once, and checks that each one
+    elaborates, synthesizes and emits its IR.
+    """
+    results = benchmark.run(processes=os.cpu_count() or 1)
+    errors = {name: case["error"] for name, case in results["cases"].items() if "error" in case}
+    assert set(results["cases"]) == {name for name, _, _ in benchmark.CASES}
+    assert not errors, errors
+
+
+if __name__ == "__main__":
+    try:
+        test_benchmark()
+    except AssertionError as e:
+        print(e)
+        print("Benchmark failed")
+        sys.exit(1)
+    print("Benchmark passed")
@@ -0,0 +1,31 @@
+import sys
+
+from src import Session
+from src.cosim import cosim
+from src.cpu import ISA
+from test_cpu import benchmarks, isa_tests
+
+
+def test_cosim(stages=(1, 3), isas=(ISA.ZBKB, ISA.ZBKC)):
+    """Runs the benchmarks and the tests of each ISA extension in lockstep with
+    the ISS, on the 1- and 3-stage CPUs elaborated with that extension.
+    """
+    failures = []
+    for num_stages in stages:
+        for isa in isas:
+            session = Session(num_stages=num_stages, isa=isa)
+            for program in benchmarks + isa_tests[isa]:
+                result = cosim(program, max_cycles=256, session=session, verbose=False)
+                if not result.passed:
+                    failures.append(f"{program.name} on {num_stages} stages with -e {isa}")
+    assert not failures, failures
+
+
+if __name__ == "__main__":
+    try:
+        test_cosim()
+    except AssertionError as e:
+        print("\n".join(e.args[0]))
+        print("Co-simulation failed")
+        sys.exit(1)
+    print("Co-simulation passed")
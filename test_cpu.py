@@ -1,9 +1,13 @@
-import pyrtl, sys
+import pyrtl, sys, json
 from argparse import ArgumentParser
 from os import listdir
 from os.path import isfile, join, splitext
 
-from src import Program, rv_cpu
+from src import Program, Session, rv_cpu
+from src.cache import CacheConfig
+from src.cosim import cosim
+from src.program import run_parallel, warning
+from src.sim import BACKENDS
 
 # A set of hand-written smoke tests
 benchmarks = [
@@ -244,6 +248,62 @@ benchmarks = [
         rf={10: 666, 11: 36, 12: 666},
         dmem={},
     ),
+    # Test that a store of zero overwrites memory, with or without a data cache
+    Program(
+        name="store_zero",
+        instructions=[
+            # main:
+            0x00100513,  # addi a0, zero, 1
+            0x00A02223,  # sw a0, 4(zero)
+            0x00002223,  # sw zero, 4(zero)
+            0x00402583,  # lw a1, 4(zero)
+            # exit:
+        ],
+        rf={10: 1, 11: 0},
+        dmem={1: 0},
+    ),
+    # Test stores to addresses that share a set of any small data cache, so
+    # that dirty lines are written back when evicted and read again
+    Program(
+        name="evict",
+        instructions=[
+            # main:
+            0x00100513,  # addi a0, zero, 1
+            0x00200593,  # addi a1, zero, 2
+            0x00300613,  # addi a2, zero, 3
+            0x00400693,  # addi a3, zero, 4
+            0x00500713,  # addi a4, zero, 5
+            0x00001437,  # lui s0, 1
+            0x00A02023,  # sw a0, 0(zero)
+            0x40B02023,  # sw a1, 1024(zero)
+            0xC0C42023,  # sw a2, -1024(s0)
+            0x00D42023,  # sw a3, 0(s0)
+            0x40E42023,  # sw a4, 1024(s0)
+            0x00002283,  # lw t0, 0(zero)
+            0x40002303,  # lw t1, 1024(zero)
+            0xC0042383,  # lw t2, -1024(s0)
+            0x00042783,  # lw a5, 0(s0)
+            0x40042803,  # lw a6, 1024(s0)
+            0x40002023,  # sw zero, 1024(zero)
+            0x40002883,  # lw a7, 1024(zero)
+            # exit:
+        ],
+        rf={
+            5: 1,
+            6: 2,
+            7: 3,
+            8: 0x1000,
+            10: 1,
+            11: 2,
+            12: 3,
+            13: 4,
+            14: 5,
+            15: 4,
+            16: 5,
+            17: 0,
+        },
+        dmem={0: 1, 256: 0, 768: 3, 1024: 4, 1280: 5},
+    ),
     # Test system calls, NOT!
     # Program(
     #     name="exception",
@@ -274,28 +334,131 @@ benchmarks = [
 TEST_DIR = "test/bin/"
 TEST_EXT = ".o"
 
-# A set of riscv programs from openpiton
-tests = []
-for test in map(
-    lambda f: splitext(f)[0],
-    filter(
-        lambda f: isfile(join(TEST_DIR, f)) and splitext(f)[-1] == TEST_EXT,
-        listdir(TEST_DIR),
-    ),
-):
-    with open(join(TEST_DIR, test + TEST_EXT), "rb") as test_file:
-        tests.append(
-            Program(
-                name="inst_" + test,
-                instructions=list(
-                    map(
-                        lambda x: (x[3] << 24) + (x[2] << 16) + (x[1] << 8) + x[0],
-                        zip(*[iter(test_file.read())] * 4),
-                    )
-                ),
-                check_pass=True,
-            )
-        )
+# A set of riscv programs from openpiton, read when they are first executed
+tests = [
+    Program.from_file(join(TEST_DIR, f), name="inst_" + splitext(f)[0], check_pass=True)
+    for f in listdir(TEST_DIR)
+    if isfile(join(TEST_DIR, f)) and splitext(f)[-1] == TEST_EXT
+]
+
+# Fills the 4 ways of a set of a 2x4 data cache with dirty lines, touches the
+# first one and misses twice: the first miss evicts the least recently used
+# line with LRU, which the second one reads again, but another with PLRU
+DCACHE_POLICY = [
+    # main:
+    0x00100513,  # addi a0, zero, 1
+    0x00200593,  # addi a1, zero, 2
+    0x00300613,  # addi a2, zero, 3
+    0x00400693,  # addi a3, zero, 4
+    0x00A02023,  # sw a0, 0(zero)
+    0x00B02423,  # sw a1, 8(zero)
+    0x00C02823,  # sw a2, 16(zero)
+    0x00D02C23,  # sw a3, 24(zero)
+    0x00002283,  # lw t0, 0(zero)
+    0x02002303,  # lw t1, 32(zero)
+    0x00802383,  # lw t2, 8(zero)
+    # exit:
+]
+
+# Programs for one data cache geometry, also run when testing with it (--dcache)
+dcache_tests = {
+    "2x4x1:lru": [
+        Program(
+            name="dcache_lru",
+            instructions=DCACHE_POLICY,
+            rf={5: 1, 6: 0, 7: 2, 10: 1, 11: 2, 12: 3, 13: 4},
+            dmem={0: 1, 2: 2, 4: 3, 6: 4},
+            perf_dcache_misses=6,
+            perf_dcache_writebacks=2,
+        ),
+    ],
+    "2x4x1:plru": [
+        Program(
+            name="dcache_plru",
+            instructions=DCACHE_POLICY,
+            rf={5: 1, 6: 0, 7: 2, 10: 1, 11: 2, 12: 3, 13: 4},
+            dmem={0: 1, 2: 2, 4: 3, 6: 4},
+            perf_dcache_misses=5,
+            perf_dcache_writebacks=1,
+        ),
+    ],
+}
+
+# Operands of the extension tests: a0 = 0x12345678, a1 = 0x9abcddef, a2 = 12
+ISA_OPERANDS = [
+    # main:
+    0x12345537,  # lui a0, 0x12345
+    0x67850513,  # addi a0, a0, 0x678
+    0x9ABCE5B7,  # lui a1, 0x9abce
+    0xDEF58593,  # addi a1, a1, -0x211
+    0x00C00613,  # addi a2, zero, 12
+]
+
+# Programs for one ISA extension, also run when testing with it (-e)
+isa_tests = {
+    "b": [
+        Program(
+            name="zbkb",
+            instructions=ISA_OPERANDS
+            + [
+                0x60C516B3,  # rol a3, a0, a2
+                0x60C55733,  # ror a4, a0, a2
+                0x60455793,  # rori a5, a0, 4
+                0x40B57833,  # andn a6, a0, a1
+                0x40B568B3,  # orn a7, a0, a1
+                0x40B54933,  # xnor s2, a0, a1
+                0x08B549B3,  # pack s3, a0, a1
+                0x08B57A33,  # packh s4, a0, a1
+                0x69855A93,  # rev8 s5, a0
+                0x68755B13,  # brev8 s6, a0
+                0x08F51B93,  # zip s7, a0
+                0x08F55C13,  # unzip s8, a0
+                # exit:
+            ],
+            rf={
+                10: 0x12345678,
+                11: 0x9ABCDDEF,
+                12: 12,
+                13: 0x45678123,
+                14: 0x67812345,
+                15: 0x81234567,
+                16: 0x00000210,
+                17: 0x77777678,
+                18: 0x77777468,
+                19: 0xDDEF5678,
+                20: 0x0000EF78,
+                21: 0x78563412,
+                22: 0x482C6A1E,
+                23: 0x131C1F60,
+                24: 0x141646EC,
+            },
+            dmem={},
+        ),
+    ],
+    "c": [
+        Program(
+            name="zbkc",
+            instructions=ISA_OPERANDS
+            + [
+                0x0AB516B3,  # clmul a3, a0, a1
+                0x0AB53733,  # clmulh a4, a0, a1
+                0x0AB597B3,  # clmul a5, a1, a1
+                0x0AB5B833,  # clmulh a6, a1, a1
+                # exit:
+            ],
+            rf={
+                10: 0x12345678,
+                11: 0x9ABCDDEF,
+                12: 12,
+                13: 0xCC42A5A8,
+                14: 0x08860EA3,
+                15: 0x51515455,
+                16: 0x41444550,
+            },
+            dmem={},
+        ),
+    ],
+}
 
 if __name__ == "__main__":
     parser = ArgumentParser("Test the RISC-V CPU implementation.")
@@ -305,25 +468,126 @@ if __name__ == "__main__":
     parser.add_argument(
         "-e", "--ext", type=str, dest="extension", help="ISA extension rv(i), zbk(b), zbk(c)"
     )
+    parser.add_argument(
+        "--predictor", type=int, dest="predictor", default=0,
+        help="number of entries of the branch predictor (3 stages only, default: none)"
+    )
+    parser.add_argument(
+        "--icache", type=CacheConfig.argument, dest="icache", metavar="SETS[xWAYS[xWORDS]][:lru|plru]",
+        help="geometry of the instruction cache, e.g. 16x2x4:plru (3 stages only, default: none)"
+    )
+    parser.add_argument(
+        "--dcache", type=CacheConfig.argument, dest="dcache", metavar="SETS[xWAYS[xWORDS]][:lru|plru]",
+        help="geometry of the write-back data cache, e.g. 16x2x4 (3 stages only, default: none)"
+    )
     parser.add_argument(
         "--test", type=str, dest="test", help="name of a specific test (all by default)"
     )
     parser.add_argument(
-        "--debug", action="store_true", help="display memory on each cycle"
+        "--debug", action="store_true",
+        help="log the writes of each cycle to <program>.events.jsonl (see src/events.py)"
+    )
+    parser.add_argument(
+        "-b", "--backend", type=str, dest="backend", choices=BACKENDS,
+        default=BACKENDS[0], help="simulation backend (default: interpreted)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, dest="jobs", default=1,
+        help="number of worker processes to run programs in (default: 1)"
+    )
+    parser.add_argument(
+        "--trace", type=str, dest="trace",
+        help="trace to keep: 'full', a comma-separated list of wires, or a number N "
+        "of most recent cycles (default: none)"
+    )
+    parser.add_argument(
+        "--cosim", action="store_true",
+        help="check every instruction against the instruction-set simulator (see src/cosim.py)"
+    )
+    parser.add_argument(
+        "--json", type=str, dest="json", help="write a JSON summary of the results to this file"
     )
     args = parser.parse_args()
 
     num_stages = args.stages if args.stages is not None else 1
     extension = args.extension if args.extension is not None else 'i'
 
-    # Instantiate the CPU design
-    rv_cpu(num_stages=num_stages, isa=extension)
+    trace = args.trace
+    if trace is not None and trace != "full":
+        trace = int(trace) if trace.isdigit() else trace.split(",")
+
+    # (program, max_cycles) pairs for every selected program
+    jobs = [
+        (program, cycles)
+        for programs, cycles in (
+            (benchmarks, 256),
+            (tests, 4096),
+            (dcache_tests.get(str(args.dcache), []), 256),
+            (isa_tests.get(extension, []), 256),
+        )
+        for program in programs
+        if args.test is None or args.test == program.name
+    ]
 
     print(f"Testing {num_stages}-stage RISC-V CPU design")
-    for program in benchmarks:
-        if args.test is None or args.test == program.name:
-            program.execute(debug=args.debug)
+    if args.jobs > 1:
+        if args.debug:
+            warning("Warning: --debug is ignored with -j")
+        # Each worker instantiates its own CPU design, results come back in order
+        results = run_parallel(
+            jobs,
+            num_stages=num_stages,
+            isa=extension,
+            backend=args.backend,
+            processes=args.jobs,
+            trace=trace,
+            cosim=args.cosim,
+            predictor=args.predictor,
+            icache=args.icache,
+            dcache=args.dcache,
+        )
+        for result in results:
+            print(f"Running program {result.name}...")
+            result.report()
+    else:
+        # Instantiate the CPU design and its simulator once for all programs
+        session = Session(
+            num_stages=num_stages,
+            isa=extension,
+            backend=args.backend,
+            trace=trace,
+            predictor=args.predictor,
+            icache=args.icache,
+            dcache=args.dcache,
+        )
+        if args.cosim:
+            results = [
+                cosim(program, max_cycles=cycles, session=session)
+                for program, cycles in jobs
+            ]
+        else:
+            results = [
+                program.execute(max_cycles=cycles, debug=args.debug, session=session)
+                for program, cycles in jobs
+            ]
 
-    for program in tests:
-        if args.test is None or args.test == program.name:
-            program.execute(max_cycles=4096, debug=args.debug)
+    passed = sum(1 for result in results if result.passed)
+    print(f"{passed}/{len(results)} programs passed")
+
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(
+                {
+                    "stages": num_stages,
+                    "isa": extension,
+                    "predictor": args.predictor,
+                    "icache": str(args.icache) if args.icache else None,
+                    "dcache": str(args.dcache) if args.dcache else None,
+                    "backend": args.backend,
+                    "passed": passed,
+                    "failed": len(results) - passed,
+                    "results": [result.to_dict() for result in results],
+                },
+                json_file,
+                indent=2,
+            )
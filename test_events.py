@@ -0,0 +1,38 @@
+import os, sys, tempfile
+
+from src import Session
+from src.cache import CacheConfig
+from src.events import replay
+from src.program import get_mem, read_data_memory
+from src.sim import inspect_mem
+from test_cpu import benchmarks
+
+
+def test_replay(dcache=("2x1x1", "2x2x4", None)):
+    """Replays the event log of every benchmark on the 3-stage CPU, with and
+    without a data cache, and checks it rebuilds the final rf and memory.
+    """
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.jsonl")
+        for geometry in dcache:
+            config = CacheConfig.parse(geometry) if geometry else None
+            session = Session(num_stages=3, dcache=config)
+            for program in benchmarks:
+                program.execute(session=session, verbose=False, events=path)
+                state = replay(path)
+                if state["dmem"] != read_data_memory(session.sim):
+                    failures.append(f"{program.name} dmem with dcache {geometry}")
+                if state["rf"] != inspect_mem(session.sim, get_mem("rf")):
+                    failures.append(f"{program.name} rf with dcache {geometry}")
+    assert not failures, failures
+
+
+if __name__ == "__main__":
+    try:
+        test_replay()
+    except AssertionError as e:
+        print("\n".join(e.args[0]))
+        print("Event log replay failed")
+        sys.exit(1)
+    print("Event log replay passed")
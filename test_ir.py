@@ -0,0 +1,71 @@
+import pyrtl, sys
+import numpy as np
+
+import ir, ir_opt
+from ir_sim import BatchSimulation, random_inputs
+
+
+# A small sequential block with a memory, logic for ir_opt to remove, a strided
+# select, and a select of bit 0 of a constant, which from_block turns into a CONST
+def small_block():
+    pyrtl.reset_working_block()
+    block = pyrtl.working_block()
+    a, b, write = pyrtl.Input(8, "a"), pyrtl.Input(8, "b"), pyrtl.Input(1, "write")
+    acc = pyrtl.Register(8, "acc", reset_value=3)
+    mem = pyrtl.MemBlock(8, 2, "mem", asynchronous=True)
+
+    ones = pyrtl.WireVector(4)
+    block.add_net(pyrtl.LogicNet('s', (0, 0, 0, 0), (pyrtl.Const(1, 1),), (ones,)))
+    same = (a + b) & pyrtl.Const(0xFF, 8)  # a no-op mask, and a + b twice
+    acc.next <<= pyrtl.select(write, acc + a, (a + b) ^ mem[b[0:2]])
+    mem[a[0:2]] <<= pyrtl.MemBlock.EnabledWrite(acc, write)
+
+    out = pyrtl.Output(8, "out")
+    out <<= (same | pyrtl.concat(ones, acc[0:4] ^ b[::2])) ^ mem[acc[0:2]]
+    return block
+
+
+def test_ir(cycles=32, lanes=64, seed=0):
+    """Round trips the netlist of `small_block` through the text and binary
+    formats, then simulates it, both round trips and `ir_opt.optimize` of it in
+    lockstep, lane 0 also against PyRTL.
+    """
+    block = small_block()
+    netlist = ir.Netlist.from_block(block)
+    failures = []
+
+    text = netlist.to_text()
+    if ir.Netlist.from_text(text).to_text() != text:
+        failures.append("text round trip")
+    data = netlist.to_bytes()
+    if ir.Netlist.from_bytes(data).to_bytes() != data:
+        failures.append("binary round trip")
+
+    optimized, removed = ir_opt.optimize(netlist)
+    if not sum(removed.values()):
+        failures.append("nothing optimized")
+
+    rng = np.random.default_rng(seed)
+    netlists = (netlist, ir.Netlist.from_text(text), ir.Netlist.from_bytes(data), optimized)
+    sims = [BatchSimulation(n, lanes) for n in netlists]
+    reference = pyrtl.Simulation(tracer=None, block=block)
+    for cycle in range(cycles):
+        inputs = random_inputs(netlist, lanes, rng)
+        outputs = [sim.step(inputs) for sim in sims]
+        reference.step({name: int(values[0]) for name, values in inputs.items()})
+        for name, values in outputs[0].items():
+            if any((other[name] != values).any() for other in outputs[1:]):
+                failures.append(f"{name} differs after a round trip or optimizing at cycle {cycle}")
+            if int(values[0]) != reference.inspect(name):
+                failures.append(f"{name} differs from PyRTL at cycle {cycle}")
+    assert not failures, failures
+
+
+if __name__ == "__main__":
+    try:
+        test_ir()
+    except AssertionError as e:
+        print("\n".join(e.args[0]))
+        print("IR round trip and optimization failed")
+        sys.exit(1)
+    print("IR round trip and optimization passed")